@@ -5,10 +5,14 @@ The secret weapon that makes Multimodal Pioneer unbeatable
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterator, List, Optional, Tuple, Any
 from datetime import datetime
 import asyncio
+import json
 import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
 
 # BigFrames imports
 try:
@@ -16,6 +20,10 @@ try:
     import bigframes.ml.llm as llm
     import bigframes.ml.preprocessing as prep
     from bigframes.ml.cluster import KMeans
+    from google.cloud import bigquery
+    from google.cloud import bigquery_storage
+    from google.api_core import retry
+    from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, RetryError
     BIGFRAMES_AVAILABLE = True
 except ImportError:
     BIGFRAMES_AVAILABLE = False
@@ -23,6 +31,14 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Result columns of BigFrames text and embedding predictions, in lookup order
+PREDICTION_RESULT_COLUMNS = ('ml_generate_text_llm_result', 'ml_generate_embedding_result')
+
+# Identical leading tokens on every vision prompt let the backend reuse the prefix KV cache
+VISION_PROMPT_PREFIX = (
+    "You are a product-catalog vision analyst. Always return strict JSON. Product image follows.\n"
+)
+
 
 class BigFramesMultimodalEngine:
     """
@@ -30,22 +46,98 @@ class BigFramesMultimodalEngine:
     This is the game-changer for enterprise multimodal analytics
     """
     
-    def __init__(self, project_id: str, dataset_id: str, bucket_name: str):
+    def __init__(self, project_id: str, dataset_id: str, bucket_name: str, quantize: bool = False):
         self.project_id = project_id
         self.dataset_id = dataset_id
         self.bucket_name = bucket_name
+        self.quantize = quantize
+        self._failed_uris: List[str] = []
+        self._failed_series: List[Any] = []
+        # Per-instance memo so the cache neither outlives the engine nor is shared across engines
+        self._embed_query = lru_cache(maxsize=4096)(self._embed_query_uncached)
         
         if BIGFRAMES_AVAILABLE:
             # Configure BigFrames for maximum performance
             bigframes.options.bigquery.project = project_id
             bigframes.options.bigquery.location = "us-central1"
             bigframes.options.bigquery.max_results = 100000
+            
+            # Storage Read API clients for bulk columnar (Arrow) table reads
+            self._bq_client = bigquery.Client(project=project_id)
+            self._bqstorage_client = bigquery_storage.BigQueryReadClient()
+            
+            # Jittered exponential backoff (1s -> 60s) for rate-limited predictions
+            self._predict_retry = retry.Retry(
+                predicate=retry.if_exception_type(ResourceExhausted, ServiceUnavailable),
+                initial=1.0,
+                maximum=60.0,
+                multiplier=2.0,
+                timeout=120.0
+            )
+    
+    # Model handles are built on first use and reused across calls
+    @cached_property
+    def _vision_pro(self):
+        return llm.GeminiVisionGenerator(model_name="gemini-1.5-pro-vision-001")
+    
+    @cached_property
+    def _vision_flash(self):
+        return llm.GeminiVisionGenerator(model_name="gemini-pro-vision")
+    
+    @cached_property
+    def _embedder(self):
+        return llm.ImageEmbeddingGenerator(model_name="multimodalembedding@001")
     
-    def analyze_images_at_scale(self, table_name: str, batch_size: int = 10000) -> pd.DataFrame:
+    def _predict_safe(self, model, uris, failed_uris: Optional[List[str]] = None, **kwargs):
+        """
+        Call model.predict, retrying 429/503s; URIs that still fail are recorded and yield None
+        
+        Callers must skip the dependent step on None rather than assign it as a column.
+        `failed_uris` overrides what is recorded when `uris` is not a flat list of URIs.
+        """
+        try:
+            return self._predict_retry(model.predict)(uris, **kwargs)
+        except (RetryError, ResourceExhausted, ServiceUnavailable) as e:
+            logger.error(f"Prediction failed after retries: {e}")
+            if failed_uris is not None:
+                self._failed_uris.extend(failed_uris)
+            elif hasattr(uris, 'to_pandas'):
+                # BigFrames Series stay lazy until get_failed() asks for them
+                self._failed_series.append(uris)
+            else:
+                self._failed_uris.extend(uris.tolist() if hasattr(uris, 'tolist') else list(uris))
+            return None
+    
+    def get_failed(self) -> List[str]:
+        """
+        Image URIs whose predictions failed permanently
+        """
+        while self._failed_series:
+            self._failed_uris.extend(self._failed_series.pop(0).to_pandas().tolist())
+        return list(self._failed_uris)
+    
+    def analyze_images_at_scale(self, table_name: str, batch_size: int = 10000,
+                                columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Analyze millions of product images using BigFrames distributed processing
         
         This is the killer feature - process 1M images in 3 minutes!
+        Only `columns` (default: sku, product_name, category) are read from the product table.
+        Inside a running event loop (e.g. a notebook), await analyze_images_at_scale_async instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.analyze_images_at_scale_async(table_name, batch_size, columns))
+        raise RuntimeError(
+            "analyze_images_at_scale cannot block inside a running event loop; "
+            "use `await engine.analyze_images_at_scale_async(...)` instead"
+        )
+    
+    async def analyze_images_at_scale_async(self, table_name: str, batch_size: int = 10000,
+                                            columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Awaitable variant of analyze_images_at_scale for callers already inside an event loop
         """
         if not BIGFRAMES_AVAILABLE:
             raise ImportError("BigFrames required for scale image processing")
@@ -53,65 +145,124 @@ class BigFramesMultimodalEngine:
         print(f"🖼️ Processing images at scale with BigFrames...")
         start_time = datetime.now()
         
-        # Load object table with BigFrames
+        # Load object table with BigFrames, projecting only the columns we return
+        columns = columns or ['sku', 'product_name', 'category']
+        product_columns = ', '.join(f"p.{column}" for column in columns)
         query = f"""
         SELECT 
-            p.sku,
-            p.product_name,
-            p.brand_name,
-            p.category,
-            p.listed_color,
-            p.listed_material,
-            p.price,
-            i.uri AS image_uri,
-            i.content_type,
-            i.size_bytes,
-            i.updated
+            {product_columns},
+            i.uri AS image_uri
         FROM `{self.project_id}.{self.dataset_id}.{table_name}` p
         JOIN `{self.project_id}.{self.dataset_id}.product_images` i
         ON p.image_filename = i.name
         """
         
-        # Create BigFrames DataFrame
+        # Create BigFrames DataFrame; the join stays server-side and is paged in batch_size pages
         bdf = bigframes.read_gbq(query)
         
-        print(f"Loaded {len(bdf)} products with images")
-        
-        # Initialize Gemini Vision model for BigFrames
-        vision_model = llm.GeminiVisionGenerator(
-            model_name="gemini-1.5-pro-vision-001"
-        )
-        
-        # Analyze images in parallel batches
+        # Analyze images in pipelined batches
         print("🔄 Analyzing images with AI.ANALYZE_IMAGE...")
         
-        # Extract visual attributes
-        bdf['visual_analysis'] = vision_model.predict(
-            bdf['image_uri'],
-            prompt="Extract: colors, materials, style, condition, defects, compliance labels"
+        # Visual attributes, compliance and authenticity in a single pass per image
+        df = await self._predict_pipelined(
+            self._vision_pro,
+            self.iter_pandas_chunks(bdf, chunk_size=batch_size),
+            output_column='combined_analysis',
+            prompt=VISION_PROMPT_PREFIX + """
+            Return JSON with keys visual_analysis, compliance_check, authenticity_score.
+            visual_analysis: colors, materials, style, condition, defects, compliance labels
+            compliance_check: safety labels, age warnings, certification marks
+            authenticity_score: 0-1 float from logo quality, stitching, materials
+            """
         )
-        
-        # Check compliance
-        bdf['compliance_check'] = vision_model.predict(
-            bdf['image_uri'],
-            prompt="Check for: safety labels, age warnings, certification marks. Return JSON."
+        n = len(df)
+        print(f"Loaded {n} products with images")
+        
+        # Split the combined response back into its columns
+        parsed = df['combined_analysis'].map(self._parse_json_response)
+        df['visual_analysis'] = parsed.map(lambda d: d.get('visual_analysis'))
+        df['compliance_check'] = parsed.map(lambda d: d.get('compliance_check'))
+        df['authenticity_score'] = pd.to_numeric(
+            parsed.map(lambda d: d.get('authenticity_score')), errors='coerce'
         )
         
-        # Detect counterfeits
-        bdf['authenticity_score'] = vision_model.predict(
-            bdf['image_uri'],
-            prompt="Rate authenticity 0-1: Check logo quality, stitching, materials"
-        ).astype(float)
-        
         # Calculate processing metrics
         duration = (datetime.now() - start_time).total_seconds()
-        images_per_second = len(bdf) / duration
+        images_per_second = n / duration
         
-        print(f"✅ Processed {len(bdf)} images in {duration:.2f} seconds")
+        print(f"✅ Processed {n} images in {duration:.2f} seconds")
         print(f"⚡ Speed: {images_per_second:.0f} images/second")
-        print(f"💰 Cost: ${len(bdf) * 0.0001:.2f}")  # Estimated cost
+        print(f"💰 Cost: ${n * 0.0001:.2f}")  # Estimated cost
         
-        return bdf.to_pandas()
+        return df
+    
+    async def _predict_pipelined(self, model, pages: Iterator[pd.DataFrame], output_column: str,
+                                 prompt: str, concurrency: int = 10) -> pd.DataFrame:
+        """
+        Fetch result pages through a queue drained by up to `concurrency` generate workers,
+        so page k+1 is downloaded while earlier pages generate
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        results: List[Tuple[int, pd.DataFrame]] = []
+        
+        async def fetch_worker(executor: ThreadPoolExecutor):
+            position = 0
+            while (page := await loop.run_in_executor(executor, next, pages, None)) is not None:
+                await queue.put((position, page))
+                position += 1
+            for _ in range(concurrency):
+                await queue.put(None)
+        
+        async def generate_worker(executor: ThreadPoolExecutor):
+            while (item := await queue.get()) is not None:
+                position, page = item
+                batch_uris = page['image_uri']
+                predictions = await loop.run_in_executor(
+                    executor, lambda: self._predict_safe(model, batch_uris, prompt=prompt)
+                )
+                page[output_column] = self._prediction_values(predictions, page.index)
+                results.append((position, page))
+        
+        # Bounded fan-out keeps at most `concurrency` predict calls in flight, plus one page fetch
+        with ThreadPoolExecutor(max_workers=concurrency + 1) as executor:
+            await asyncio.gather(
+                fetch_worker(executor),
+                *(generate_worker(executor) for _ in range(concurrency))
+            )
+        if not results:
+            return pd.DataFrame(columns=['image_uri', output_column])
+        return pd.concat([page for _, page in sorted(results, key=lambda item: item[0])])
+    
+    @staticmethod
+    def _prediction_values(predictions, index: pd.Index) -> pd.Series:
+        """
+        The result column of a predict() call, aligned on the input rows (all None when it failed)
+        """
+        if predictions is None:
+            return pd.Series([None] * len(index), index=index, dtype=object)
+        if hasattr(predictions, 'to_pandas'):
+            predictions = predictions.to_pandas()
+        if isinstance(predictions, pd.DataFrame):
+            column = next(
+                (c for c in PREDICTION_RESULT_COLUMNS if c in predictions.columns),
+                predictions.columns[-1]
+            )
+            predictions = predictions[column]
+        if isinstance(predictions, pd.Series):
+            return predictions.reindex(index)
+        return pd.Series(list(predictions), index=index)
+    
+    @staticmethod
+    def _parse_json_response(text: Any) -> Dict[str, Any]:
+        """
+        Parse a model JSON response, returning an empty dict when it is malformed
+        """
+        try:
+            parsed = json.loads(text)
+        except (TypeError, ValueError):
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
     
     def multimodal_quality_control(self, products_table: str, images_table: str) -> pd.DataFrame:
         """
@@ -138,15 +289,14 @@ class BigFramesMultimodalEngine:
         
         bdf = bigframes.read_gbq(query)
         
-        # Initialize models
-        vision_model = llm.GeminiVisionGenerator(model_name="gemini-1.5-pro-vision-001")
-        text_model = llm.GeminiTextGenerator(model_name="gemini-pro")
+        vision_model = self._vision_pro
         
         # Visual QC checks
         print("Running visual quality checks...")
-        bdf['visual_qc'] = vision_model.predict(
+        visual_qc = self._predict_safe(
+            vision_model,
             bdf['image_uri'],
-            prompt="""
+            prompt=VISION_PROMPT_PREFIX + """
             Quality check this product image:
             1. Image clarity (blurry/clear)
             2. Lighting quality (poor/good)
@@ -155,78 +305,162 @@ class BigFramesMultimodalEngine:
             Return JSON with scores 0-1
             """
         )
+        if visual_qc is not None:
+            bdf['visual_qc'] = visual_qc
         
         # Text-Image consistency
         print("Checking text-image consistency...")
-        bdf['consistency_prompt'] = bdf.apply(
-            lambda row: f"Does this image match: {row['product_name']} in {row['listed_color']}?",
-            axis=1
+        bdf['consistency_prompt'] = (
+            VISION_PROMPT_PREFIX + "Does this image match: "
+            + bdf['product_name'] + " in " + bdf['listed_color'] + "?"
         )
-        bdf['consistency_check'] = vision_model.predict(
+        consistency_check = self._predict_safe(
+            vision_model,
             bdf['image_uri'],
             prompt=bdf['consistency_prompt']
         )
+        if consistency_check is not None:
+            bdf['consistency_check'] = consistency_check
+            bdf['consistency_ok'] = (bdf['consistency_check'] == 'Yes').astype('float64')
         
         # Compliance validation
         print("Validating compliance requirements...")
-        bdf['compliance_validation'] = vision_model.predict(
+        compliance_validation = self._predict_safe(
+            vision_model,
             bdf['image_uri'],
-            prompt=f"Check {bdf['category']} compliance: safety labels, warnings, certifications"
+            prompt=(
+                VISION_PROMPT_PREFIX + "Check " + bdf['category']
+                + " compliance: safety labels, warnings, certifications"
+            )
         )
+        if compliance_validation is not None:
+            bdf['compliance_validation'] = compliance_validation
+            bdf['compliance_ok'] = bdf['compliance_validation'].str.contains('compliant').astype('float64')
+        
+        # Generate QC report over the checks whose predictions succeeded
+        summary_columns = {
+            column: 'mean' for column in ('visual_qc', 'consistency_ok', 'compliance_ok')
+            if column in bdf.columns
+        }
         
-        # Generate QC report
-        qc_summary = bdf.groupby('category').agg({
-            'visual_qc': 'mean',
-            'consistency_check': lambda x: (x == 'Yes').mean(),
-            'compliance_validation': lambda x: (x.str.contains('compliant')).mean()
-        }).to_pandas()
+        # Execute the whole column chain once; the summary and the result both read the cache
+        bdf = bdf.cache()
+        if not summary_columns:
+            logger.error("All QC predictions failed; see get_failed()")
+            return bdf.to_pandas(allow_large_results=True)
+        qc_summary = bdf.groupby('category').agg(summary_columns).to_pandas(allow_large_results=True)
         
         print("\n📊 QC Summary by Category:")
         print(qc_summary)
         
-        return bdf.to_pandas()
+        return bdf.to_pandas(allow_large_results=True)
     
-    def visual_search_at_scale(self, query_image_uri: str, embeddings_table: str, k: int = 100) -> pd.DataFrame:
+    def visual_search_at_scale(self, query_image_uri: str, embeddings_table: str, k: int = 100,
+                               explain: bool = False, explain_top: int = 10) -> pd.DataFrame:
         """
         Find visually similar products across millions using BigFrames
+        
+        With `explain`, the top `explain_top` results get a `why_similar` note from one batched vision call.
         """
         if not BIGFRAMES_AVAILABLE:
             raise ImportError("BigFrames required")
         
         print(f"🔎 Visual search across millions of products...")
         
-        # Generate query embedding
-        vision_embedder = llm.ImageEmbeddingGenerator(
-            model_name="multimodalembedding@001"
-        )
-        query_embedding = vision_embedder.predict([query_image_uri])[0]
+        # Generate query embedding (memoized per image URI)
+        query_embedding = np.array(self._embed_query(query_image_uri))
         
-        # Load embeddings with BigFrames
-        bdf = bigframes.read_gbq(
-            f"SELECT * FROM `{self.project_id}.{self.dataset_id}.{embeddings_table}`"
-        )
-        
-        # Calculate similarities using vectorized operations
-        print("Computing similarities...")
-        bdf['similarity'] = bdf['image_embedding'].apply(
-            lambda e: np.dot(e, query_embedding) / (np.linalg.norm(e) * np.linalg.norm(query_embedding))
-        )
-        
-        # Get top results
-        results = bdf.nlargest(k, 'similarity')
+        # Stream embeddings as Arrow record batches over the Storage Read API
+        table = self._bq_client.get_table(f"{self.project_id}.{self.dataset_id}.{embeddings_table}")
+        df = self._bq_client.list_rows(table).to_arrow(
+            bqstorage_client=self._bqstorage_client
+        ).to_pandas(split_blocks=True, self_destruct=True)
         
-        # Add explanations
-        vision_model = llm.GeminiVisionGenerator(model_name="gemini-pro-vision")
-        results['why_similar'] = vision_model.predict(
-            results['image_uri'],
-            prompt=f"Why is this product similar to the query image? Focus on visual aspects."
-        )
+        # Nothing to rank in an empty embeddings table
+        if df.empty:
+            return df.assign(similarity=pd.Series(dtype=np.float32))
         
-        return results.to_pandas()
+        # Calculate similarities as a single matrix-vector product
+        print("Computing similarities...")
+        embeddings = np.vstack(df['image_embedding'].to_numpy()).astype(np.float32)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector)
+        
+        if self.quantize:
+            # Opt-in INT8 scoring; the codes are built from the FP32 rows already read,
+            # so this trades precision for a smaller working set rather than saving bandwidth
+            codes, scales = self._quantize_embeddings(embeddings)
+            query_codes, query_scales = self._quantize_embeddings(query_vector[np.newaxis, :])
+            raw_scores = codes.astype(np.int32) @ query_codes[0].astype(np.int32)
+            dots = self._dequantize_scores(raw_scores, scales, query_scales[0])
+            norms = np.linalg.norm(codes, axis=1) * scales / 127
+            del embeddings
+        else:
+            dots = embeddings @ query_vector
+            norms = np.linalg.norm(embeddings, axis=1)
+        similarity = dots / norms
+        
+        # Get top results: O(N) partition, then sort only the k survivors
+        k = min(k, len(similarity))
+        top_idx = np.argpartition(-similarity, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-similarity[top_idx])]
+        results = df.iloc[top_idx].copy()
+        results['similarity'] = similarity[top_idx]
+        
+        # Add explanations on demand, one request for all explained results
+        if explain and len(results):
+            top_uris = results['image_uri'].head(explain_top).tolist()
+            response = self._predict_safe(
+                self._vision_flash,
+                [[query_image_uri] + top_uris],
+                failed_uris=[query_image_uri] + top_uris,
+                prompt=VISION_PROMPT_PREFIX + (
+                    f"The first image is the query; {len(top_uris)} result images follow. "
+                    "Return a JSON array of short explanations, one per result image in order, "
+                    "of why it is visually similar to the query."
+                )
+            )
+            explanations = []
+            if response is not None:
+                try:
+                    explanations = json.loads(list(response)[0])
+                except (TypeError, ValueError, IndexError):
+                    logger.warning("Could not parse similarity explanations")
+            if not isinstance(explanations, list):
+                explanations = []
+            explanations = (explanations + [None] * len(top_uris))[:len(top_uris)]
+            results['why_similar'] = explanations + [None] * (len(results) - len(top_uris))
+        
+        return results
+    
+    def _embed_query_uncached(self, uri: str) -> tuple:
+        """
+        Embed a query image once; repeated searches for the same URI skip the RPC
+        """
+        return tuple(self._predict_retry(self._embedder.predict)([uri])[0])
     
-    def counterfeit_detection_network(self, products_table: str) -> pd.DataFrame:
+    @staticmethod
+    def _quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Symmetric per-row INT8 quantization; returns the codes and max_abs scale per row
+        """
+        max_abs = np.abs(embeddings).max(axis=1)
+        max_abs[max_abs == 0] = 1.0
+        codes = np.round(embeddings / max_abs[:, np.newaxis] * 127).astype(np.int8)
+        return codes, max_abs.astype(np.float32)
+    
+    @staticmethod
+    def _dequantize_scores(raw_scores: np.ndarray, scales: np.ndarray, query_scale: float) -> np.ndarray:
+        """
+        Map int32 dot-product accumulators back to FP32 dot products
+        """
+        return raw_scores.astype(np.float32) * scales * (query_scale / (127 * 127))
+    
+    def counterfeit_detection_network(self, products_table: str) -> Iterator[pd.DataFrame]:
         """
         Build counterfeit detection network using BigFrames clustering
+        
+        Results are streamed back as pandas chunks rather than one driver-side frame.
         """
         if not BIGFRAMES_AVAILABLE:
             raise ImportError("BigFrames required")
@@ -245,23 +479,29 @@ class BigFramesMultimodalEngine:
         """
         
         bdf = bigframes.read_gbq(query)
-        
-        # Generate visual embeddings
-        embedder = llm.ImageEmbeddingGenerator(model_name="multimodalembedding@001")
-        bdf['visual_embedding'] = embedder.predict(bdf['image_uri'])
+        n_products = len(bdf)
+        if n_products == 0:
+            logger.info("No high-risk brand products to cluster")
+            return iter(())
+        
+        # Generate visual embeddings; clustering needs them, so stop if they failed
+        visual_embedding = self._predict_safe(self._embedder, bdf['image_uri'])
+        if visual_embedding is None:
+            logger.error("Embedding prediction failed; skipping counterfeit clustering")
+            return iter(())
+        bdf['visual_embedding'] = visual_embedding
         
         # Cluster products to find suspicious groups
         print("Clustering products to detect counterfeits...")
-        kmeans = KMeans(n_clusters=int(len(bdf) * 0.2))  # 20% clusters
+        kmeans = KMeans(n_clusters=self._cluster_count(n_products))
         bdf['cluster'] = kmeans.fit_predict(bdf[['visual_embedding']])
         
         # Analyze each cluster for counterfeit indicators
-        vision_model = llm.GeminiVisionGenerator(model_name="gemini-1.5-pro-vision-001")
-        
         # Check authenticity markers
-        bdf['authenticity_analysis'] = vision_model.predict(
+        authenticity_analysis = self._predict_safe(
+            self._vision_pro,
             bdf['image_uri'],
-            prompt="""
+            prompt=VISION_PROMPT_PREFIX + """
             Analyze for counterfeit indicators:
             1. Logo quality and placement
             2. Material texture and quality
@@ -271,24 +511,44 @@ class BigFramesMultimodalEngine:
             Return confidence score 0-1 where 1 is definitely authentic
             """
         )
+        if authenticity_analysis is None:
+            logger.error("Authenticity prediction failed; skipping counterfeit flagging")
+            return iter(())
+        bdf['authenticity_analysis'] = authenticity_analysis
+        
+        # Flag suspicious clusters (average authenticity) in one aggregation pass
+        cluster_stats = bdf.groupby('cluster', as_index=False).agg(
+            auth_mean=('authenticity_analysis', 'mean')
+        )
+        suspicious = cluster_stats[cluster_stats['auth_mean'] < 0.5][['cluster']]
+        suspicious['counterfeit_risk'] = True
         
-        # Flag suspicious clusters
-        cluster_risk = bdf.groupby('cluster').agg({
-            'price': ['mean', 'std'],  # Price anomalies
-            'authenticity_analysis': 'mean'  # Average authenticity
-        })
-        
-        suspicious_clusters = cluster_risk[
-            cluster_risk['authenticity_analysis']['mean'] < 0.5
-        ].index
+        # Mark suspicious products with a hash join rather than an IN-list
+        bdf = bdf.merge(suspicious, on='cluster', how='left')
+        bdf['counterfeit_risk'] = bdf['counterfeit_risk'].fillna(False)
         
-        # Mark suspicious products
-        bdf['counterfeit_risk'] = bdf['cluster'].isin(suspicious_clusters)
+        # Materialize once so the totals below and the streamed pages share one execution
+        bdf = bdf.cache()
         
         print(f"⚠️ Found {bdf['counterfeit_risk'].sum()} potentially counterfeit products")
         print(f"💰 Potential revenue protection: ${bdf[bdf['counterfeit_risk']]['price'].sum():,.2f}")
         
-        return bdf.to_pandas()
+        return self.iter_pandas_chunks(bdf)
+    
+    @staticmethod
+    def _cluster_count(n_products: int) -> int:
+        """
+        ~sqrt(N) clusters keeps training O(N*sqrt(N)) instead of O(N^2) at 20% of N;
+        never more clusters than products, so small catalogs still fit
+        """
+        return min(n_products, max(64, math.isqrt(n_products)))
+    
+    @staticmethod
+    def iter_pandas_chunks(bdf, chunk_size: int = 100_000) -> Iterator[pd.DataFrame]:
+        """
+        Page a BigFrames result into pandas chunks so peak memory is O(chunk_size)
+        """
+        yield from bdf.to_pandas_batches(page_size=chunk_size, allow_large_results=True)
     
     def create_multimodal_dashboard_data(self, products_table: str) -> Dict[str, pd.DataFrame]:
         """
@@ -297,50 +557,57 @@ class BigFramesMultimodalEngine:
         if not BIGFRAMES_AVAILABLE:
             raise ImportError("BigFrames required")
         
-        dashboard_data = {}
-        
         # Overall metrics
         print("📊 Generating dashboard metrics...")
         
-        # Product quality scores
-        quality_query = f"""
-        SELECT 
-            category,
-            COUNT(*) as product_count,
-            AVG(quality_score) as avg_quality,
-            SUM(CASE WHEN quality_score < 0.5 THEN 1 ELSE 0 END) as low_quality_count,
-            AVG(price) as avg_price
-        FROM `{self.project_id}.{self.dataset_id}.{products_table}_analyzed`
-        GROUP BY category
-        """
-        dashboard_data['quality_by_category'] = bigframes.read_gbq(quality_query).to_pandas()
-        
-        # Compliance status
-        compliance_query = f"""
-        SELECT 
-            DATE(analysis_timestamp) as date,
-            SUM(compliance_pass) as compliant_products,
-            SUM(1 - compliance_pass) as non_compliant_products,
-            AVG(compliance_score) as avg_compliance_score
-        FROM `{self.project_id}.{self.dataset_id}.{products_table}_compliance`
-        GROUP BY date
-        ORDER BY date DESC
-        LIMIT 30
-        """
-        dashboard_data['compliance_trend'] = bigframes.read_gbq(compliance_query).to_pandas()
-        
-        # Counterfeit detection results
-        counterfeit_query = f"""
-        SELECT 
-            brand_name,
-            COUNT(*) as total_products,
-            SUM(counterfeit_flag) as suspected_counterfeits,
-            SUM(counterfeit_flag * price) as revenue_at_risk
-        FROM `{self.project_id}.{self.dataset_id}.{products_table}_counterfeit_check`
-        GROUP BY brand_name
-        ORDER BY revenue_at_risk DESC
-        """
-        dashboard_data['counterfeit_summary'] = bigframes.read_gbq(counterfeit_query).to_pandas()
+        queries = {
+            # Product quality scores
+            'quality_by_category': f"""
+            SELECT 
+                category,
+                COUNT(*) as product_count,
+                AVG(quality_score) as avg_quality,
+                SUM(CASE WHEN quality_score < 0.5 THEN 1 ELSE 0 END) as low_quality_count,
+                AVG(price) as avg_price
+            FROM `{self.project_id}.{self.dataset_id}.{products_table}_analyzed`
+            GROUP BY category
+            """,
+            
+            # Compliance status
+            'compliance_trend': f"""
+            SELECT 
+                DATE(analysis_timestamp) as date,
+                SUM(compliance_pass) as compliant_products,
+                SUM(1 - compliance_pass) as non_compliant_products,
+                AVG(compliance_score) as avg_compliance_score
+            FROM `{self.project_id}.{self.dataset_id}.{products_table}_compliance`
+            GROUP BY date
+            ORDER BY date DESC
+            LIMIT 30
+            """,
+            
+            # Counterfeit detection results
+            'counterfeit_summary': f"""
+            SELECT 
+                brand_name,
+                COUNT(*) as total_products,
+                SUM(counterfeit_flag) as suspected_counterfeits,
+                SUM(counterfeit_flag * price) as revenue_at_risk
+            FROM `{self.project_id}.{self.dataset_id}.{products_table}_counterfeit_check`
+            GROUP BY brand_name
+            ORDER BY revenue_at_risk DESC
+            """
+        }
+        
+        # The three jobs are independent, so run them concurrently
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = {
+                name: executor.submit(
+                    lambda q: bigframes.read_gbq(q).to_pandas(allow_large_results=True), query
+                )
+                for name, query in queries.items()
+            }
+            dashboard_data = {name: future.result() for name, future in futures.items()}
         
         return dashboard_data
     
@@ -5,17 +5,208 @@ Extracts attributes, validates quality, and detects compliance issues
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Any, Union
 from dataclasses import dataclass
 from datetime import datetime
 import re
 import json
 import logging
+import sys
+from functools import lru_cache
+from itertools import islice
+from types import MappingProxyType
+
+# Optional C Aho-Corasick automaton for multi-keyword scans
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Optional JIT for the numeric quality-scoring core
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    
+    def njit(*args, **kwargs):
+        """No-op stand-in so the scoring core runs as plain Python"""
+        return lambda func: func
+
+# Optional linear-time regex engine for patterns run over untrusted OCR / model text
+try:
+    import re2
+    RE2_AVAILABLE = True
+except ImportError:
+    RE2_AVAILABLE = False
+
+# Optional fast JSON parser for model responses
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Slotted dataclasses (no per-instance __dict__) need Python 3.10+
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
 
-@dataclass
+
+def _compile_untrusted(pattern: str):
+    """Compile with RE2 when installed (no catastrophic backtracking), else stdlib re"""
+    if RE2_AVAILABLE:
+        return re2.compile(pattern)
+    return re.compile(pattern)
+
+
+# Resolution score steps: quality >= threshold[i] earns score[i + 1]
+_RESOLUTION_THRESHOLDS = (0.4, 0.6, 0.8)
+_RESOLUTION_SCORES = (0.4, 0.6, 0.8, 1.0)
+
+# Background codes produced by QualityAnalyzer._background_code, indexing _BACKGROUND_SCORES
+_BG_NONE, _BG_NEUTRAL, _BG_DARK, _BG_OTHER = 0, 1, 2, 3
+_BACKGROUND_SCORES = (0.5, 1.0, 0.7, 0.5)
+
+# Fallback parser pattern: colors (any case) and text lines in one scan
+_FALLBACK_RE = _compile_untrusted(r'(?i:color[s]?:\s*(?P<color>[a-zA-Z]+))|text:\s*(?P<text>.+)')
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts into read-only mappings and lists into tuples, interning strings"""
+    if isinstance(value, dict):
+        return MappingProxyType({_freeze(k): _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+# Static lookup tables, built once at import and shared by every instance
+
+# Color mapping for standardization
+_COLOR_MAPPINGS = _freeze({
+    'red': ['crimson', 'scarlet', 'ruby', 'cherry', 'burgundy', 'maroon'],
+    'blue': ['navy', 'azure', 'cobalt', 'royal', 'sky', 'teal', 'turquoise'],
+    'green': ['emerald', 'forest', 'lime', 'olive', 'sage', 'mint'],
+    'black': ['charcoal', 'ebony', 'onyx', 'jet'],
+    'white': ['ivory', 'cream', 'pearl', 'snow'],
+    'brown': ['chocolate', 'coffee', 'tan', 'beige', 'khaki'],
+    'gray': ['grey', 'silver', 'charcoal', 'slate'],
+    'pink': ['rose', 'fuchsia', 'magenta', 'blush'],
+    'yellow': ['gold', 'amber', 'mustard', 'lemon'],
+    'orange': ['coral', 'peach', 'tangerine', 'rust'],
+    'purple': ['violet', 'lavender', 'plum', 'mauve']
+})
+
+# Size indicators
+_SIZE_INDICATORS = _freeze({
+    'clothing': {
+        'patterns': [r'\b(XS|S|M|L|XL|XXL|XXXL)\b', r'\b\d{1,2}[/-]\d{1,2}\b'],
+        'keywords': ['small', 'medium', 'large', 'extra large', 'petite', 'plus']
+    },
+    'shoes': {
+        'patterns': [r'\b\d{1,2}\.?\d?\b', r'\bEU\s*\d{2}\b', r'\bUK\s*\d{1,2}\b'],
+        'keywords': ['narrow', 'wide', 'regular']
+    },
+    'electronics': {
+        'patterns': [r'\d+["\']\s*(inch|in)', r'\d+\s*(gb|tb|mb)', r'\d+\s*mm'],
+        'keywords': ['compact', 'mini', 'standard', 'pro', 'max']
+    }
+})
+
+# Materials that might be detected visually
+_VISUAL_MATERIALS = _freeze({
+    'leather': ['smooth', 'textured', 'glossy'],
+    'fabric': ['woven', 'knit', 'mesh'],
+    'metal': ['shiny', 'matte', 'brushed'],
+    'plastic': ['glossy', 'matte', 'transparent'],
+    'wood': ['grain', 'polished', 'natural']
+})
+
+_COMPLIANCE_RULES = _freeze({
+    'food': {
+        'required_labels': ['ingredients', 'nutrition facts', 'allergens', 'expiry date'],
+        'certifications': ['FDA', 'USDA', 'organic', 'non-GMO'],
+        'warnings': ['contains', 'may contain', 'allergen']
+    },
+    'cosmetics': {
+        'required_labels': ['ingredients', 'usage instructions', 'warnings'],
+        'certifications': ['cruelty-free', 'vegan', 'dermatologist tested'],
+        'warnings': ['external use only', 'patch test', 'discontinue if']
+    },
+    'electronics': {
+        'required_labels': ['CE mark', 'FCC', 'voltage', 'model number'],
+        'certifications': ['UL', 'Energy Star', 'RoHS'],
+        'warnings': ['electrical hazard', 'choking hazard', 'battery warning']
+    },
+    'toys': {
+        'required_labels': ['age recommendation', 'choking hazard', 'CE mark'],
+        'certifications': ['CPSC', 'ASTM', 'EN71'],
+        'warnings': ['small parts', 'adult supervision', 'not suitable for']
+    },
+    'textiles': {
+        'required_labels': ['care instructions', 'fiber content', 'country of origin'],
+        'certifications': ['OEKO-TEX', 'GOTS', 'Fair Trade'],
+        'warnings': ['flammability', 'color fastness']
+    }
+})
+
+# Regulation behind each required label
+_REGULATIONS = _freeze({
+    'food': {
+        'ingredients': 'FDA 21 CFR 101.4',
+        'nutrition facts': 'FDA Nutrition Labeling',
+        'allergens': 'FALCPA',
+        'expiry date': 'FDA Food Code'
+    },
+    'cosmetics': {
+        'ingredients': 'FDA Fair Packaging and Labeling Act',
+        'warnings': 'FDA Cosmetic Labeling'
+    },
+    'electronics': {
+        'CE mark': 'EU Directive 2014/30/EU',
+        'FCC': 'FCC Part 15',
+        'voltage': 'IEC 60950-1'
+    },
+    'toys': {
+        'age recommendation': 'CPSC 16 CFR Part 1500',
+        'choking hazard': 'CPSIA Section 104'
+    }
+})
+
+_QUALITY_CRITERIA = _freeze({
+    'resolution': {
+        'min_width': 800,
+        'min_height': 800,
+        'optimal_width': 1500,
+        'optimal_height': 1500
+    },
+    'composition': {
+        'product_coverage': 0.7,  # Product should cover 70% of image
+        'centered': True,
+        'multiple_angles': False
+    },
+    'lighting': {
+        'brightness_range': (0.3, 0.8),
+        'contrast_range': (0.4, 0.7),
+        'no_shadows': True
+    },
+    'background': {
+        'preferred': 'white',
+        'acceptable': ['white', 'light gray', 'neutral']
+    }
+})
+
+# Keyword lists shared by the per-row and batch quality scorers
+_SHADOW_INDICATORS = _freeze(['shadow', 'dark', 'dim', 'underexposed', 'overexposed'])
+_ACCEPTABLE_BACKGROUNDS = _freeze(['white', 'gray', 'grey', 'beige', 'cream'])
+_DARK_BACKGROUNDS = _freeze(['black', 'dark'])
+
+
+@dataclass(frozen=True, **_SLOTS)
 class ImageAttribute:
     """Detected attribute from image"""
     attribute_type: str
@@ -24,7 +215,26 @@ class ImageAttribute:
     bounding_box: Optional[Dict[str, float]] = None
 
 
-@dataclass 
+@dataclass
+class AttributeBatch:
+    """Struct-of-arrays layout for many detected attributes"""
+    types: List[str]
+    values: List[str]
+    confidences: np.ndarray
+    
+    @classmethod
+    def from_attributes(cls, attributes: List[ImageAttribute]) -> 'AttributeBatch':
+        return cls(
+            types=[attr.attribute_type for attr in attributes],
+            values=[attr.value for attr in attributes],
+            confidences=np.fromiter((attr.confidence for attr in attributes), dtype=float, count=len(attributes))
+        )
+    
+    def __len__(self) -> int:
+        return len(self.types)
+
+
+@dataclass(frozen=True, **_SLOTS)
 class ComplianceIssue:
     """Compliance issue detected in image"""
     issue_type: str
@@ -34,151 +244,224 @@ class ComplianceIssue:
     fix_suggestion: str = ""
 
 
+# Category-independent compliance issues, shared by every checker
+_NO_CERTIFICATIONS_ISSUE = ComplianceIssue(
+    issue_type='no_certifications',
+    severity='major',
+    description='No certifications visible on product',
+    fix_suggestion='Consider adding relevant certifications to build trust'
+)
+_MISSING_WARNINGS_ISSUE = ComplianceIssue(
+    issue_type='missing_warnings',
+    severity='major',
+    description='Required safety warnings not visible',
+    regulation='CPSC requirements',
+    fix_suggestion='Ensure safety warnings are clearly visible in main product image'
+)
+_POOR_LABEL_VISIBILITY_ISSUE = ComplianceIssue(
+    issue_type='poor_label_visibility',
+    severity='major',
+    description='Image quality too low to verify compliance labels',
+    fix_suggestion='Upload higher resolution images with clear label visibility'
+)
+
+
+class _KeywordMatcher:
+    """
+    Find every keyword contained in a text in a single pass
+    
+    Uses an Aho-Corasick automaton when pyahocorasick is installed and falls
+    back to plain substring tests otherwise. Keywords are matched lowercase.
+    """
+    
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = tuple(dict.fromkeys(keyword.lower() for keyword in keywords))
+        self._automaton = None
+        
+        if AHOCORASICK_AVAILABLE and self.keywords:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+    
+    def find(self, text: str) -> Set[str]:
+        """Return the keywords that occur in an already-lowercased text"""
+        if self._automaton is not None:
+            return {keyword for _, keyword in self._automaton.iter(text)}
+        return {keyword for keyword in self.keywords if keyword in text}
+
+
+# Derived lookups, also built once at import
+
+# Reverse lookup: every primary and variant name -> primary (first mapping wins)
+_COLOR_INDEX = {}
+for _primary_color, _variations in _COLOR_MAPPINGS.items():
+    _COLOR_INDEX.setdefault(_primary_color, _primary_color)
+    for _variation in _variations:
+        _COLOR_INDEX.setdefault(_variation, _primary_color)
+_COLOR_INDEX = MappingProxyType(_COLOR_INDEX)
+del _primary_color, _variations, _variation
+_PRIMARY_COLOR_MATCHER = _KeywordMatcher(_COLOR_MAPPINGS)
+
+_SIZE_RES = MappingProxyType({
+    category: tuple(re.compile(pattern, re.IGNORECASE) for pattern in indicators['patterns'])
+    for category, indicators in _SIZE_INDICATORS.items()
+})
+# Capitalized phrases whose first word has 4+ letters; short words are rejected inside the scan
+_BRAND_RE = _compile_untrusted(r'\b[A-Z][A-Za-z]{3,}(?:\s+[A-Z][A-Za-z]+)*\b')
+# One alternation so OCR text is scanned once; the named group says which form matched
+_MODEL_RE = _compile_untrusted(
+    r'(?P<dash>\b[A-Z]{2,4}[-\s]?\d{3,6}\b)'     # ABC-1234
+    r'|(?P<suffix>\b\d{2,4}[A-Z]{2,4}\b)'         # 123ABC
+    r'|\bModel:?\s*(?P<model>[A-Za-z0-9-]+)\b'    # Model: XYZ
+)
+
+# One keyword trie over every category's labels, certifications and warnings;
+# shared prefixes ("contains" / "may contain") are stored once
+_COMPLIANCE_MATCHER = _KeywordMatcher(
+    keyword
+    for rules in _COMPLIANCE_RULES.values()
+    for keyword in rules['required_labels'] + rules['certifications'] + rules['warnings']
+)
+
+# One alternation regex per list: a single scan instead of one substring test per keyword
+_SHADOW_RE = re.compile('|'.join(map(re.escape, _SHADOW_INDICATORS)), re.IGNORECASE)
+_NEUTRAL_BG_RE = re.compile('|'.join(map(re.escape, _ACCEPTABLE_BACKGROUNDS)))
+_DARK_BG_RE = re.compile('|'.join(map(re.escape, _DARK_BACKGROUNDS)))
+
+# Exact-name sets: most backgrounds are a bare color name, so try O(1) membership first
+_ACCEPTABLE_BG = frozenset(_ACCEPTABLE_BACKGROUNDS)
+_DARK_BG = frozenset(_DARK_BACKGROUNDS)
+
+
 class ImageAttributeExtractor:
     """
     Extract structured attributes from product images
     """
     
     def __init__(self):
-        # Color mapping for standardization
-        self.color_mappings = {
-            'red': ['crimson', 'scarlet', 'ruby', 'cherry', 'burgundy', 'maroon'],
-            'blue': ['navy', 'azure', 'cobalt', 'royal', 'sky', 'teal', 'turquoise'],
-            'green': ['emerald', 'forest', 'lime', 'olive', 'sage', 'mint'],
-            'black': ['charcoal', 'ebony', 'onyx', 'jet'],
-            'white': ['ivory', 'cream', 'pearl', 'snow'],
-            'brown': ['chocolate', 'coffee', 'tan', 'beige', 'khaki'],
-            'gray': ['grey', 'silver', 'charcoal', 'slate'],
-            'pink': ['rose', 'fuchsia', 'magenta', 'blush'],
-            'yellow': ['gold', 'amber', 'mustard', 'lemon'],
-            'orange': ['coral', 'peach', 'tangerine', 'rust'],
-            'purple': ['violet', 'lavender', 'plum', 'mauve']
-        }
-        
-        # Size indicators
-        self.size_indicators = {
-            'clothing': {
-                'patterns': [r'\b(XS|S|M|L|XL|XXL|XXXL)\b', r'\b\d{1,2}[/-]\d{1,2}\b'],
-                'keywords': ['small', 'medium', 'large', 'extra large', 'petite', 'plus']
-            },
-            'shoes': {
-                'patterns': [r'\b\d{1,2}\.?\d?\b', r'\bEU\s*\d{2}\b', r'\bUK\s*\d{1,2}\b'],
-                'keywords': ['narrow', 'wide', 'regular']
-            },
-            'electronics': {
-                'patterns': [r'\d+["\']\s*(inch|in)', r'\d+\s*(gb|tb|mb)', r'\d+\s*mm'],
-                'keywords': ['compact', 'mini', 'standard', 'pro', 'max']
-            }
-        }
-        
+        # Shared, read-only tables (see module scope)
+        self.color_mappings = _COLOR_MAPPINGS
+        self.size_indicators = _SIZE_INDICATORS
+        self._color_index = _COLOR_INDEX
+        self._primary_color_matcher = _PRIMARY_COLOR_MATCHER
+        self._size_res = _SIZE_RES
+        self._brand_re = _BRAND_RE
+        self._model_re = _MODEL_RE
+        
+        # Catalogs repeat the same few color names; memoize per extractor
+        self._standardize_color = lru_cache(maxsize=4096)(self._standardize_color)
+        
+    def extract_all(self, image_analysis: Dict[str, Any], category: str,
+                    out: Optional[List[ImageAttribute]] = None) -> List[ImageAttribute]:
+        """
+        Color, text and material attributes in one pass
+        
+        Reads each analysis field once and appends everything to ``out`` (a new
+        list if not given) instead of building and concatenating three lists.
+        """
+        if out is None:
+            out = []
+        self._append_colors(image_analysis.get('detected_colors', []), out)
+        self._append_text_attributes(image_analysis.get('detected_text', ''), category, out)
+        self._append_materials(image_analysis.get('detected_textures', []), out)
+        return out
+    
     def extract_colors(self, image_analysis: Dict[str, Any]) -> List[ImageAttribute]:
         """Extract and standardize color attributes"""
         attributes = []
-        
-        detected_colors = image_analysis.get('detected_colors', [])
-        
+        self._append_colors(image_analysis.get('detected_colors', []), attributes)
+        return attributes
+    
+    def extract_text_attributes(self, image_analysis: Dict[str, Any], category: str) -> List[ImageAttribute]:
+        """Extract attributes from visible text in image"""
+        attributes = []
+        self._append_text_attributes(image_analysis.get('detected_text', ''), category, attributes)
+        return attributes
+    
+    def extract_material_textures(self, image_analysis: Dict[str, Any]) -> List[ImageAttribute]:
+        """Extract material and texture information"""
+        attributes = []
+        self._append_materials(image_analysis.get('detected_textures', []), attributes)
+        return attributes
+    
+    def _append_colors(self, detected_colors: List[str], out: List[ImageAttribute]) -> None:
         for idx, color in enumerate(detected_colors[:3]):  # Top 3 colors
             standardized_color = self._standardize_color(color)
             
             # Primary color gets higher confidence
             confidence = 0.9 if idx == 0 else (0.8 - idx * 0.1)
             
-            attributes.append(ImageAttribute(
+            out.append(ImageAttribute(
                 attribute_type='color',
                 value=standardized_color,
                 confidence=confidence
             ))
-        
-        return attributes
     
-    def extract_text_attributes(self, image_analysis: Dict[str, Any], category: str) -> List[ImageAttribute]:
-        """Extract attributes from visible text in image"""
-        attributes = []
-        
-        detected_text = image_analysis.get('detected_text', '')
+    def _append_text_attributes(self, detected_text: str, category: str,
+                                out: List[ImageAttribute]) -> None:
         if not detected_text:
-            return attributes
-        
-        # Extract brand names
-        brand_pattern = r'\b[A-Z][A-Za-z]+(?:\s+[A-Z][A-Za-z]+)*\b'
-        potential_brands = re.findall(brand_pattern, detected_text)
-        
-        for brand in potential_brands[:2]:  # Top 2 potential brands
-            if len(brand) > 3:  # Filter out small words
-                attributes.append(ImageAttribute(
-                    attribute_type='brand',
-                    value=brand,
-                    confidence=0.7
-                ))
+            return
+        
+        # Extract brand names (scan stops after the top 2)
+        for match in islice(self._brand_re.finditer(detected_text), 2):
+            out.append(ImageAttribute(
+                attribute_type='brand',
+                value=match.group(),
+                confidence=0.7
+            ))
         
         # Extract sizes based on category
-        if category in self.size_indicators:
-            for pattern in self.size_indicators[category]['patterns']:
-                sizes = re.findall(pattern, detected_text, re.IGNORECASE)
+        if category in self._size_res:
+            for pattern in self._size_res[category]:
+                sizes = pattern.findall(detected_text)
                 for size in sizes:
-                    attributes.append(ImageAttribute(
+                    out.append(ImageAttribute(
                         attribute_type='size',
                         value=size.upper(),
                         confidence=0.8
                     ))
         
         # Extract model numbers
-        model_patterns = [
-            r'\b[A-Z]{2,4}[-\s]?\d{3,6}\b',  # ABC-1234
-            r'\b\d{2,4}[A-Z]{2,4}\b',         # 123ABC
-            r'\bModel:?\s*([A-Za-z0-9-]+)\b'  # Model: XYZ
-        ]
-        
-        for pattern in model_patterns:
-            models = re.findall(pattern, detected_text)
-            for model in models:
-                attributes.append(ImageAttribute(
-                    attribute_type='model_number',
-                    value=model,
-                    confidence=0.75
-                ))
-        
-        return attributes
+        for match in self._model_re.finditer(detected_text):
+            out.append(ImageAttribute(
+                attribute_type='model_number',
+                value=match.group(match.lastgroup),
+                confidence=0.75
+            ))
     
-    def extract_material_textures(self, image_analysis: Dict[str, Any]) -> List[ImageAttribute]:
-        """Extract material and texture information"""
-        attributes = []
-        
-        # Materials that might be detected visually
-        visual_materials = {
-            'leather': ['smooth', 'textured', 'glossy'],
-            'fabric': ['woven', 'knit', 'mesh'],
-            'metal': ['shiny', 'matte', 'brushed'],
-            'plastic': ['glossy', 'matte', 'transparent'],
-            'wood': ['grain', 'polished', 'natural']
-        }
-        
-        detected_textures = image_analysis.get('detected_textures', [])
-        
+    def _append_materials(self, detected_textures: List[str], out: List[ImageAttribute]) -> None:
         for texture in detected_textures:
+            texture_lower = texture.lower()
             # Map texture to material
-            for material, indicators in visual_materials.items():
-                if any(indicator in texture.lower() for indicator in indicators):
-                    attributes.append(ImageAttribute(
+            for material, indicators in _VISUAL_MATERIALS.items():
+                if any(indicator in texture_lower for indicator in indicators):
+                    out.append(ImageAttribute(
                         attribute_type='material',
                         value=material,
                         confidence=0.6
                     ))
                     break
-        
-        return attributes
     
     def _standardize_color(self, color: str) -> str:
         """Standardize color names to primary categories"""
-        color_lower = color.lower()
+        # Model output is usually lowercase already: try it as-is before allocating a copy
+        primary = self._color_index.get(color)
+        if primary is not None:
+            return primary
         
-        for primary_color, variations in self.color_mappings.items():
-            if color_lower == primary_color or color_lower in variations:
-                return primary_color
+        color_lower = sys.intern(color.lower())
+        primary = self._color_index.get(color_lower)
+        if primary is not None:
+            return primary
         
-        # Check if color contains primary color name
+        return self._substring_fallback(color_lower, color)
+    
+    def _substring_fallback(self, color_lower: str, color: str) -> str:
+        """Map a color containing a primary color name to that primary"""
+        contained = self._primary_color_matcher.find(color_lower)
         for primary_color in self.color_mappings.keys():
-            if primary_color in color_lower:
+            if primary_color in contained:
                 return primary_color
         
         return color  # Return original if no mapping found
@@ -190,99 +473,88 @@ class ComplianceChecker:
     """
     
     def __init__(self):
-        self.compliance_rules = {
-            'food': {
-                'required_labels': ['ingredients', 'nutrition facts', 'allergens', 'expiry date'],
-                'certifications': ['FDA', 'USDA', 'organic', 'non-GMO'],
-                'warnings': ['contains', 'may contain', 'allergen']
-            },
-            'cosmetics': {
-                'required_labels': ['ingredients', 'usage instructions', 'warnings'],
-                'certifications': ['cruelty-free', 'vegan', 'dermatologist tested'],
-                'warnings': ['external use only', 'patch test', 'discontinue if']
-            },
-            'electronics': {
-                'required_labels': ['CE mark', 'FCC', 'voltage', 'model number'],
-                'certifications': ['UL', 'Energy Star', 'RoHS'],
-                'warnings': ['electrical hazard', 'choking hazard', 'battery warning']
-            },
-            'toys': {
-                'required_labels': ['age recommendation', 'choking hazard', 'CE mark'],
-                'certifications': ['CPSC', 'ASTM', 'EN71'],
-                'warnings': ['small parts', 'adult supervision', 'not suitable for']
-            },
-            'textiles': {
-                'required_labels': ['care instructions', 'fiber content', 'country of origin'],
-                'certifications': ['OEKO-TEX', 'GOTS', 'Fair Trade'],
-                'warnings': ['flammability', 'color fastness']
-            }
+        self.compliance_rules = _COMPLIANCE_RULES
+        self._matcher = _COMPLIANCE_MATCHER
+        
+        # One specialized check per category; no rule lookups per image
+        self._category_checkers = {
+            category: self._make_checker(category, rules)
+            for category, rules in self.compliance_rules.items()
         }
         
     def check_compliance(self, image_analysis: Dict[str, Any], category: str) -> List[ComplianceIssue]:
         """Check if product image meets compliance requirements"""
-        issues = []
-        
-        if category not in self.compliance_rules:
-            return issues
-        
-        rules = self.compliance_rules[category]
+        return self.check_compliance_categories(image_analysis, [category])[category]
+    
+    def check_compliance_categories(self, image_analysis: Dict[str, Any],
+                                    categories: List[str]) -> Dict[str, List[ComplianceIssue]]:
+        """Check one image against several categories, scanning its text only once"""
         detected_labels = image_analysis.get('compliance_labels', [])
         detected_text = image_analysis.get('detected_text', '').lower()
         
-        # Check required labels
-        for required_label in rules['required_labels']:
-            if not any(required_label in label.lower() for label in detected_labels):
-                # Also check in general text
-                if required_label not in detected_text:
-                    issues.append(ComplianceIssue(
-                        issue_type='missing_required_label',
-                        severity='critical',
-                        description=f"Missing required label: {required_label}",
-                        regulation=self._get_regulation(category, required_label),
-                        fix_suggestion=f"Add {required_label} to product packaging or image"
-                    ))
+        # Labels are lowercased once, as one joined text; one pass each over the
+        # label text and the general text finds every keyword
+        label_hits = self._matcher.find('\n'.join(detected_labels).lower())
+        text_hits = self._matcher.find(detected_text)
         
-        # Check for any certifications
-        found_certifications = []
-        for cert in rules['certifications']:
-            if cert.lower() in detected_text or any(cert.lower() in label.lower() for label in detected_labels):
-                found_certifications.append(cert)
-        
-        if not found_certifications and category in ['food', 'cosmetics']:
-            issues.append(ComplianceIssue(
-                issue_type='no_certifications',
-                severity='major',
-                description='No certifications visible on product',
-                fix_suggestion='Consider adding relevant certifications to build trust'
-            ))
-        
-        # Check warnings visibility
-        warnings_found = False
-        for warning in rules['warnings']:
-            if warning in detected_text:
-                warnings_found = True
-                break
-        
-        if not warnings_found and category in ['toys', 'electronics']:
-            issues.append(ComplianceIssue(
-                issue_type='missing_warnings',
-                severity='major',
-                description='Required safety warnings not visible',
-                regulation='CPSC requirements',
-                fix_suggestion='Ensure safety warnings are clearly visible in main product image'
-            ))
-        
-        # Image quality for compliance
-        quality_score = float(image_analysis.get('image_quality_score', 0))
-        if quality_score < 0.6:
-            issues.append(ComplianceIssue(
-                issue_type='poor_label_visibility',
-                severity='major',
-                description='Image quality too low to verify compliance labels',
-                fix_suggestion='Upload higher resolution images with clear label visibility'
+        return {
+            category: self._category_issues(image_analysis, category, label_hits, text_hits)
+            for category in categories
+        }
+    
+    def _category_issues(self, image_analysis: Dict[str, Any], category: str,
+                         label_hits: Set[str], text_hits: Set[str]) -> List[ComplianceIssue]:
+        """Turn keyword hits into compliance issues for one category"""
+        checker = self._category_checkers.get(category)
+        if checker is None:
+            return []
+        return checker(image_analysis, label_hits, text_hits)
+    
+    def _make_checker(self, category: str, rules: Mapping[str, Any]
+                      ) -> Callable[[Dict[str, Any], Set[str], Set[str]], List[ComplianceIssue]]:
+        """Build the issue check for one category with its rules resolved up front"""
+        # Issues are frozen, so each possible one is built once and shared
+        required = tuple(
+            (label.lower(), ComplianceIssue(
+                issue_type='missing_required_label',
+                severity='critical',
+                description=f"Missing required label: {label}",
+                regulation=self._get_regulation(category, label),
+                fix_suggestion=f"Add {label} to product packaging or image"
             ))
+            for label in rules['required_labels']
+        )
+        certifications = frozenset(cert.lower() for cert in rules['certifications'])
+        warnings = frozenset(rules['warnings'])
+        needs_certification = category in ('food', 'cosmetics')
+        needs_warning = category in ('toys', 'electronics')
+        
+        def check(image_analysis: Dict[str, Any], label_hits: Set[str],
+                  text_hits: Set[str]) -> List[ComplianceIssue]:
+            issues = []
+            
+            # Check required labels (in a detected label or in general text)
+            for keyword, issue in required:
+                if keyword not in label_hits and keyword not in text_hits:
+                    issues.append(issue)
+            
+            # Check for any certifications
+            if (needs_certification and certifications.isdisjoint(text_hits)
+                    and certifications.isdisjoint(label_hits)):
+                issues.append(_NO_CERTIFICATIONS_ISSUE)
+            
+            # Check warnings visibility
+            if needs_warning and warnings.isdisjoint(text_hits):
+                issues.append(_MISSING_WARNINGS_ISSUE)
+            
+            # Image quality for compliance
+            quality_score = float(image_analysis.get('image_quality_score', 0))
+            if quality_score < 0.6:
+                issues.append(_POOR_LABEL_VISIBILITY_ISSUE)
+            
+            return issues
         
-        return issues
+        return check
     
     def check_brand_guidelines(self, image_analysis: Dict[str, Any], brand_guidelines: Dict[str, Any]) -> List[ComplianceIssue]:
         """Check if image meets brand guidelines"""
@@ -316,29 +588,7 @@ class ComplianceChecker:
     
     def _get_regulation(self, category: str, label_type: str) -> str:
         """Get relevant regulation for missing label"""
-        regulations = {
-            'food': {
-                'ingredients': 'FDA 21 CFR 101.4',
-                'nutrition facts': 'FDA Nutrition Labeling',
-                'allergens': 'FALCPA',
-                'expiry date': 'FDA Food Code'
-            },
-            'cosmetics': {
-                'ingredients': 'FDA Fair Packaging and Labeling Act',
-                'warnings': 'FDA Cosmetic Labeling'
-            },
-            'electronics': {
-                'CE mark': 'EU Directive 2014/30/EU',
-                'FCC': 'FCC Part 15',
-                'voltage': 'IEC 60950-1'
-            },
-            'toys': {
-                'age recommendation': 'CPSC 16 CFR Part 1500',
-                'choking hazard': 'CPSIA Section 104'
-            }
-        }
-        
-        return regulations.get(category, {}).get(label_type, 'Industry Standard')
+        return _REGULATIONS.get(category, {}).get(label_type, 'Industry Standard')
 
 
 class QualityAnalyzer:
@@ -347,28 +597,13 @@ class QualityAnalyzer:
     """
     
     def __init__(self):
-        self.quality_criteria = {
-            'resolution': {
-                'min_width': 800,
-                'min_height': 800,
-                'optimal_width': 1500,
-                'optimal_height': 1500
-            },
-            'composition': {
-                'product_coverage': 0.7,  # Product should cover 70% of image
-                'centered': True,
-                'multiple_angles': False
-            },
-            'lighting': {
-                'brightness_range': (0.3, 0.8),
-                'contrast_range': (0.4, 0.7),
-                'no_shadows': True
-            },
-            'background': {
-                'preferred': 'white',
-                'acceptable': ['white', 'light gray', 'neutral']
-            }
-        }
+        self.quality_criteria = _QUALITY_CRITERIA
+        self.shadow_indicators = _SHADOW_INDICATORS
+        self.acceptable_backgrounds = _ACCEPTABLE_BACKGROUNDS
+        self.dark_backgrounds = _DARK_BACKGROUNDS
+        self._shadow_re = _SHADOW_RE
+        self._neutral_bg_re = _NEUTRAL_BG_RE
+        self._dark_bg_re = _DARK_BG_RE
         
     def analyze_quality(self, image_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Comprehensive quality analysis"""
@@ -383,25 +618,25 @@ class QualityAnalyzer:
         ai_quality = float(image_analysis.get('image_quality_score', 0))
         quality_report['metrics']['ai_quality_score'] = ai_quality
         
-        # Resolution check (simplified - would need actual dimensions)
-        resolution_score = self._check_resolution(image_analysis)
+        # Resolution (simplified - would need actual dimensions), lighting and background
+        # (a one-row batch, so single images share the batch kernel's dispatch)
+        resolution, lighting, background = _score_arrays(
+            np.array([ai_quality]),
+            np.array([float(image_analysis.get('image_quality_score', 0.5))]),
+            np.array([self._has_shadows(image_analysis)]),
+            np.array([self._background_code(image_analysis)], dtype=np.int64)
+        )
+        resolution_score = float(resolution[0])
+        lighting_score = float(lighting[0])
+        background_score = float(background[0])
         quality_report['metrics']['resolution_score'] = resolution_score
-        
-        # Lighting quality
-        lighting_score = self._check_lighting(image_analysis)
         quality_report['metrics']['lighting_score'] = lighting_score
-        
-        # Background quality
-        background_score = self._check_background(image_analysis)
         quality_report['metrics']['background_score'] = background_score
         
         # Calculate overall score
-        quality_report['overall_score'] = np.mean([
-            ai_quality,
-            resolution_score,
-            lighting_score,
-            background_score
-        ])
+        quality_report['overall_score'] = (
+            ai_quality + resolution_score + lighting_score + background_score
+        ) * 0.25
         
         # Generate issues and recommendations
         if resolution_score < 0.7:
@@ -426,84 +661,174 @@ class QualityAnalyzer:
         
         return quality_report
     
-    def _check_resolution(self, image_analysis: Dict[str, Any]) -> float:
-        """Check image resolution quality"""
-        # Simplified - would need actual image dimensions
-        # Using quality score as proxy
-        quality = float(image_analysis.get('image_quality_score', 0))
-        
-        if quality >= 0.8:
-            return 1.0
-        elif quality >= 0.6:
-            return 0.8
-        elif quality >= 0.4:
-            return 0.6
-        else:
-            return 0.4
-    
-    def _check_lighting(self, image_analysis: Dict[str, Any]) -> float:
-        """Check lighting quality"""
-        # Look for shadow indicators in analysis
-        detected_text = image_analysis.get('detected_text', '').lower()
-        full_analysis = image_analysis.get('full_analysis', '').lower()
-        
-        shadow_indicators = ['shadow', 'dark', 'dim', 'underexposed', 'overexposed']
-        has_shadows = any(indicator in full_analysis for indicator in shadow_indicators)
-        
-        base_score = float(image_analysis.get('image_quality_score', 0.5))
-        
-        if has_shadows:
-            return base_score * 0.7
-        else:
-            return min(base_score * 1.2, 1.0)
+    def _has_shadows(self, image_analysis: Dict[str, Any]) -> bool:
+        """Look for shadow indicators in the free-text analysis"""
+        return self._shadow_re.search(image_analysis.get('full_analysis', '')) is not None
     
-    def _check_background(self, image_analysis: Dict[str, Any]) -> float:
-        """Check background quality"""
+    def _background_code(self, image_analysis: Dict[str, Any]) -> int:
+        """Categorize the background color as none / neutral / dark / other"""
         detected_colors = image_analysis.get('detected_colors', [])
         
         if not detected_colors:
-            return 0.5
-        
-        # Check if background is neutral
-        acceptable_backgrounds = ['white', 'gray', 'grey', 'beige', 'cream']
+            return _BG_NONE
         
         # Assuming last color is often background
         background_color = detected_colors[-1].lower() if len(detected_colors) > 1 else detected_colors[0].lower()
         
-        if any(color in background_color for color in acceptable_backgrounds):
-            return 1.0
-        elif any(color in background_color for color in ['black', 'dark']):
-            return 0.7
+        # Exact color names resolve by set membership
+        exact = background_color.strip()
+        if exact in _ACCEPTABLE_BG:
+            return _BG_NEUTRAL
+        if exact in _DARK_BG:
+            return _BG_DARK
+        
+        # Otherwise check if background contains a neutral / dark tone
+        if self._neutral_bg_re.search(background_color):
+            return _BG_NEUTRAL
+        elif self._dark_bg_re.search(background_color):
+            return _BG_DARK
         else:
-            return 0.5
+            return _BG_OTHER
+    
+    def analyze_quality_batch(self, analyses: pd.DataFrame) -> pd.DataFrame:
+        """
+        Vectorized quality scores for a frame of parsed image analyses
+        
+        Expects the analyze_quality keys as columns (image_quality_score,
+        full_analysis, detected_colors) and returns its metrics plus
+        overall_score, one row per input row.
+        """
+        def column(name: str, default: Any) -> pd.Series:
+            if name in analyses:
+                return analyses[name]
+            return pd.Series(default, index=analyses.index)
+        
+        # String prep stays in pandas; only numeric arrays reach the scoring loop
+        raw_quality = pd.to_numeric(column('image_quality_score', np.nan), errors='coerce')
+        ai_quality = raw_quality.fillna(0.0).to_numpy(dtype=float)
+        base = raw_quality.fillna(0.5).to_numpy(dtype=float)
+        has_shadows = column('full_analysis', '').fillna('').str.contains(
+            self._shadow_re
+        ).to_numpy(dtype=bool)
+        
+        # Background: last detected color (or the only one)
+        # (missing or NaN entries count as no colors)
+        detected_colors = column('detected_colors', None)
+        has_colors = detected_colors.map(
+            lambda c: len(c) if isinstance(c, (list, tuple, np.ndarray)) else 0
+        ).to_numpy() > 0
+        background_color = detected_colors.map(
+            lambda c: str(c[-1]).lower() if isinstance(c, (list, tuple, np.ndarray)) and len(c) else ''
+        )
+        is_neutral = background_color.str.contains(self._neutral_bg_re).to_numpy(dtype=bool)
+        is_dark = background_color.str.contains(self._dark_bg_re).to_numpy(dtype=bool)
+        background_codes = np.select(
+            [~has_colors, is_neutral, is_dark], [_BG_NONE, _BG_NEUTRAL, _BG_DARK], default=_BG_OTHER
+        ).astype(np.int64)
+        
+        resolution, lighting, background = _score_arrays(ai_quality, base, has_shadows, background_codes)
+        
+        return pd.DataFrame({
+            'ai_quality_score': ai_quality,
+            'resolution_score': resolution,
+            'lighting_score': lighting,
+            'background_score': background,
+            'overall_score': (ai_quality + resolution + lighting + background) / 4
+        }, index=analyses.index)
+
+
+def _score_arrays(ai_quality: np.ndarray, lighting_base: np.ndarray, has_shadows: np.ndarray,
+                  background_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(resolution, lighting, background) score arrays, compiled when numba is installed"""
+    if NUMBA_AVAILABLE:
+        # One compiled loop over the batch
+        return _score_batch(ai_quality, lighting_base, has_shadows, background_codes)
+    
+    # Resolution: step function on the AI quality score
+    resolution = np.asarray(_RESOLUTION_SCORES)[
+        np.searchsorted(_RESOLUTION_THRESHOLDS, ai_quality, side='right')
+    ]
+    # Lighting: penalize shadows, otherwise boost (capped at 1.0)
+    lighting = np.where(has_shadows, lighting_base * 0.7, np.minimum(lighting_base * 1.2, 1.0))
+    background = np.asarray(_BACKGROUND_SCORES)[background_codes]
+    return resolution, lighting, background
+
+
+@njit(cache=True, fastmath=True)
+def _score_core(ai_quality: float, lighting_base: float, has_shadows: bool,
+                background_code: int) -> Tuple[float, float, float]:
+    """
+    Numeric quality core: (resolution, lighting, background) scores
+    
+    Only floats and ints go in, so numba can compile it when installed; all
+    string handling stays in QualityAnalyzer.
+    """
+    # Resolution: one step up per threshold reached (quality score as proxy)
+    step = 0
+    for threshold in _RESOLUTION_THRESHOLDS:
+        if ai_quality >= threshold:
+            step += 1
+    resolution_score = _RESOLUTION_SCORES[step]
+    
+    # Lighting: penalize shadows, otherwise boost (capped at 1.0)
+    if has_shadows:
+        lighting_score = lighting_base * 0.7
+    else:
+        lighting_score = min(lighting_base * 1.2, 1.0)
+    
+    return resolution_score, lighting_score, _BACKGROUND_SCORES[background_code]
+
+
+@njit(cache=True)
+def _score_batch(ai_quality: np.ndarray, lighting_base: np.ndarray, has_shadows: np.ndarray,
+                 background_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Run _score_core over a whole batch of numeric rows"""
+    n = ai_quality.shape[0]
+    resolution = np.empty(n)
+    lighting = np.empty(n)
+    background = np.empty(n)
+    for i in range(n):
+        resolution[i], lighting[i], background[i] = _score_core(
+            ai_quality[i], lighting_base[i], has_shadows[i], background_codes[i]
+        )
+    return resolution, lighting, background
 
 
 # Helper functions
 def parse_image_analysis_json(analysis_text: str) -> Dict[str, Any]:
     """Parse AI-generated analysis JSON"""
     try:
+        if ORJSON_AVAILABLE:
+            return orjson.loads(analysis_text)
         return json.loads(analysis_text)
-    except json.JSONDecodeError:
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses this
         # Fallback parsing for non-JSON responses
         logger.warning("Failed to parse as JSON, using fallback parser")
+        fields = {'color': [], 'text': []}
+        for match in _FALLBACK_RE.finditer(analysis_text):
+            fields[match.lastgroup].append(match.group(match.lastgroup))
         return {
-            'detected_colors': re.findall(r'color[s]?:\s*([a-zA-Z]+)', analysis_text, re.IGNORECASE),
-            'detected_text': re.findall(r'text:\s*(.+)', analysis_text),
+            'detected_colors': fields['color'],
+            'detected_text': fields['text'],
             'image_quality_score': 0.5,
             'brand_visibility': 'brand' in analysis_text.lower()
         }
 
 
-def aggregate_attributes(attributes: List[ImageAttribute]) -> Dict[str, List[str]]:
+def aggregate_attributes(attributes: Union[List[ImageAttribute], AttributeBatch]) -> Dict[str, List[str]]:
     """Aggregate attributes by type"""
-    aggregated = {}
+    if not isinstance(attributes, AttributeBatch):
+        attributes = AttributeBatch.from_attributes(attributes)
     
-    for attr in attributes:
-        if attr.attribute_type not in aggregated:
-            aggregated[attr.attribute_type] = []
-        
-        # Add if confidence is high enough and not duplicate
-        if attr.confidence >= 0.6 and attr.value not in aggregated[attr.attribute_type]:
-            aggregated[attr.attribute_type].append(attr.value)
+    # Every seen type gets a key, even if none of its values pass the threshold
+    aggregated = {attribute_type: [] for attribute_type in attributes.types}
+    seen = set()
+    
+    # Add if confidence is high enough and not duplicate
+    for idx in np.flatnonzero(attributes.confidences >= 0.6):
+        key = (attributes.types[idx], attributes.values[idx])
+        if key not in seen:
+            seen.add(key)
+            aggregated[key[0]].append(key[1])
     
     return aggregated
\ No newline at end of file
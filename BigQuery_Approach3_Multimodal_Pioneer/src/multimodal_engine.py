@@ -9,15 +9,62 @@ from typing import Dict, List, Optional, Any, Tuple, Union
 from dataclasses import dataclass
 from datetime import datetime
 import pandas as pd
+import google.auth
+from google.auth.credentials import Credentials
 from google.cloud import bigquery
 from google.cloud import storage
+from google.auth.transport.requests import Request as AuthRequest
+from google.api_core.exceptions import NotFound
 from google.cloud.exceptions import GoogleCloudError
 import logging
 import json
+import mimetypes
+import os
+import pathlib
 import re
+import threading
+from types import MappingProxyType
+
+# Optional BigQuery Storage Read API client for fast Arrow result downloads
+try:
+    from google.cloud import bigquery_storage
+    BQSTORAGE_AVAILABLE = True
+except ImportError:
+    BQSTORAGE_AVAILABLE = False
+
+# Optional async HTTP client for concurrent image uploads
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# str.endswith accepts a tuple: one call checks every extension
+_SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Columns of an image analysis row (see BigQueryMultimodalEngine._image_analysis_query)
+_ANALYSIS_COLUMNS = (
+    'sku', 'product_name', 'listed_color', 'category', 'brand_name', 'image_uri',
+    'primary_color', 'brand_visible', 'quality_score', 'condition', 'compliance_labels',
+    'full_analysis', 'image_hash'
+)
+
+
+def _upload_object_names(local_paths: List[str], prefix: str) -> List[str]:
+    """Object names for local files, relative to their common parent directory"""
+    if not local_paths:
+        return []
+    absolute = [os.path.abspath(path) for path in local_paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in absolute])
+    return [f"{prefix}{pathlib.Path(os.path.relpath(path, root)).as_posix()}" for path in absolute]
+
+
+# Worker threads for the *_async variants, shared by every engine so cached
+# engines don't each hold their own; keeps blocking BigQuery calls off the event loop
+_WORKER_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
 
 @dataclass
 class ImageAnalysisResult:
@@ -57,32 +104,133 @@ class BigQueryMultimodalEngine:
     for advanced e-commerce analytics and quality control
     """
     
+    # Compliance rules configuration (shared, read-only)
+    compliance_rules = MappingProxyType({
+        'has_required_labels': MappingProxyType({
+            'categories': ('food', 'cosmetics', 'electronics'),
+            'required_elements': ('ingredients', 'warnings', 'certifications')
+        }),
+        'brand_guidelines': MappingProxyType({
+            'logo_position': ('top-left', 'top-right'),
+            'color_consistency': 0.85  # 85% similarity required
+        }),
+        'image_quality': MappingProxyType({
+            'min_resolution': (800, 800),
+            'max_blur_score': 0.3,
+            'lighting_range': (0.3, 0.8)
+        })
+    })
+    
     def __init__(self, project_id: str, dataset_id: str, bucket_name: str):
         """Initialize the multimodal engine"""
         self.project_id = project_id
         self.dataset_id = dataset_id
         self.bucket_name = bucket_name
+        # The client exposes no public pool-size setting; its default pool of
+        # 10 connections covers the 8 threads of _WORKER_POOL, so keep both in step
         self.client = bigquery.Client(project=project_id)
         self.storage_client = storage.Client(project=project_id)
         self.dataset_ref = f"{project_id}.{dataset_id}"
+        self._bqstorage_client = bigquery_storage.BigQueryReadClient() if BQSTORAGE_AVAILABLE else None
+        self._pool = _WORKER_POOL
+    
+    def close(self) -> None:
+        """Close the BigQuery client's connections (the shared worker pool stays up)"""
+        self.client.close()
+    
+    def __enter__(self) -> "BigQueryMultimodalEngine":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
         
-        # Compliance rules configuration
-        self.compliance_rules = {
-            'has_required_labels': {
-                'categories': ['food', 'cosmetics', 'electronics'],
-                'required_elements': ['ingredients', 'warnings', 'certifications']
-            },
-            'brand_guidelines': {
-                'logo_position': ['top-left', 'top-right'],
-                'color_consistency': 0.85  # 85% similarity required
-            },
-            'image_quality': {
-                'min_resolution': (800, 800),
-                'max_blur_score': 0.3,
-                'lighting_range': (0.3, 0.8)
-            }
-        }
+    def submit(self, query: str, job_config: Optional[bigquery.QueryJobConfig] = None) -> bigquery.QueryJob:
+        """
+        Start a query without waiting for it
+        
+        To pipeline chained analyses, submit the next stage's query before
+        downloading the current one, so job execution overlaps the download:
+        
+            job1 = engine.submit(q1)
+            job2 = engine.submit(q2)
+            df1 = engine.job_to_dataframe(job1)
+            df2 = engine.job_to_dataframe(job2)
+        """
+        return self.client.query(query, job_config=job_config)
+    
+    def job_to_dataframe(self, job: bigquery.QueryJob) -> pd.DataFrame:
+        """Wait for a job and download its result over the Storage Read API when available"""
+        return job.to_dataframe(
+            bqstorage_client=self._bqstorage_client,
+            create_bqstorage_client=False
+        )
+    
+    def _query_to_dataframe(self, query: str,
+                            job_config: Optional[bigquery.QueryJobConfig] = None) -> pd.DataFrame:
+        """Run a query and download its result"""
+        return self.job_to_dataframe(self.submit(query, job_config))
+    
+    async def bulk_upload_images(self, local_paths: List[str], prefix: str = "product_images/",
+                                 max_concurrency: int = 32,
+                                 credentials: Optional[Credentials] = None) -> List[str]:
+        """
+        Upload local images to the engine's bucket concurrently
+        
+        Returns the gs:// URIs in input order, ready for create_object_table.
+        Each object is named by its path relative to the directory the files
+        share, so a/img.jpg and b/img.jpg upload as separate objects.
+        Uses aiohttp against the GCS upload endpoint when installed, otherwise
+        the storage client on the engine's thread pool. Without ``credentials``,
+        application default credentials are used.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        object_names = _upload_object_names(local_paths, prefix)
+        loop = asyncio.get_running_loop()
         
+        if AIOHTTP_AVAILABLE:
+            if credentials is None:
+                credentials, _ = google.auth.default(
+                    scopes=['https://www.googleapis.com/auth/devstorage.read_write']
+                )
+            refresh_lock = asyncio.Lock()
+            upload_url = f"https://storage.googleapis.com/upload/storage/v1/b/{self.bucket_name}/o"
+            
+            async def authorization() -> str:
+                # Refresh lazily so long uploads outlive a single token
+                async with refresh_lock:
+                    if not credentials.valid:
+                        await loop.run_in_executor(self._pool, credentials.refresh, AuthRequest())
+                    return f"Bearer {credentials.token}"
+            
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=64)) as session:
+                async def upload(path: str, name: str) -> None:
+                    async with semaphore:
+                        data = await loop.run_in_executor(self._pool, pathlib.Path(path).read_bytes)
+                        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                        async with session.post(
+                            upload_url,
+                            params={'uploadType': 'media', 'name': name},
+                            data=data,
+                            headers={
+                                'Authorization': await authorization(),
+                                'Content-Type': content_type
+                            }
+                        ) as response:
+                            response.raise_for_status()
+                
+                await asyncio.gather(*(upload(p, n) for p, n in zip(local_paths, object_names)))
+        else:
+            bucket = self.storage_client.bucket(self.bucket_name)
+            
+            async def upload(path: str, name: str) -> None:
+                async with semaphore:
+                    await loop.run_in_executor(self._pool, bucket.blob(name).upload_from_filename, path)
+            
+            await asyncio.gather(*(upload(p, n) for p, n in zip(local_paths, object_names)))
+        
+        logger.info(f"Uploaded {len(object_names)} images to gs://{self.bucket_name}/{prefix}")
+        return [f"gs://{self.bucket_name}/{name}" for name in object_names]
+    
     def create_object_table(self, table_name: str, image_uris: List[str]) -> str:
         """
         Create an Object Table for unstructured data
@@ -107,14 +255,31 @@ class BigQueryMultimodalEngine:
             logger.error(f"Failed to create object table: {str(e)}")
             raise
     
-    def analyze_product_images(self, product_table: str, image_table: str, limit: Optional[int] = None) -> pd.DataFrame:
+    def _image_analysis_query(self, product_table: str, image_table: str, limit: Optional[int],
+                              batch_size: int, skip_analyzed_in: Optional[str] = None) -> str:
         """
-        Analyze product images using multimodal AI
+        SQL for the per-image analysis rows
+        
+        Images are sent to the model ``batch_size`` at a time: one
+        GENERATE_TEXT call returns a JSON array with one analysis per SKU,
+        which is exploded back to one row per image and matched to its pair by
+        array position, not by the sku the model echoes. image_hash fingerprints
+        the object's MD5 (its generation when GCS has no MD5), so an image
+        re-uploaded under the same name counts as changed. With
+        ``skip_analyzed_in``, SKUs whose current image already has a row in
+        that table are left out.
         """
-        start_time = datetime.now()
-        limit_clause = f"LIMIT {limit}" if limit else ""
+        image_hash = "FARM_FINGERPRINT(CONCAT(i.uri, '#', IFNULL(i.md5_hash, CAST(i.generation AS STRING))))"
+        # A deterministic order keeps the limited pair set identical wherever the CTE is evaluated
+        limit_clause = f"ORDER BY p.sku, i.uri LIMIT {limit}" if limit else ""
+        skip_join = skip_filter = ""
+        if skip_analyzed_in:
+            skip_join = f"""LEFT JOIN `{self.dataset_ref}.{skip_analyzed_in}` done
+                ON done.sku = p.sku
+                AND done.image_hash = {image_hash}"""
+            skip_filter = "    AND done.sku IS NULL"
         
-        query = f"""
+        return f"""
         WITH product_image_pairs AS (
             SELECT 
                 p.sku,
@@ -124,25 +289,40 @@ class BigQueryMultimodalEngine:
                 p.category,
                 p.brand_name,
                 i.uri as image_uri,
-                i.content as image_content
+                i.content as image_content,
+                {image_hash} as image_hash
             FROM `{self.dataset_ref}.{product_table}` p
             JOIN `{self.dataset_ref}.{image_table}` i
                 ON p.image_filename = i.name
+            {skip_join}
             WHERE p.image_filename IS NOT NULL
+            {skip_filter}
             {limit_clause}
         ),
+        numbered_pairs AS (
+            SELECT 
+                *,
+                DIV(ROW_NUMBER() OVER (ORDER BY sku, image_uri) - 1, {batch_size}) as batch_id,
+                MOD(ROW_NUMBER() OVER (ORDER BY sku, image_uri) - 1, {batch_size}) as batch_offset
+            FROM product_image_pairs
+        ),
+        batches AS (
+            SELECT 
+                batch_id,
+                STRING_AGG(sku, ', ' ORDER BY batch_offset) as skus,
+                ARRAY_AGG(image_content ORDER BY batch_offset) as images
+            FROM numbered_pairs
+            GROUP BY batch_id
+        ),
         image_analysis AS (
             SELECT 
-                sku,
-                product_name,
-                listed_color,
-                category,
-                brand_name,
-                image_uri,
+                batch_id,
                 AI.GENERATE_TEXT(
                     MODEL `{self.dataset_ref}.gemini_vision_model`,
                     PROMPT => CONCAT(
-                        'Analyze this product image and extract the following in JSON format: ',
+                        'Analyze each of these product images, given in the order of SKUs: ', skus, '. ',
+                        'Return a JSON array with one object per image; each object has the image sku ',
+                        'plus the following: ',
                         '1. detected_colors (list of dominant colors), ',
                         '2. detected_text (any visible text/labels), ',
                         '3. product_condition (new/used/damaged), ',
@@ -152,31 +332,52 @@ class BigQueryMultimodalEngine:
                         '7. compliance_labels (list any certification marks, warnings, etc.)'
                     ),
                     STRUCT(
-                        image_content AS image,
+                        images AS image,
                         0.3 AS temperature,
                         'application/json' AS mime_type
                     )
                 ) AS analysis_result
-            FROM product_image_pairs
+            FROM batches
+        ),
+        per_image AS (
+            SELECT 
+                batch_id,
+                batch_offset,
+                item
+            FROM image_analysis
+            CROSS JOIN UNNEST(JSON_EXTRACT_ARRAY(analysis_result.text, '$')) AS item
+                WITH OFFSET AS batch_offset
         )
         SELECT 
-            sku,
-            product_name,
-            listed_color,
-            category,
-            brand_name,
-            image_uri,
-            JSON_EXTRACT_SCALAR(analysis_result.text, '$.detected_colors[0]') as primary_color,
-            JSON_EXTRACT_SCALAR(analysis_result.text, '$.brand_visibility') as brand_visible,
-            JSON_EXTRACT_SCALAR(analysis_result.text, '$.image_quality_score') as quality_score,
-            JSON_EXTRACT_SCALAR(analysis_result.text, '$.product_condition') as condition,
-            JSON_EXTRACT_ARRAY(analysis_result.text, '$.compliance_labels') as compliance_labels,
-            analysis_result.text as full_analysis
-        FROM image_analysis
+            pp.sku,
+            pp.product_name,
+            pp.listed_color,
+            pp.category,
+            pp.brand_name,
+            pp.image_uri,
+            JSON_EXTRACT_SCALAR(pi.item, '$.detected_colors[0]') as primary_color,
+            JSON_EXTRACT_SCALAR(pi.item, '$.brand_visibility') as brand_visible,
+            JSON_EXTRACT_SCALAR(pi.item, '$.image_quality_score') as quality_score,
+            JSON_EXTRACT_SCALAR(pi.item, '$.product_condition') as condition,
+            JSON_EXTRACT_ARRAY(pi.item, '$.compliance_labels') as compliance_labels,
+            pi.item as full_analysis,
+            pp.image_hash
+        FROM per_image pi
+        JOIN numbered_pairs pp
+            ON pp.batch_id = pi.batch_id
+            AND pp.batch_offset = pi.batch_offset
         """
+    
+    def analyze_product_images(self, product_table: str, image_table: str, limit: Optional[int] = None,
+                               batch_size: int = 16) -> pd.DataFrame:
+        """
+        Analyze product images using multimodal AI
+        """
+        start_time = datetime.now()
+        query = self._image_analysis_query(product_table, image_table, limit, batch_size)
         
         try:
-            results_df = self.client.query(query).to_dataframe()
+            results_df = self._query_to_dataframe(query)
             execution_time = (datetime.now() - start_time).total_seconds() * 1000
             
             logger.info(f"Analyzed {len(results_df)} images in {execution_time:.2f}ms")
@@ -186,11 +387,119 @@ class BigQueryMultimodalEngine:
             logger.error(f"Image analysis failed: {str(e)}")
             raise
     
+    def analyze_product_images_to_table(self, product_table: str, image_table: str,
+                                        image_analysis_table: str, limit: Optional[int] = None,
+                                        batch_size: int = 16, incremental: bool = True) -> str:
+        """
+        Analyze product images and write the rows to a table instead of downloading them
+        
+        Chain with create_typed_analysis_table and the validation / report
+        methods to keep the whole pipeline inside BigQuery. When the table
+        already exists and ``incremental`` is set, only SKUs that are new or
+        whose image changed are sent to the model, and their rows are merged in
+        per (sku, image_uri).
+        """
+        destination = f"{self.dataset_ref}.{image_analysis_table}"
+        
+        try:
+            if incremental and self._table_exists(destination):
+                source = self._image_analysis_query(product_table, image_table, limit, batch_size,
+                                                    skip_analyzed_in=image_analysis_table)
+                columns = ', '.join(_ANALYSIS_COLUMNS)
+                updates = ', '.join(f"{column} = S.{column}" for column in _ANALYSIS_COLUMNS)
+                query = f"""
+                MERGE `{destination}` T
+                USING (
+                    SELECT * FROM ({source})
+                    WHERE TRUE
+                    QUALIFY ROW_NUMBER() OVER (PARTITION BY sku, image_uri) = 1
+                ) S
+                ON T.sku = S.sku AND T.image_uri = S.image_uri
+                WHEN MATCHED THEN
+                    UPDATE SET {updates}
+                WHEN NOT MATCHED THEN
+                    INSERT ({columns}) VALUES ({columns})
+                """
+                self.submit(query).result()
+            else:
+                job_config = bigquery.QueryJobConfig(
+                    destination=destination,
+                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+                )
+                self.submit(self._image_analysis_query(product_table, image_table, limit, batch_size),
+                            job_config).result()
+            logger.info(f"Wrote image analysis to {image_analysis_table}")
+            return image_analysis_table
+        except GoogleCloudError as e:
+            logger.error(f"Image analysis failed: {str(e)}")
+            raise
+    
+    def _table_exists(self, table_id: str) -> bool:
+        try:
+            self.client.get_table(table_id)
+            return True
+        except NotFound:
+            return False
+    
+    def create_typed_analysis_table(self, image_analysis_table: str) -> str:
+        """
+        Materialize analyze_product_images output with typed columns
+        
+        quality_score is stored as FLOAT64 and detected_text is pulled out of
+        the JSON once, so the validation, counterfeit and report queries do
+        no casting or JSON parsing of their own.
+        """
+        typed_table = f"{image_analysis_table}_typed"
+        
+        query = f"""
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.{typed_table}` AS
+        {self._typed_analysis_select(image_analysis_table)}
+        """
+        
+        try:
+            self.client.query(query).result()
+            logger.info(f"Created typed analysis table: {typed_table}")
+            return typed_table
+        except GoogleCloudError as e:
+            logger.error(f"Failed to create typed analysis table: {str(e)}")
+            raise
+    
+    def _typed_analysis_select(self, image_analysis_table: str) -> str:
+        return f"""
+        SELECT 
+            sku,
+            image_uri,
+            primary_color,
+            brand_visible,
+            SAFE_CAST(quality_score AS FLOAT64) as quality_score,
+            condition,
+            compliance_labels,
+            JSON_EXTRACT_SCALAR(full_analysis, '$.detected_text') as detected_text,
+            full_analysis
+        FROM `{self.dataset_ref}.{image_analysis_table}`
+        """
+    
+    def _analysis_source(self, image_analysis_table: str) -> str:
+        """
+        FROM-clause source for the typed analysis columns
+        
+        Tables ending in _typed (create_typed_analysis_table output) are read
+        as they are; any other name is typed inline, so read-only callers
+        never issue metadata calls or write tables.
+        """
+        if image_analysis_table.endswith('_typed'):
+            return f"`{self.dataset_ref}.{image_analysis_table}`"
+        return f"({self._typed_analysis_select(image_analysis_table)})"
+    
     def validate_product_specifications(self, product_table: str, image_analysis_table: str) -> QualityControlResult:
         """
         Validate that product images match listed specifications
+        
+        image_analysis_table is the analyze_product_images_to_table output
+        or its create_typed_analysis_table copy (faster; no casts per run).
         """
         start_time = datetime.now()
+        analysis = self._analysis_source(image_analysis_table)
         
         query = f"""
         WITH validation_results AS (
@@ -221,7 +530,7 @@ class BigQueryMultimodalEngine:
                 
                 -- Quality validation
                 CASE 
-                    WHEN CAST(a.quality_score AS FLOAT64) >= 0.7 THEN TRUE
+                    WHEN a.quality_score >= 0.7 THEN TRUE
                     ELSE FALSE
                 END as quality_passed,
                 
@@ -234,7 +543,7 @@ class BigQueryMultimodalEngine:
                 END as compliance_passed
                 
             FROM `{self.dataset_ref}.{product_table}` p
-            LEFT JOIN `{self.dataset_ref}.{image_analysis_table}` a
+            LEFT JOIN {analysis} a
                 ON p.sku = a.sku
         ),
         summary AS (
@@ -266,7 +575,7 @@ class BigQueryMultimodalEngine:
                                    'Brand logo/name not detected in image' as details)
                         WHEN quality_passed = FALSE THEN 
                             STRUCT('low_quality_image' as issue_type, 
-                                   CONCAT('Quality score: ', quality_score) as details)
+                                   CONCAT('Quality score: ', CAST(quality_score AS STRING)) as details)
                         WHEN compliance_passed = FALSE THEN 
                             STRUCT('missing_compliance_labels' as issue_type, 
                                    CONCAT('Required for category: ', category) as details)
@@ -281,39 +590,26 @@ class BigQueryMultimodalEngine:
         )
         SELECT 
             s.*,
-            ARRAY_AGG(
-                STRUCT(i.sku, i.product_name, i.issues)
-            ) as failed_products
+            ARRAY(
+                SELECT AS STRUCT i.sku, i.product_name, issue.issue_type, issue.details
+                FROM issues i
+                CROSS JOIN UNNEST(i.issues) AS issue
+            ) as issues_found
         FROM summary s
-        CROSS JOIN issues i
-        GROUP BY s.total_products, s.color_pass, s.brand_pass, 
-                 s.quality_pass, s.compliance_pass, s.all_pass
         """
         
         try:
-            results = self.client.query(query).to_dataframe()
+            results = self._query_to_dataframe(query)
             execution_time = (datetime.now() - start_time).total_seconds() * 1000
             
             if len(results) > 0:
                 row = results.iloc[0]
                 
-                # Parse issues
-                issues_list = []
-                if 'failed_products' in row and row['failed_products']:
-                    for product in row['failed_products']:
-                        for issue in product.get('issues', []):
-                            issues_list.append({
-                                'sku': product['sku'],
-                                'product_name': product['product_name'],
-                                'issue_type': issue['issue_type'],
-                                'details': issue['details']
-                            })
-                
                 return QualityControlResult(
                     total_products=int(row['total_products']),
                     passed=int(row['all_pass']),
                     failed=int(row['total_products'] - row['all_pass']),
-                    issues_found=issues_list,
+                    issues_found=list(row['issues_found']),  # already flat sku/issue records
                     compliance_rate=float(row['all_pass'] / row['total_products']) if row['total_products'] > 0 else 0.0,
                     processing_time_ms=execution_time
                 )
@@ -331,70 +627,102 @@ class BigQueryMultimodalEngine:
             logger.error(f"Validation failed: {str(e)}")
             raise
     
+    def build_embedding_index(self, product_image_table: str) -> str:
+        """
+        Embed every product image once and index the embeddings
+        
+        visual_similarity_search reads this table, so only the query image
+        is embedded at search time. Re-run when the catalog changes.
+        """
+        embedding_table = f"{product_image_table}_embeddings"
+        
+        query = f"""
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.{embedding_table}` AS
+        SELECT 
+            p.sku,
+            p.product_name,
+            p.brand_name,
+            p.price,
+            p.category,
+            i.uri as image_uri,
+            AI.GENERATE_EMBEDDING(
+                MODEL `{self.dataset_ref}.multimodal_embedding_model`,
+                CONTENT => i.content,
+                STRUCT('IMAGE' as content_type)
+            ) AS embedding
+        FROM `{self.dataset_ref}.products` p
+        JOIN `{self.dataset_ref}.{product_image_table}` i
+            ON p.image_filename = i.name;
+        
+        CREATE VECTOR INDEX IF NOT EXISTS product_emb_idx
+        ON `{self.dataset_ref}.{embedding_table}` (embedding)
+        OPTIONS (index_type = 'IVF', distance_type = 'COSINE')
+        """
+        
+        try:
+            self.client.query(query).result()
+            logger.info(f"Built embedding index: {embedding_table}")
+            return embedding_table
+        except GoogleCloudError as e:
+            logger.error(f"Failed to build embedding index: {str(e)}")
+            raise
+    
     def visual_similarity_search(self, query_image_uri: str, product_image_table: str, top_k: int = 10) -> VisualSearchResult:
         """
         Find visually similar products using image embeddings
+        
+        Requires build_embedding_index(product_image_table) to have been run.
         """
         start_time = datetime.now()
         
+        # Fixed SQL text with parameters, so repeat searches hit BigQuery's result cache;
+        # one extra neighbour in case the query image itself is in the catalog
         query = f"""
         WITH query_embedding AS (
             SELECT AI.GENERATE_EMBEDDING(
                 MODEL `{self.dataset_ref}.multimodal_embedding_model`,
-                CONTENT => (SELECT content FROM `{self.dataset_ref}.{product_image_table}` WHERE uri = '{query_image_uri}'),
+                CONTENT => (SELECT content FROM `{self.dataset_ref}.{product_image_table}` WHERE uri = @uri),
                 STRUCT('IMAGE' as content_type)
             ) AS embedding
-        ),
-        product_embeddings AS (
-            SELECT 
-                p.sku,
-                p.product_name,
-                p.brand_name,
-                p.price,
-                p.category,
-                i.uri as image_uri,
-                AI.GENERATE_EMBEDDING(
-                    MODEL `{self.dataset_ref}.multimodal_embedding_model`,
-                    CONTENT => i.content,
-                    STRUCT('IMAGE' as content_type)
-                ) AS embedding
-            FROM `{self.dataset_ref}.products` p
-            JOIN `{self.dataset_ref}.{product_image_table}` i
-                ON p.image_filename = i.name
-            WHERE i.uri != '{query_image_uri}'
         )
         SELECT 
-            pe.sku,
-            pe.product_name,
-            pe.brand_name,
-            pe.price,
-            pe.category,
-            pe.image_uri,
-            ML.DISTANCE(qe.embedding, pe.embedding, 'COSINE') as distance,
-            1 - ML.DISTANCE(qe.embedding, pe.embedding, 'COSINE') as similarity_score
-        FROM query_embedding qe
-        CROSS JOIN product_embeddings pe
+            base.sku,
+            base.product_name,
+            base.brand_name,
+            base.price,
+            base.category,
+            base.image_uri,
+            distance,
+            1 - distance as similarity_score
+        FROM VECTOR_SEARCH(
+            TABLE `{self.dataset_ref}.{product_image_table}_embeddings`,
+            'embedding',
+            (SELECT embedding FROM query_embedding),
+            top_k => @search_k,
+            distance_type => 'COSINE'
+        )
+        WHERE base.image_uri != @uri
         ORDER BY distance ASC
-        LIMIT {top_k}
+        LIMIT @top_k
         """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter('uri', 'STRING', query_image_uri),
+                bigquery.ScalarQueryParameter('top_k', 'INT64', top_k),
+                bigquery.ScalarQueryParameter('search_k', 'INT64', top_k + 1)
+            ],
+            use_query_cache=True
+        )
         
         try:
-            results = self.client.query(query).to_dataframe()
+            results = self._query_to_dataframe(query, job_config)
             execution_time = (datetime.now() - start_time).total_seconds() * 1000
             
-            similar_products = []
-            similarity_scores = []
-            
-            for _, row in results.iterrows():
-                similar_products.append({
-                    'sku': row['sku'],
-                    'product_name': row['product_name'],
-                    'brand_name': row['brand_name'],
-                    'price': float(row['price']),
-                    'category': row['category'],
-                    'image_uri': row['image_uri']
-                })
-                similarity_scores.append(float(row['similarity_score']))
+            results['price'] = results['price'].astype(float)
+            similar_products = results[
+                ['sku', 'product_name', 'brand_name', 'price', 'category', 'image_uri']
+            ].to_dict('records')
+            similarity_scores = results['similarity_score'].astype(float).tolist()
             
             return VisualSearchResult(
                 query_image=query_image_uri,
@@ -407,12 +735,53 @@ class BigQueryMultimodalEngine:
             logger.error(f"Visual search failed: {str(e)}")
             raise
     
+    async def analyze_product_images_async(self, product_table: str, image_table: str,
+                                           limit: Optional[int] = None, batch_size: int = 16) -> pd.DataFrame:
+        """Non-blocking analyze_product_images for asyncio callers"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool, self.analyze_product_images, product_table, image_table, limit, batch_size
+        )
+    
+    async def validate_product_specifications_async(self, product_table: str,
+                                                    image_analysis_table: str) -> QualityControlResult:
+        """Non-blocking validate_product_specifications for asyncio callers"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool, self.validate_product_specifications, product_table, image_analysis_table
+        )
+    
+    async def visual_similarity_search_async(self, query_image_uri: str, product_image_table: str,
+                                             top_k: int = 10) -> VisualSearchResult:
+        """Non-blocking visual_similarity_search for asyncio callers"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool, self.visual_similarity_search, query_image_uri, product_image_table, top_k
+        )
+    
     def detect_counterfeit_products(self, product_table: str, image_analysis_table: str) -> pd.DataFrame:
         """
         Detect potential counterfeit products using visual and text analysis
+        
+        image_analysis_table is the analyze_product_images_to_table output
+        or its create_typed_analysis_table copy (faster; no casts per run).
         """
+        analysis = self._analysis_source(image_analysis_table)
         query = f"""
-        WITH authenticity_checks AS (
+        WITH price_floors AS (
+            -- 10th percentile price per brand and category, computed once
+            SELECT 
+                brand_name,
+                category,
+                APPROX_QUANTILES(price, 100)[OFFSET(10)] as p10_price
+            FROM `{self.dataset_ref}.{product_table}`
+            GROUP BY brand_name, category
+        ),
+        auth AS (
+            SELECT DISTINCT brand, authorized_seller
+            FROM `{self.dataset_ref}.authorized_sellers`
+        ),
+        authenticity_checks AS (
             SELECT 
                 p.sku,
                 p.product_name,
@@ -424,29 +793,26 @@ class BigQueryMultimodalEngine:
                 a.full_analysis,
                 
                 -- Price anomaly detection
-                p.price < (
-                    SELECT APPROX_QUANTILES(price, 100)[OFFSET(10)]  -- 10th percentile
-                    FROM `{self.dataset_ref}.{product_table}` p2
-                    WHERE p2.brand_name = p.brand_name
-                        AND p2.category = p.category
-                ) as suspiciously_cheap,
+                p.price < pf.p10_price as suspiciously_cheap,
                 
                 -- Brand verification
-                JSON_EXTRACT_SCALAR(a.full_analysis, '$.detected_text') as detected_text,
+                a.detected_text,
                 
                 -- Quality indicators
-                CAST(a.quality_score AS FLOAT64) < 0.5 as low_quality_image,
+                a.quality_score < 0.5 as low_quality_image,
                 
                 -- Seller reputation (simplified)
-                p.seller_name NOT IN (
-                    SELECT DISTINCT authorized_seller
-                    FROM `{self.dataset_ref}.authorized_sellers`
-                    WHERE brand = p.brand_name
-                ) as unauthorized_seller
+                auth.authorized_seller IS NULL as unauthorized_seller
                 
             FROM `{self.dataset_ref}.{product_table}` p
-            LEFT JOIN `{self.dataset_ref}.{image_analysis_table}` a
+            LEFT JOIN {analysis} a
                 ON p.sku = a.sku
+            LEFT JOIN price_floors pf
+                ON pf.brand_name = p.brand_name
+                AND pf.category = p.category
+            LEFT JOIN auth
+                ON auth.brand = p.brand_name
+                AND auth.authorized_seller = p.seller_name
             WHERE p.brand_name IS NOT NULL
         )
         SELECT 
@@ -483,69 +849,112 @@ class BigQueryMultimodalEngine:
             END
         """
         
-        return self.client.query(query).to_dataframe()
+        return self._query_to_dataframe(query)
     
     def generate_visual_insights_report(self, product_table: str, image_analysis_table: str) -> Dict[str, Any]:
         """
         Generate comprehensive visual insights report
-        """
-        insights = {}
         
-        # Overall image quality metrics
-        quality_query = f"""
+        All four sections come from one query over a single products/analysis
+        join; each section is returned as a JSON column. image_analysis_table
+        is the analyze_product_images_to_table output or its
+        create_typed_analysis_table copy (faster; no casts per run).
+        """
+        analysis = self._analysis_source(image_analysis_table)
+        # Cheap probe first: skip the report on an empty analysis table, and
+        # its compliance section when no products are in a regulated category
+        probe_query = f"""
         SELECT 
-            AVG(CAST(quality_score AS FLOAT64)) as avg_quality_score,
-            COUNTIF(CAST(quality_score AS FLOAT64) >= 0.8) / COUNT(*) * 100 as high_quality_pct,
-            COUNTIF(CAST(quality_score AS FLOAT64) < 0.5) / COUNT(*) * 100 as low_quality_pct
-        FROM `{self.dataset_ref}.{image_analysis_table}`
+            (SELECT COUNT(*) FROM {analysis}) as n_analyses,
+            (SELECT COUNTIF(category IN ('food', 'cosmetics', 'electronics'))
+             FROM `{self.dataset_ref}.{product_table}`) as n_regulated
         """
-        insights['image_quality'] = self.client.query(quality_query).to_dataframe().to_dict('records')[0]
+        probe = next(iter(self.client.query(probe_query).result()))
+        if probe['n_analyses'] == 0:
+            return {
+                'image_quality': {},
+                'color_accuracy': {},
+                'brand_visibility': [],
+                'compliance_by_category': []
+            }
         
-        # Color accuracy
-        color_query = f"""
+        compliance_column = (
+            "TO_JSON_STRING(ARRAY(SELECT AS STRUCT * FROM compliance))"
+            if probe['n_regulated'] > 0 else "'[]'"
+        )
+        
+        query = f"""
+        WITH analysis AS (
+            SELECT 
+                sku,
+                quality_score,
+                primary_color,
+                brand_visible,
+                compliance_labels
+            FROM {analysis}
+        ),
+        joined AS (
+            SELECT 
+                p.listed_color,
+                p.brand_name,
+                p.category,
+                a.*
+            FROM `{self.dataset_ref}.{product_table}` p
+            JOIN analysis a
+                ON p.sku = a.sku
+        ),
+        -- Overall image quality metrics
+        quality AS (
+            SELECT 
+                AVG(quality_score) as avg_quality_score,
+                COUNTIF(quality_score >= 0.8) / COUNT(*) * 100 as high_quality_pct,
+                COUNTIF(quality_score < 0.5) / COUNT(*) * 100 as low_quality_pct
+            FROM analysis
+        ),
+        -- Color accuracy
+        colors AS (
+            SELECT 
+                COUNTIF(LOWER(listed_color) = LOWER(primary_color)) / COUNT(*) * 100 as color_accuracy_pct,
+                COUNT(DISTINCT primary_color) as unique_colors_detected
+            FROM joined
+            WHERE listed_color IS NOT NULL
+        ),
+        -- Brand visibility
+        brands AS (
+            SELECT 
+                brand_name,
+                COUNT(*) as total_products,
+                COUNTIF(brand_visible = 'true') as brand_visible_count,
+                COUNTIF(brand_visible = 'true') / COUNT(*) * 100 as visibility_rate
+            FROM joined
+            WHERE brand_name IS NOT NULL
+            GROUP BY brand_name
+        ),
+        -- Compliance by category
+        compliance AS (
+            SELECT 
+                category,
+                COUNT(*) as total_products,
+                COUNTIF(ARRAY_LENGTH(compliance_labels) > 0) as has_labels,
+                COUNTIF(ARRAY_LENGTH(compliance_labels) > 0) / COUNT(*) * 100 as compliance_rate
+            FROM joined
+            WHERE category IN ('food', 'cosmetics', 'electronics')
+            GROUP BY category
+        )
         SELECT 
-            COUNTIF(LOWER(p.listed_color) = LOWER(a.primary_color)) / COUNT(*) * 100 as color_accuracy_pct,
-            COUNT(DISTINCT a.primary_color) as unique_colors_detected
-        FROM `{self.dataset_ref}.{product_table}` p
-        JOIN `{self.dataset_ref}.{image_analysis_table}` a
-            ON p.sku = a.sku
-        WHERE p.listed_color IS NOT NULL
+            TO_JSON_STRING((SELECT AS STRUCT * FROM quality)) as image_quality,
+            TO_JSON_STRING((SELECT AS STRUCT * FROM colors)) as color_accuracy,
+            TO_JSON_STRING(ARRAY(
+                SELECT AS STRUCT * FROM brands ORDER BY total_products DESC LIMIT 10
+            )) as brand_visibility,
+            {compliance_column} as compliance_by_category
         """
-        insights['color_accuracy'] = self.client.query(color_query).to_dataframe().to_dict('records')[0]
         
-        # Brand visibility
-        brand_query = f"""
-        SELECT 
-            p.brand_name,
-            COUNT(*) as total_products,
-            COUNTIF(a.brand_visible = 'true') as brand_visible_count,
-            COUNTIF(a.brand_visible = 'true') / COUNT(*) * 100 as visibility_rate
-        FROM `{self.dataset_ref}.{product_table}` p
-        JOIN `{self.dataset_ref}.{image_analysis_table}` a
-            ON p.sku = a.sku
-        WHERE p.brand_name IS NOT NULL
-        GROUP BY p.brand_name
-        ORDER BY total_products DESC
-        LIMIT 10
-        """
-        insights['brand_visibility'] = self.client.query(brand_query).to_dataframe().to_dict('records')
-        
-        # Compliance by category
-        compliance_query = f"""
-        SELECT 
-            p.category,
-            COUNT(*) as total_products,
-            COUNTIF(ARRAY_LENGTH(a.compliance_labels) > 0) as has_labels,
-            COUNTIF(ARRAY_LENGTH(a.compliance_labels) > 0) / COUNT(*) * 100 as compliance_rate
-        FROM `{self.dataset_ref}.{product_table}` p
-        JOIN `{self.dataset_ref}.{image_analysis_table}` a
-            ON p.sku = a.sku
-        WHERE p.category IN ('food', 'cosmetics', 'electronics')
-        GROUP BY p.category
-        """
-        insights['compliance_by_category'] = self.client.query(compliance_query).to_dataframe().to_dict('records')
-        
-        return insights
+        row = next(iter(self.client.query(query).result()))
+        return {
+            section: json.loads(row[section])
+            for section in ('image_quality', 'color_accuracy', 'brand_visibility', 'compliance_by_category')
+        }
     
     def create_training_dataset_for_visual_model(self, product_table: str, image_table: str) -> str:
         """
@@ -553,57 +962,51 @@ class BigQueryMultimodalEngine:
         """
         training_table = f"{product_table}_visual_training"
         
+        # Train/validation/test split assigned in the same CTAS (no UPDATE rewrite)
         query = f"""
         CREATE OR REPLACE TABLE `{self.dataset_ref}.{training_table}` AS
         SELECT 
-            p.sku,
-            p.category,
-            p.brand_name,
-            p.listed_color,
-            p.price_range,
-            i.uri as image_uri,
-            -- Create labels for supervised learning
-            STRUCT(
-                p.category as product_category,
-                p.brand_name as brand,
-                p.listed_color as color,
-                CASE 
-                    WHEN p.price < 50 THEN 'budget'
-                    WHEN p.price < 200 THEN 'mid-range'
-                    ELSE 'premium'
-                END as price_tier,
-                p.is_on_sale,
-                p.rating
-            ) as labels,
-            -- Include metadata for stratification
-            CURRENT_TIMESTAMP() as created_at,
-            FARM_FINGERPRINT(CONCAT(p.sku, CAST(CURRENT_TIMESTAMP() AS STRING))) as split_hash
-        FROM `{self.dataset_ref}.{product_table}` p
-        JOIN `{self.dataset_ref}.{image_table}` i
-            ON p.image_filename = i.name
-        WHERE i.content IS NOT NULL
-            AND p.category IS NOT NULL
-            AND p.brand_name IS NOT NULL
+            *,
+            CASE 
+                WHEN MOD(ABS(split_hash), 10) < 7 THEN 'TRAIN'
+                WHEN MOD(ABS(split_hash), 10) < 9 THEN 'VALIDATION'
+                ELSE 'TEST'
+            END as dataset_split
+        FROM (
+            SELECT 
+                p.sku,
+                p.category,
+                p.brand_name,
+                p.listed_color,
+                p.price_range,
+                i.uri as image_uri,
+                -- Create labels for supervised learning
+                STRUCT(
+                    p.category as product_category,
+                    p.brand_name as brand,
+                    p.listed_color as color,
+                    CASE 
+                        WHEN p.price < 50 THEN 'budget'
+                        WHEN p.price < 200 THEN 'mid-range'
+                        ELSE 'premium'
+                    END as price_tier,
+                    p.is_on_sale,
+                    p.rating
+                ) as labels,
+                -- Include metadata for stratification
+                CURRENT_TIMESTAMP() as created_at,
+                FARM_FINGERPRINT(CONCAT(p.sku, CAST(CURRENT_TIMESTAMP() AS STRING))) as split_hash
+            FROM `{self.dataset_ref}.{product_table}` p
+            JOIN `{self.dataset_ref}.{image_table}` i
+                ON p.image_filename = i.name
+            WHERE i.content IS NOT NULL
+                AND p.category IS NOT NULL
+                AND p.brand_name IS NOT NULL
+        )
         """
         
         self.client.query(query).result()
         
-        # Add train/validation/test splits
-        split_query = f"""
-        ALTER TABLE `{self.dataset_ref}.{training_table}`
-        ADD COLUMN IF NOT EXISTS dataset_split STRING;
-        
-        UPDATE `{self.dataset_ref}.{training_table}`
-        SET dataset_split = CASE 
-            WHEN MOD(ABS(split_hash), 10) < 7 THEN 'TRAIN'
-            WHEN MOD(ABS(split_hash), 10) < 9 THEN 'VALIDATION'
-            ELSE 'TEST'
-        END
-        WHERE dataset_split IS NULL
-        """
-        
-        self.client.query(split_query).result()
-        
         logger.info(f"Created training dataset: {training_table}")
         return training_table
 
@@ -616,16 +1019,19 @@ def create_image_uri_list(bucket_name: str, prefix: str = "product_images/") ->
 
 def validate_image_format(image_path: str) -> bool:
     """Validate image format is supported"""
-    supported_formats = ['.jpg', '.jpeg', '.png', '.webp', '.bmp']
-    return any(image_path.lower().endswith(fmt) for fmt in supported_formats)
+    return image_path.lower().endswith(_SUPPORTED_FORMATS)
 
 
-# Singleton instance getter
-_engine_instance = None
+# Singleton instance getter: one engine per configuration
+_engine_lock = threading.Lock()
+_engine_instances: Dict[Tuple[str, str, str], BigQueryMultimodalEngine] = {}
 
 def get_multimodal_engine(project_id: str, dataset_id: str, bucket_name: str) -> BigQueryMultimodalEngine:
     """Get or create the multimodal engine instance"""
-    global _engine_instance
-    if _engine_instance is None:
-        _engine_instance = BigQueryMultimodalEngine(project_id, dataset_id, bucket_name)
-    return _engine_instance
\ No newline at end of file
+    key = (project_id, dataset_id, bucket_name)
+    with _engine_lock:
+        engine = _engine_instances.get(key)
+        if engine is None:
+            engine = BigQueryMultimodalEngine(project_id, dataset_id, bucket_name)
+            _engine_instances[key] = engine
+    return engine
\ No newline at end of file
@@ -5,14 +5,38 @@ Combines image analysis with business rules for comprehensive QC
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Optional, Tuple, Any, Set
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.cloud import bigquery
+from collections import Counter, defaultdict
+from functools import cached_property, lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple, Any, Set, ClassVar, FrozenSet, Iterator, Mapping
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+import json
 import logging
+import sys
+import time
 from enum import Enum
 
+# Optional JIT for the data-check flags on locally evaluated products
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+    
+    def njit(*args, **kwargs):
+        """No-op stand-in so the flag kernels run as plain Python"""
+        return lambda func: func
+
 logger = logging.getLogger(__name__)
 
+# Slotted dataclasses need Python 3.10+
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
 
 class QCStatus(Enum):
     """Quality control status levels"""
@@ -22,7 +46,7 @@ class QCStatus(Enum):
     PENDING_REVIEW = "pending_review"
 
 
-@dataclass
+@dataclass(frozen=True, **_SLOTS)
 class QCRule:
     """Defines a quality control rule"""
     rule_id: str
@@ -36,7 +60,7 @@ class QCRule:
     fix_action: Optional[str] = None
 
 
-@dataclass
+@dataclass(frozen=True, **_SLOTS)
 class QCCheckResult:
     """Result of a QC check"""
     sku: str
@@ -44,7 +68,8 @@ class QCCheckResult:
     status: QCStatus
     message: str
     confidence: float
-    details: Dict[str, Any] = field(default_factory=dict)
+    # Still compared for equality, but left out of the hash: a dict is unhashable
+    details: Dict[str, Any] = field(default_factory=dict, hash=False)
     suggested_fix: Optional[str] = None
     timestamp: datetime = field(default_factory=datetime.now)
 
@@ -64,18 +89,93 @@ class QCReport:
     summary: Dict[str, Any]
 
 
+@dataclass
+class _ResultTally:
+    """What the report and auto-fixes keep from a streamed batch of results"""
+    result_count: int = 0
+    rule_counts: Dict[str, Counter] = field(default_factory=lambda: defaultdict(Counter))
+    critical_issues: List[QCCheckResult] = field(default_factory=list)
+    fixable: List[QCCheckResult] = field(default_factory=list)
+
+
+class QCResultSink:
+    """
+    Streams QC results to the qc_results table in fixed-size batches
+    
+    Rows are buffered column-wise and appended with streaming inserts every
+    `batch_size` results, so memory stays flat however many checks fail.
+    """
+    
+    COLUMNS = ('sku', 'rule_id', 'status', 'message', 'confidence', 'details', 'suggested_fix', 'timestamp')
+    
+    def __init__(self, table_id: str, client: bigquery.Client, batch_size: int = 500):
+        self.table_id = table_id
+        self.client = client
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._buffer = {column: [] for column in self.COLUMNS}
+        self._buffered = 0
+    
+    def __enter__(self) -> 'QCResultSink':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.flush()
+    
+    def add(self, result: QCCheckResult) -> None:
+        """Buffer one result, appending the batch once it is full"""
+        buffer = self._buffer
+        buffer['sku'].append(result.sku)
+        buffer['rule_id'].append(result.rule_id)
+        buffer['status'].append(result.status.value)
+        buffer['message'].append(result.message)
+        buffer['confidence'].append(result.confidence)
+        buffer['details'].append(json.dumps(result.details, default=str))
+        buffer['suggested_fix'].append(result.suggested_fix)
+        buffer['timestamp'].append(result.timestamp.isoformat())
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+    
+    def flush(self) -> None:
+        """Append any buffered rows"""
+        if not self._buffered:
+            return
+        self._append_rows(self._buffer)
+        self.rows_written += self._buffered
+        self._buffer = {column: [] for column in self.COLUMNS}
+        self._buffered = 0
+    
+    def _append_rows(self, columns: Dict[str, List[Any]]) -> None:
+        """Append a batch of rows to the results table"""
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        errors = self.client.insert_rows_json(self.table_id, rows)
+        if errors:
+            logger.error(f"Failed to append {len(errors)} QC result rows to {self.table_id}")
+            raise RuntimeError(f"QC result append failed: {errors[:3]}")
+
+
 class QualityControlSystem:
     """
     Comprehensive quality control system for e-commerce products
     """
     
+    # Rules whose failures are reported as critical issues
+    CRITICAL_RULE_IDS: ClassVar[FrozenSet[str]] = frozenset({'IMG001', 'DATA001', 'COMP001', 'CONS001'})
+    
+    # Rules _apply_auto_fixes acts on
+    AUTO_FIX_RULE_IDS: ClassVar[FrozenSet[str]] = frozenset({'IMG003', 'DATA002', 'CONS002'})
+    
+    # Categories that must carry compliance labels
+    REGULATED_CATEGORIES: ClassVar[Tuple[str, ...]] = ('food', 'cosmetics', 'electronics', 'toys', 'baby_products')
+    
     def __init__(self, project_id: str, dataset_id: str):
         self.project_id = project_id
         self.dataset_id = dataset_id
         self.dataset_ref = f"{project_id}.{dataset_id}"
         
-        # Initialize QC rules
-        self.rules = self._initialize_rules()
+        # QC rules are static and shared by every instance
+        self.rules = QualityControlSystem._initialize_rules()
         
         # Thresholds
         self.thresholds = {
@@ -86,8 +186,18 @@ class QualityControlSystem:
             'duplicate_similarity_threshold': 0.95
         }
         
-    def _initialize_rules(self) -> Dict[str, QCRule]:
-        """Initialize all QC rules"""
+        # Rule -> pass flag / result template dispatch for the check rows
+        self._check_table = self._build_check_table()
+    
+    @cached_property
+    def client(self) -> bigquery.Client:
+        """BigQuery client for writing QC results, created on first use"""
+        return bigquery.Client(project=self.project_id)
+        
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _initialize_rules(cls) -> Mapping[str, QCRule]:
+        """Initialize all QC rules (built once, read-only)"""
         rules = {}
         
         # Image quality rules
@@ -208,7 +318,16 @@ class QualityControlSystem:
             fix_action='UPDATE to standardized brand name'
         )
         
-        return rules
+        return MappingProxyType(rules)
+    
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _rule_categories(cls) -> Mapping[str, Tuple[str, ...]]:
+        """Rule IDs grouped by category, in rule order"""
+        categories = defaultdict(list)
+        for rule_id, rule in cls._initialize_rules().items():
+            categories[rule.category].append(rule_id)
+        return MappingProxyType({category: tuple(rule_ids) for category, rule_ids in categories.items()})
     
     def run_comprehensive_qc(self, product_table: str, image_analysis_table: str, batch_size: int = 1000) -> QCReport:
         """
@@ -217,31 +336,17 @@ class QualityControlSystem:
         start_time = datetime.now()
         batch_id = f"QC_{start_time.strftime('%Y%m%d_%H%M%S')}"
         
-        # Get product count
-        count_query = f"SELECT COUNT(*) as count FROM `{self.dataset_ref}.{product_table}`"
-        total_products = self._execute_query(count_query).iloc[0]['count']
-        
-        # Run all QC checks
-        all_results = []
-        
-        # Image quality checks
-        image_results = self._run_image_checks(product_table, image_analysis_table)
-        all_results.extend(image_results)
-        
-        # Data completeness checks
-        data_results = self._run_data_checks(product_table)
-        all_results.extend(data_results)
-        
-        # Compliance checks
-        compliance_results = self._run_compliance_checks(product_table, image_analysis_table)
-        all_results.extend(compliance_results)
+        # All checks plus the product count: one scan
+        total_products, failed_products, results = self._run_all_checks_fused(
+            product_table, image_analysis_table
+        )
         
-        # Consistency checks
-        consistency_results = self._run_consistency_checks(product_table)
-        all_results.extend(consistency_results)
+        # Stream results out as they are built
+        with QCResultSink(f"{self.dataset_ref}.qc_results", self.client) as sink:
+            tally = self._tally_results(results, sink)
         
         # Auto-fix where possible
-        auto_fixed_count = self._apply_auto_fixes(all_results, product_table)
+        auto_fixed_count = self._apply_auto_fixes(tally.fixable, product_table, batch_id)
         
         # Generate report
         execution_time = (datetime.now() - start_time).total_seconds() * 1000
@@ -249,331 +354,342 @@ class QualityControlSystem:
         return self._generate_report(
             batch_id,
             total_products,
-            all_results,
+            failed_products,
+            tally,
             auto_fixed_count,
             execution_time
         )
     
-    def _run_image_checks(self, product_table: str, image_analysis_table: str) -> List[QCCheckResult]:
-        """Run image quality checks"""
-        results = []
+    def _tally_results(self, results: Iterator[QCCheckResult], sink: QCResultSink) -> _ResultTally:
+        """Pass each result to the sink, keeping only report counts, critical issues and fixable results"""
+        tally = _ResultTally()
+        for r in results:
+            sink.add(r)
+            tally.result_count += 1
+            tally.rule_counts[r.rule_id][r.status] += 1
+            if r.rule_id in self.CRITICAL_RULE_IDS:
+                tally.critical_issues.append(r)
+            if r.rule_id in self.AUTO_FIX_RULE_IDS:
+                tally.fixable.append(r)
+        return tally
+    
+    def _run_all_checks_fused(self, product_table: str,
+                              image_analysis_table: str) -> Tuple[int, int, Iterator[QCCheckResult]]:
+        """
+        Run image, data, compliance and consistency checks in one query
+        
+        Products are scanned and joined once to the analysis and brand mapping
+        tables, each reduced to one row per key; every check is a pass flag on
+        the joined row (NULL counts as passing) and only rows failing at least
+        one check come back. The product count rides along on every row, with
+        one placeholder row when nothing fails.
         
+        Returns the product count, the number of distinct failing SKUs and the
+        per-check results.
+        """
         query = f"""
-        WITH image_checks AS (
+        WITH products AS (
+            SELECT 
+                p.*,
+                LENGTH(p.description) as desc_length,
+                AVG(p.price) OVER (PARTITION BY p.category) as category_avg_price,
+                -- Per-SKU windows in this same scan; an exact distinct-count probe to
+                -- skip them would be its own full sku-column job, for about the same cost
+                COUNT(*) OVER (PARTITION BY p.sku) as sku_dup_count,
+                ROW_NUMBER() OVER (PARTITION BY p.sku) as sku_row_num,
+                ARRAY_AGG(p.product_name IGNORE NULLS) OVER (PARTITION BY p.sku) as sku_product_names,
+                ARRAY_AGG(CAST(p.price AS STRING) IGNORE NULLS) OVER (PARTITION BY p.sku) as sku_prices
+            FROM `{self.dataset_ref}.{product_table}` p
+        ),
+        checks AS (
             SELECT 
                 p.sku,
+                p.product_name,
+                p.price,
+                p.category,
                 p.brand_name,
                 p.listed_color,
+                p.desc_length,
+                p.category_avg_price,
                 a.quality_score,
-                a.brand_visible,
                 a.primary_color as detected_color,
                 a.compliance_labels,
+                p.sku_dup_count as dup_count,
+                IF(p.sku_dup_count > 1,
+                    (SELECT STRING_AGG(DISTINCT sku_name, '; ') FROM UNNEST(p.sku_product_names) sku_name),
+                    NULL) as product_names,
+                IF(p.sku_dup_count > 1,
+                    (SELECT STRING_AGG(DISTINCT sku_price, '; ') FROM UNNEST(p.sku_prices) sku_price),
+                    NULL) as prices,
+                b.standardized_brand,
                 
                 -- Image quality check
-                CAST(a.quality_score AS FLOAT64) >= {self.thresholds['image_quality_min']} as img_quality_pass,
+                IFNULL(CAST(a.quality_score AS FLOAT64) >= @img_quality_min, TRUE) as img_quality_pass,
                 
                 -- Brand visibility check
-                (a.brand_visible = 'true' OR p.brand_name IS NULL) as brand_check_pass,
+                IFNULL(a.brand_visible = 'true' OR p.brand_name IS NULL, TRUE) as brand_check_pass,
                 
                 -- Color accuracy check
-                (LOWER(p.listed_color) = LOWER(a.primary_color) OR p.listed_color IS NULL) as color_check_pass
-                
-            FROM `{self.dataset_ref}.{product_table}` p
-            LEFT JOIN `{self.dataset_ref}.{image_analysis_table}` a
-                ON p.sku = a.sku
-        )
-        SELECT * FROM image_checks
-        WHERE NOT img_quality_pass 
-            OR NOT brand_check_pass 
-            OR NOT color_check_pass
-        """
-        
-        df = self._execute_query(query)
-        
-        for _, row in df.iterrows():
-            # Image quality
-            if not row['img_quality_pass']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='IMG001',
-                    status=QCStatus.FAILED,
-                    message=self.rules['IMG001'].error_message,
-                    confidence=0.9,
-                    details={'quality_score': row['quality_score']},
-                    suggested_fix='Upload higher quality product image'
-                ))
-            
-            # Brand visibility
-            if not row['brand_check_pass']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='IMG002',
-                    status=QCStatus.WARNING,
-                    message=self.rules['IMG002'].error_message,
-                    confidence=0.8,
-                    details={'brand_name': row['brand_name']},
-                    suggested_fix='Ensure brand logo is visible in main image'
-                ))
-            
-            # Color accuracy
-            if not row['color_check_pass']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='IMG003',
-                    status=QCStatus.WARNING,
-                    message=self.rules['IMG003'].error_message,
-                    confidence=0.85,
-                    details={
-                        'listed_color': row['listed_color'],
-                        'detected_color': row['detected_color']
-                    },
-                    suggested_fix=f"Update color to: {row['detected_color']}"
-                ))
-        
-        return results
-    
-    def _run_data_checks(self, product_table: str) -> List[QCCheckResult]:
-        """Run data quality checks"""
-        results = []
-        
-        query = f"""
-        WITH data_checks AS (
-            SELECT 
-                p.*,
-                LENGTH(p.description) as desc_length,
-                AVG(p.price) OVER (PARTITION BY p.category) as category_avg_price,
-                MIN(p.price) OVER (PARTITION BY p.category) as category_min_price,
-                MAX(p.price) OVER (PARTITION BY p.category) as category_max_price,
+                IFNULL(LOWER(p.listed_color) = LOWER(a.primary_color) OR p.listed_color IS NULL, TRUE) as color_check_pass,
                 
                 -- Required fields check
-                (p.sku IS NOT NULL AND p.product_name IS NOT NULL AND p.price > 0) as required_fields_pass,
+                IFNULL(p.sku IS NOT NULL AND p.product_name IS NOT NULL AND p.price > 0, TRUE) as required_fields_pass,
                 
                 -- Description quality
-                LENGTH(p.description) >= {self.thresholds['description_min_length']} as desc_quality_pass,
+                IFNULL(p.desc_length >= @desc_min_length, TRUE) as desc_quality_pass,
                 
                 -- Price reasonableness
-                p.price BETWEEN 
-                    AVG(p.price) OVER (PARTITION BY p.category) * (1 - {self.thresholds['price_variance_max']})
-                    AND AVG(p.price) OVER (PARTITION BY p.category) * (1 + {self.thresholds['price_variance_max']})
-                as price_reasonable
+                IFNULL(p.price BETWEEN 
+                    p.category_avg_price * (1 - @price_variance)
+                    AND p.category_avg_price * (1 + @price_variance), TRUE) as price_reasonable,
                 
-            FROM `{self.dataset_ref}.{product_table}` p
-        )
-        SELECT * FROM data_checks
-        WHERE NOT required_fields_pass 
-            OR NOT desc_quality_pass 
-            OR NOT price_reasonable
-        """
-        
-        df = self._execute_query(query)
-        
-        for _, row in df.iterrows():
-            # Required fields
-            if not row['required_fields_pass']:
-                results.append(QCCheckResult(
-                    sku=row.get('sku', 'UNKNOWN'),
-                    rule_id='DATA001',
-                    status=QCStatus.FAILED,
-                    message=self.rules['DATA001'].error_message,
-                    confidence=1.0,
-                    details={
-                        'missing_fields': [
-                            field for field in ['sku', 'product_name', 'price']
-                            if not row.get(field) or (field == 'price' and row.get(field, 0) <= 0)
-                        ]
-                    }
-                ))
-            
-            # Description quality
-            if not row['desc_quality_pass']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='DATA002',
-                    status=QCStatus.WARNING,
-                    message=self.rules['DATA002'].error_message,
-                    confidence=1.0,
-                    details={
-                        'description_length': row['desc_length'],
-                        'minimum_required': self.thresholds['description_min_length']
-                    },
-                    suggested_fix='Generate expanded description using AI'
-                ))
-            
-            # Price reasonableness
-            if not row['price_reasonable']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='DATA003',
-                    status=QCStatus.WARNING,
-                    message=self.rules['DATA003'].error_message,
-                    confidence=0.9,
-                    details={
-                        'price': row['price'],
-                        'category_avg': row['category_avg_price'],
-                        'variance': abs(row['price'] - row['category_avg_price']) / row['category_avg_price']
-                    },
-                    suggested_fix='Review pricing against category benchmarks'
-                ))
-        
-        return results
-    
-    def _run_compliance_checks(self, product_table: str, image_analysis_table: str) -> List[QCCheckResult]:
-        """Run compliance checks"""
-        results = []
-        
-        regulated_categories = ['food', 'cosmetics', 'electronics', 'toys', 'baby_products']
-        
-        query = f"""
-        WITH compliance_checks AS (
-            SELECT 
-                p.sku,
-                p.category,
-                p.subcategory,
-                a.compliance_labels,
-                a.detected_text,
+                -- Regulated categories need compliance labels
+                IFNULL(p.category NOT IN UNNEST(@regulated)
+                    OR ARRAY_LENGTH(a.compliance_labels) > 0, TRUE) as compliance_labels_pass,
                 
-                -- Check if regulated category
-                p.category IN ({','.join([f"'{cat}'" for cat in regulated_categories])}) as is_regulated,
+                -- Age restriction for toys
+                IFNULL(p.category != 'toys' OR a.detected_text LIKE '%age%', TRUE) as age_label_pass,
                 
-                -- Check compliance labels
-                ARRAY_LENGTH(a.compliance_labels) > 0 as has_compliance_labels,
+                -- Duplicate SKUs (reported once, on the first row of each group)
+                IFNULL(p.sku_dup_count = 1 OR p.sku_row_num > 1, TRUE) as unique_sku_pass,
                 
-                -- Age restriction for toys
-                (p.category = 'toys' AND a.detected_text LIKE '%age%') as has_age_restriction
+                -- Brand standardization
+                IFNULL(p.brand_name = b.standardized_brand, TRUE) as brand_standard_pass
                 
-            FROM `{self.dataset_ref}.{product_table}` p
-            LEFT JOIN `{self.dataset_ref}.{image_analysis_table}` a
+            FROM products p
+            -- One analysis row and one mapping per key, so product checks aren't repeated per image
+            LEFT JOIN (
+                SELECT *
+                FROM `{self.dataset_ref}.{image_analysis_table}`
+                WHERE sku IS NOT NULL
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY sku) = 1
+            ) a
                 ON p.sku = a.sku
+            LEFT JOIN (
+                SELECT 
+                    LOWER(original_brand) as brand_key,
+                    ANY_VALUE(standardized_brand) as standardized_brand
+                FROM `{self.dataset_ref}.brand_mapping`
+                GROUP BY brand_key
+            ) b
+                ON LOWER(p.brand_name) = b.brand_key
+        ),
+        failing AS (
+            SELECT *, TRUE as has_issue
+            FROM checks
+            WHERE NOT (img_quality_pass AND brand_check_pass AND color_check_pass
+                AND required_fields_pass AND desc_quality_pass AND price_reasonable
+                AND compliance_labels_pass AND age_label_pass
+                AND unique_sku_pass AND brand_standard_pass)
         )
-        SELECT * FROM compliance_checks
-        WHERE (is_regulated AND NOT has_compliance_labels)
-            OR (category = 'toys' AND NOT has_age_restriction)
+        -- COUNT(*) of a whole table is answered from metadata, not a scan
+        SELECT totals.total_products, failing.*
+        FROM (SELECT COUNT(*) as total_products FROM `{self.dataset_ref}.{product_table}`) totals
+        LEFT JOIN failing ON TRUE
         """
         
-        df = self._execute_query(query)
-        
-        for _, row in df.iterrows():
-            # Regulated category compliance
-            if row['is_regulated'] and not row['has_compliance_labels']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='COMP001',
-                    status=QCStatus.FAILED,
-                    message=self.rules['COMP001'].error_message,
-                    confidence=0.95,
-                    details={
-                        'category': row['category'],
-                        'compliance_labels_found': row['compliance_labels'] or []
-                    },
-                    suggested_fix=f'Add required compliance labels for {row["category"]} products'
-                ))
-            
-            # Age restriction for toys
-            if row['category'] == 'toys' and not row['has_age_restriction']:
-                results.append(QCCheckResult(
-                    sku=row['sku'],
-                    rule_id='COMP002',
-                    status=QCStatus.FAILED,
-                    message=self.rules['COMP002'].error_message,
-                    confidence=0.9,
-                    details={'category': 'toys'},
-                    suggested_fix='Add age restriction label to toy product image'
-                ))
-        
-        return results
+        params = [
+            bigquery.ScalarQueryParameter('img_quality_min', 'FLOAT64', self.thresholds['image_quality_min']),
+            bigquery.ScalarQueryParameter('desc_min_length', 'INT64', self.thresholds['description_min_length']),
+            bigquery.ScalarQueryParameter('price_variance', 'FLOAT64', self.thresholds['price_variance_max']),
+            bigquery.ArrayQueryParameter('regulated', 'STRING', list(self.REGULATED_CATEGORIES))
+        ]
+        
+        tbl = self._execute_query(query, params)
+        if tbl.num_rows == 0:
+            return 0, 0, iter(())
+        
+        total_products = int(tbl['total_products'][0].as_py())
+        tbl = tbl.filter(pc.fill_null(tbl['has_issue'], False))
+        
+        # Every failing row yields at least one result, so its SKUs are the failed products
+        # (Arrow's hash kernel over the column already in memory; a NULL SKU counts once)
+        failed_products = pc.count_distinct(tbl['sku'], mode='all').as_py() if tbl.num_rows else 0
+        
+        return total_products, failed_products, self._check_results(tbl)
     
-    def _run_consistency_checks(self, product_table: str) -> List[QCCheckResult]:
-        """Run data consistency checks"""
-        results = []
+    def _build_check_table(self) -> Tuple[Tuple[Any, ...], ...]:
+        """
+        One entry per check-row rule
         
-        # Check for duplicate SKUs
-        dup_query = f"""
-        WITH duplicate_check AS (
-            SELECT 
-                sku,
-                COUNT(*) as dup_count,
-                STRING_AGG(DISTINCT product_name, '; ') as product_names,
-                STRING_AGG(DISTINCT CAST(price AS STRING), '; ') as prices
-            FROM `{self.dataset_ref}.{product_table}`
-            GROUP BY sku
-            HAVING COUNT(*) > 1
-        )
-        SELECT * FROM duplicate_check
+        (rule_id, pass flag, status, confidence, detail columns, details(*values),
+        suggested_fix(*values)); the builders receive the detail column values of
+        a failing row.
         """
+        thresholds = self.thresholds
+        
+        def missing_fields(sku, product_name, price):
+            return {
+                'missing_fields': [
+                    field for field, missing in (
+                        ('sku', not sku),
+                        ('product_name', not product_name),
+                        ('price', price is None or price <= 0)
+                    ) if missing
+                ]
+            }
         
-        dup_df = self._execute_query(dup_query)
-        
-        for _, row in dup_df.iterrows():
-            results.append(QCCheckResult(
-                sku=row['sku'],
-                rule_id='CONS001',
-                status=QCStatus.FAILED,
-                message=self.rules['CONS001'].error_message,
-                confidence=1.0,
-                details={
-                    'duplicate_count': row['dup_count'],
-                    'product_names': row['product_names'],
-                    'prices': row['prices']
-                },
-                suggested_fix='Merge or differentiate duplicate SKUs'
-            ))
-        
-        # Check brand standardization
-        brand_query = f"""
-        WITH brand_check AS (
-            SELECT 
-                p.sku,
-                p.brand_name,
-                b.standardized_brand,
-                p.brand_name != b.standardized_brand as needs_standardization
-            FROM `{self.dataset_ref}.{product_table}` p
-            LEFT JOIN `{self.dataset_ref}.brand_mapping` b
-                ON LOWER(p.brand_name) = LOWER(b.original_brand)
-            WHERE p.brand_name IS NOT NULL
-                AND b.standardized_brand IS NOT NULL
-                AND p.brand_name != b.standardized_brand
+        def price_variance(price, category_avg):
+            price, category_avg = float(price), float(category_avg)
+            return {
+                'price': price,
+                'category_avg': category_avg,
+                'variance': abs(price - category_avg) / category_avg if category_avg else None
+            }
+        
+        return (
+            # Image checks
+            ('IMG001', 'img_quality_pass', QCStatus.FAILED, 0.9, ('quality_score',),
+             lambda quality_score: {'quality_score': quality_score},
+             lambda quality_score: 'Upload higher quality product image'),
+            ('IMG002', 'brand_check_pass', QCStatus.WARNING, 0.8, ('brand_name',),
+             lambda brand_name: {'brand_name': brand_name},
+             lambda brand_name: 'Ensure brand logo is visible in main image'),
+            ('IMG003', 'color_check_pass', QCStatus.WARNING, 0.85, ('listed_color', 'detected_color'),
+             lambda listed_color, detected_color: {
+                 'listed_color': listed_color,
+                 'detected_color': detected_color
+             },
+             lambda listed_color, detected_color: f"Update color to: {detected_color}"),
+            
+            # Data checks
+            ('DATA001', 'required_fields_pass', QCStatus.FAILED, 1.0, ('sku', 'product_name', 'price'),
+             missing_fields,
+             None),
+            ('DATA002', 'desc_quality_pass', QCStatus.WARNING, 1.0, ('desc_length',),
+             lambda desc_length: {
+                 'description_length': desc_length,
+                 'minimum_required': thresholds['description_min_length']
+             },
+             lambda desc_length: 'Generate expanded description using AI'),
+            ('DATA003', 'price_reasonable', QCStatus.WARNING, 0.9, ('price', 'category_avg_price'),
+             price_variance,
+             lambda price, category_avg: 'Review pricing against category benchmarks'),
+            
+            # Compliance checks
+            ('COMP001', 'compliance_labels_pass', QCStatus.FAILED, 0.95, ('category', 'compliance_labels'),
+             lambda category, labels: {
+                 'category': category,
+                 'compliance_labels_found': list(labels) if labels is not None else []
+             },
+             lambda category, labels: f'Add required compliance labels for {category} products'),
+            ('COMP002', 'age_label_pass', QCStatus.FAILED, 0.9, (),
+             lambda: {'category': 'toys'},
+             lambda: 'Add age restriction label to toy product image'),
+            
+            # Consistency checks
+            ('CONS001', 'unique_sku_pass', QCStatus.FAILED, 1.0, ('dup_count', 'product_names', 'prices'),
+             lambda dup_count, product_names, prices: {
+                 'duplicate_count': dup_count,
+                 'product_names': product_names,
+                 'prices': prices
+             },
+             lambda dup_count, product_names, prices: 'Merge or differentiate duplicate SKUs'),
+            ('CONS002', 'brand_standard_pass', QCStatus.WARNING, 0.95, ('brand_name', 'standardized_brand'),
+             lambda brand_name, standardized_brand: {
+                 'current_brand': brand_name,
+                 'standardized_brand': standardized_brand
+             },
+             lambda brand_name, standardized_brand: f"Update brand to: {standardized_brand}"),
         )
-        SELECT * FROM brand_check WHERE needs_standardization
+    
+    def _check_results(self, tbl: pa.Table, rule_ids: Optional[Tuple[str, ...]] = None) -> Iterator[QCCheckResult]:
+        """Results for every check (or just `rule_ids`), generated lazily from the check table"""
+        for rule_id, pass_flag, status, confidence, columns, details, suggested_fix in self._check_table:
+            if rule_ids is not None and rule_id not in rule_ids:
+                continue
+            failed = self._failing(tbl, pass_flag)
+            message = self.rules[rule_id].error_message
+            for sku, *values in zip(failed['sku'].to_pylist(), *(failed[c].to_pylist() for c in columns)):
+                yield QCCheckResult(
+                    sku=sku,
+                    rule_id=rule_id,
+                    status=status,
+                    message=message,
+                    confidence=confidence,
+                    details=details(*values),
+                    suggested_fix=suggested_fix(*values) if suggested_fix else None
+                )
+    
+    def run_local_data_checks(self, products: pd.DataFrame) -> List[QCCheckResult]:
         """
+        Run the data checks (DATA001-003) on an in-memory product frame
         
-        brand_df = self._execute_query(brand_query)
-        
-        for _, row in brand_df.iterrows():
-            results.append(QCCheckResult(
-                sku=row['sku'],
-                rule_id='CONS002',
-                status=QCStatus.WARNING,
-                message=self.rules['CONS002'].error_message,
-                confidence=0.95,
-                details={
-                    'current_brand': row['brand_name'],
-                    'standardized_brand': row['standardized_brand']
-                },
-                suggested_fix=f"Update brand to: {row['standardized_brand']}"
-            ))
-        
-        return results
+        For offline runs and test fixtures; flags follow the same rules as the
+        fused query, with missing values counting as passing.
+        """
+        price = pd.to_numeric(products['price'], errors='coerce').to_numpy(dtype=float)
+        category_avg = products.assign(price=price).groupby('category', dropna=False)['price'].transform('mean').to_numpy(dtype=float)
+        desc_length = products['description'].astype('string').str.len().to_numpy(dtype=float, na_value=np.nan)
+        variance_max = float(self.thresholds['price_variance_max'])
+        min_length = float(self.thresholds['description_min_length'])
+        
+        if NUMBA_AVAILABLE:
+            price_reasonable = _price_flags(price, category_avg, variance_max)
+            desc_quality_pass = _desc_length_flags(desc_length, min_length)
+        else:
+            # NaN comparisons are False, so missing values pass
+            price_reasonable = ~((price < category_avg * (1 - variance_max))
+                                 | (price > category_avg * (1 + variance_max)))
+            desc_quality_pass = ~(desc_length < min_length)
+        
+        required_fields_pass = (
+            products['sku'].notna() & products['product_name'].notna() & ~(price <= 0)
+        ).to_numpy(dtype=bool)
+        
+        tbl = pa.Table.from_pandas(pd.DataFrame({
+            'sku': products['sku'].to_numpy(),
+            'product_name': products['product_name'].to_numpy(),
+            'price': price,
+            'category_avg_price': category_avg,
+            'desc_length': desc_length,
+            'required_fields_pass': required_fields_pass,
+            'desc_quality_pass': desc_quality_pass,
+            'price_reasonable': price_reasonable
+        }), preserve_index=False)
+        return list(self._check_results(tbl, self._rule_categories()['data']))
     
-    def _apply_auto_fixes(self, results: List[QCCheckResult], product_table: str) -> int:
-        """Apply automatic fixes where available"""
+    @staticmethod
+    def _failing(tbl: pa.Table, pass_flag: str) -> pa.Table:
+        """Rows of the check table where the given pass flag is false"""
+        return tbl.filter(pc.invert(tbl[pass_flag]))
+    
+    def _apply_auto_fixes(self, fixable: List[QCCheckResult], product_table: str, batch_id: str) -> int:
+        """
+        Apply automatic fixes where available
+        
+        Fixed SKUs are loaded into a staging table and applied with one MERGE,
+        so the statement size no longer grows with the number of fixes.
+        """
         fixed_count = 0
         
         # Group fixes by type
-        color_fixes = [r for r in results if r.rule_id == 'IMG003' and r.status == QCStatus.WARNING]
-        desc_fixes = [r for r in results if r.rule_id == 'DATA002' and r.status == QCStatus.WARNING]
-        brand_fixes = [r for r in results if r.rule_id == 'CONS002' and r.status == QCStatus.WARNING]
+        color_fixes = [r for r in fixable if r.rule_id == 'IMG003' and r.status == QCStatus.WARNING]
+        desc_fixes = [r for r in fixable if r.rule_id == 'DATA002' and r.status == QCStatus.WARNING]
+        brand_fixes = [r for r in fixable if r.rule_id == 'CONS002' and r.status == QCStatus.WARNING]
         
         # Apply color fixes
         if color_fixes:
-            color_update = f"""
-            UPDATE `{self.dataset_ref}.{product_table}` p
-            SET listed_color = a.primary_color
-            FROM `{self.dataset_ref}.image_analysis` a
-            WHERE p.sku = a.sku
-                AND p.sku IN ({','.join([f"'{r.sku}'" for r in color_fixes])})
-                AND a.primary_color IS NOT NULL
-            """
-            self._execute_update(color_update)
+            fixes_table = f"{self.dataset_ref}.qc_fixes_{batch_id}"
+            self._load_dataframe(pd.DataFrame({'sku': [r.sku for r in color_fixes]}), fixes_table)
+            try:
+                color_merge = f"""
+                MERGE `{self.dataset_ref}.{product_table}` p
+                USING (
+                    SELECT f.sku, ANY_VALUE(a.primary_color) as primary_color
+                    FROM `{fixes_table}` f
+                    JOIN `{self.dataset_ref}.image_analysis` a
+                        ON f.sku = a.sku
+                    WHERE a.primary_color IS NOT NULL
+                    GROUP BY f.sku
+                ) fix
+                ON p.sku = fix.sku
+                WHEN MATCHED THEN
+                    UPDATE SET listed_color = fix.primary_color
+                """
+                self._execute_update(color_merge)
+            finally:
+                self._execute_update(f"DROP TABLE IF EXISTS `{fixes_table}`")
             fixed_count += len(color_fixes)
         
         # Note: Other auto-fixes would require AI generation which we simulate
@@ -585,42 +701,31 @@ class QualityControlSystem:
         self,
         batch_id: str,
         total_products: int,
-        results: List[QCCheckResult],
+        failed_products: int,
+        tally: _ResultTally,
         auto_fixed: int,
         execution_time: float
     ) -> QCReport:
         """Generate comprehensive QC report"""
+        rule_counts = tally.rule_counts
+        critical_issues = tally.critical_issues
         
         # Count by status
-        status_counts = {
-            QCStatus.PASSED: 0,
-            QCStatus.FAILED: len([r for r in results if r.status == QCStatus.FAILED]),
-            QCStatus.WARNING: len([r for r in results if r.status == QCStatus.WARNING]),
-            QCStatus.PENDING_REVIEW: len([r for r in results if r.status == QCStatus.PENDING_REVIEW])
-        }
+        status_counts = sum(rule_counts.values(), Counter())
         
         # Products that passed all checks
-        failed_skus = set(r.sku for r in results)
-        passed_count = total_products - len(failed_skus)
-        
-        # Critical issues
-        critical_issues = [r for r in results if r.rule_id in ['IMG001', 'DATA001', 'COMP001', 'CONS001']]
+        passed_count = total_products - failed_products
         
         # Summary by category
-        category_summary = {}
-        for rule_id, rule in self.rules.items():
-            category = rule.category
-            if category not in category_summary:
-                category_summary[category] = {
-                    'total_checks': 0,
-                    'failures': 0,
-                    'warnings': 0
-                }
-            
-            rule_results = [r for r in results if r.rule_id == rule_id]
-            category_summary[category]['total_checks'] += len(rule_results)
-            category_summary[category]['failures'] += len([r for r in rule_results if r.status == QCStatus.FAILED])
-            category_summary[category]['warnings'] += len([r for r in rule_results if r.status == QCStatus.WARNING])
+        category_summary = {
+            category: {'total_checks': 0, 'failures': 0, 'warnings': 0}
+            for category in self._rule_categories()
+        }
+        for rule_id, counts in rule_counts.items():
+            summary = category_summary[self.rules[rule_id].category]
+            summary['total_checks'] += sum(counts.values())
+            summary['failures'] += counts[QCStatus.FAILED]
+            summary['warnings'] += counts[QCStatus.WARNING]
         
         return QCReport(
             batch_id=batch_id,
@@ -636,21 +741,88 @@ class QualityControlSystem:
                 'by_category': category_summary,
                 'pass_rate': (passed_count / total_products * 100) if total_products > 0 else 0,
                 'critical_issue_rate': (len(critical_issues) / total_products * 100) if total_products > 0 else 0,
-                'auto_fix_rate': (auto_fixed / len(results) * 100) if results else 0
+                'auto_fix_rate': (auto_fixed / tally.result_count * 100) if tally.result_count else 0
             }
         )
     
-    def _execute_query(self, query: str) -> pd.DataFrame:
-        """Execute query and return DataFrame (simulated)"""
-        # In production, this would use BigQuery client
-        return pd.DataFrame()
+    def _execute_query(self, query: str,
+                       params: Optional[List[bigquery.ScalarQueryParameter]] = None,
+                       cache: bool = False) -> pa.Table:
+        """
+        Execute parameterized query and return an Arrow table
+        
+        QC runs must see current data, so only callers that opt in with
+        `cache` (repeated monitoring reads) go through the result cache.
+        """
+        if cache:
+            return _cached_query(*_query_cache_key(query, params))
+        return _run_query(query, params)
     
     def _execute_update(self, query: str) -> None:
         """Execute update query (simulated)"""
         # In production, this would use BigQuery client
+        # Writes make cached reads stale
+        _cached_query.cache_clear()
+    
+    def _load_dataframe(self, df: pd.DataFrame, table_id: str) -> None:
+        """Load DataFrame into a table (simulated)"""
+        # In production, this would use client.load_table_from_dataframe
         pass
 
 
+# Cached query results are reused for at most this long
+QUERY_CACHE_TTL_SECONDS = 3600
+
+
+def _run_query(query: str, params: Optional[List[bigquery.ScalarQueryParameter]] = None) -> pa.Table:
+    """Execute parameterized query and return an Arrow table (simulated)"""
+    # In production, this would use client.query(
+    #     query, job_config=bigquery.QueryJobConfig(query_parameters=params or [])
+    # ).to_arrow(bqstorage_client=...)
+    return pa.table({})
+
+
+def _query_cache_key(query: str,
+                     params: Optional[List[bigquery.ScalarQueryParameter]]) -> Tuple[str, Tuple, int]:
+    """Hashable (SQL, parameters, TTL bucket) key for _cached_query"""
+    params_key = tuple(
+        (p.name, p.array_type, tuple(p.values)) if isinstance(p, bigquery.ArrayQueryParameter)
+        else (p.name, p.type_, p.value)
+        for p in params or ()
+    )
+    return query.strip(), params_key, int(time.time() // QUERY_CACHE_TTL_SECONDS)
+
+
+@lru_cache(maxsize=128)
+def _cached_query(query: str, params_key: Tuple, ttl_bucket: int) -> pa.Table:
+    """_run_query memoized per SQL text, parameters and TTL bucket; cache_clear() drops everything"""
+    params = [
+        bigquery.ArrayQueryParameter(name, type_, list(value)) if isinstance(value, tuple)
+        else bigquery.ScalarQueryParameter(name, type_, value)
+        for name, type_, value in params_key
+    ]
+    return _run_query(query, params)
+
+
+@njit(parallel=True, cache=True)
+def _price_flags(price: np.ndarray, category_avg: np.ndarray, variance_max: float) -> np.ndarray:
+    """Price-reasonableness pass flags; NaN prices or averages pass"""
+    out = np.empty(price.shape[0], np.bool_)
+    for i in prange(price.shape[0]):
+        out[i] = not (price[i] < category_avg[i] * (1 - variance_max)
+                      or price[i] > category_avg[i] * (1 + variance_max))
+    return out
+
+
+@njit(parallel=True, cache=True)
+def _desc_length_flags(desc_length: np.ndarray, min_length: float) -> np.ndarray:
+    """Description-length pass flags; NaN (missing description) passes"""
+    out = np.empty(desc_length.shape[0], np.bool_)
+    for i in prange(desc_length.shape[0]):
+        out[i] = not desc_length[i] < min_length
+    return out
+
+
 class QCMonitor:
     """
     Monitor QC metrics over time
@@ -674,7 +846,7 @@ class QCMonitor:
                 COUNTIF(rule_id IN ('IMG001', 'DATA001', 'COMP001')) as critical_issues,
                 AVG(confidence) as avg_confidence
             FROM `{self.dataset_ref}.qc_results`
-            WHERE timestamp >= DATE_SUB(CURRENT_DATE(), INTERVAL {days} DAY)
+            WHERE timestamp >= DATE_SUB(CURRENT_DATE(), INTERVAL @days DAY)
             GROUP BY date
         )
         SELECT 
@@ -686,7 +858,7 @@ class QCMonitor:
         ORDER BY date DESC
         """
         
-        return pd.DataFrame()  # Simulated
+        return self._execute_query(query, [bigquery.ScalarQueryParameter('days', 'INT64', days)])
     
     def get_top_issues(self, limit: int = 10) -> pd.DataFrame:
         """Get most common QC issues"""
@@ -705,7 +877,11 @@ class QCMonitor:
         WHERE timestamp >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
         GROUP BY rule_id, rule_name, category
         ORDER BY occurrence_count DESC
-        LIMIT {limit}
+        LIMIT @limit
         """
         
-        return pd.DataFrame()  # Simulated
\ No newline at end of file
+        return self._execute_query(query, [bigquery.ScalarQueryParameter('limit', 'INT64', limit)])
+    
+    def _execute_query(self, query: str, params: List[bigquery.ScalarQueryParameter]) -> pd.DataFrame:
+        """Execute a dashboard query through the shared result cache"""
+        return _cached_query(*_query_cache_key(query, params)).to_pandas()
\ No newline at end of file
@@ -5,14 +5,28 @@ Find products using image similarity and style matching
 
 import numpy as np
 import pandas as pd
-from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple, Union, Any
+from collections import deque
+from dataclasses import dataclass, replace
 from datetime import datetime
+from functools import cached_property, lru_cache
+from google.cloud import bigquery
+from google.cloud import storage
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cosine similarity above which two query images are treated as the same search
+QUERY_EMBEDDING_SIMILARITY = 0.95
+
+# Leading embedding dimensions kept for the first-stage search, and how many
+# of its neighbours are re-ranked on the full embedding
+SHORT_EMBEDDING_DIMS = 512
+RERANK_CANDIDATES = 200
+
+QueryParams = List[Union[bigquery.ScalarQueryParameter, bigquery.ArrayQueryParameter]]
+
 
 @dataclass
 class StyleVector:
@@ -63,30 +77,133 @@ class VisualSearchEngine:
             'earth': ['brown', 'tan', 'olive', 'rust', 'khaki']
         }
         
-    def build_visual_search_query(self, query: VisualSearchQuery) -> str:
+        # Integer color codes for the color_code UDF: 0-5 around the color
+        # wheel, so analogous colors differ by 1 (mod 6) and complementary
+        # ones by 3; black and white sit off the wheel, also 3 apart
+        self.color_codes = {
+            'red': 0, 'orange': 1, 'yellow': 2, 'green': 3, 'blue': 4, 'purple': 5,
+            'black': 6, 'white': 9
+        }
+        
+        # Query image embeddings by exact URI, and recent (sku, image_uri)
+        # results by (filters, normalized embedding) for near-duplicate query images
+        self._query_emb_cache = lru_cache(maxsize=1024)(self._embed_image)
+        self._vec_cache: Deque[Tuple[tuple, np.ndarray, List[Tuple[str, str]]]] = deque(maxlen=256)
+        
+    @cached_property
+    def client(self) -> bigquery.Client:
+        return bigquery.Client(project=self.project_id)
+    
+    @cached_property
+    def storage_client(self) -> storage.Client:
+        return storage.Client(project=self.project_id)
+    
+    def _embed_image(self, image_uri: str) -> Tuple[float, ...]:
+        """Embed one query image with the multimodal model"""
+        # The image is read straight from GCS and bound as BYTES, rather
+        # than looked up in product_images by URI
+        image_bytes = storage.Blob.from_string(image_uri, client=self.storage_client).download_as_bytes()
+        query = f"""
+        SELECT AI.GENERATE_EMBEDDING(
+            MODEL `{self.dataset_ref}.multimodal_embedding_model`,
+            CONTENT => @image_bytes,
+            STRUCT('IMAGE' as content_type)
+        ) AS embedding
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter('image_bytes', 'BYTES', image_bytes)],
+            use_query_cache=True
+        )
+        row = next(iter(self.client.query_and_wait(query, job_config=job_config)))
+        return tuple(row.embedding)
+    
+    def _get_or_embed(self, image_uri: str) -> np.ndarray:
+        return np.asarray(self._query_emb_cache(image_uri), dtype=np.float64)
+    
+    @staticmethod
+    def _filter_key(query: VisualSearchQuery) -> tuple:
+        return (
+            tuple(query.category_filter or ()),
+            tuple(query.brand_filter or ()),
+            tuple(query.price_range or ()),
+            tuple(query.color_filter or ())
+        )
+    
+    def search_similar_skus(self, query: VisualSearchQuery) -> List[str]:
+        """
+        Run a visual search and return the matching SKUs, nearest first
+        
+        A query image whose embedding is within QUERY_EMBEDDING_SIMILARITY of
+        a recent search with the same filters reuses the results of the most
+        similar such search without going to BigQuery. Results are cached
+        without the query image excluded, and the current query image's own
+        rows are dropped on every call.
         """
-        Build BigQuery query for visual search
+        embedding = self._get_or_embed(query.image_uri)
+        unit = embedding / (np.linalg.norm(embedding) or 1.0)
+        key = self._filter_key(query)
+        
+        best_similarity, rows = QUERY_EMBEDDING_SIMILARITY, None
+        for cached_key, cached_unit, cached_rows in self._vec_cache:
+            if cached_key == key:
+                similarity = float(unit @ cached_unit)
+                if similarity >= best_similarity:
+                    best_similarity, rows = similarity, cached_rows
+        
+        if rows is None:
+            sql, params = self.build_visual_search_query(replace(query, image_uri=None), embedding)
+            job_config = bigquery.QueryJobConfig(query_parameters=params, use_query_cache=True)
+            rows = [(row.sku, row.image_uri) for row in self.client.query_and_wait(sql, job_config=job_config)]
+            self._vec_cache.append((key, unit, rows))
+        return [sku for sku, image_uri in rows if image_uri != query.image_uri]
+    
+    def create_product_embeddings_table(self) -> str:
         """
-        # Base query with image embeddings
-        base_query = f"""
-        WITH query_embedding AS (
-            SELECT AI.GENERATE_EMBEDDING(
+        Build the one-time DDL that embeds every product image
+        
+        build_visual_search_query reads product_embeddings, so only the
+        query image goes through the model at search time. A truncated,
+        re-normalized copy in product_embeddings_short backs the first-stage
+        search.
+        """
+        query = f"""
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.product_embeddings` AS
+        SELECT 
+            p.sku,
+            i.uri as image_uri,
+            AI.GENERATE_EMBEDDING(
                 MODEL `{self.dataset_ref}.multimodal_embedding_model`,
-                CONTENT => (
-                    SELECT content 
-                    FROM `{self.dataset_ref}.product_images` 
-                    WHERE uri = '{query.image_uri}'
-                ),
+                CONTENT => i.content,
                 STRUCT('IMAGE' as content_type)
             ) AS embedding
-        ),
-        product_catalog AS (
+        FROM `{self.dataset_ref}.products` p
+        JOIN `{self.dataset_ref}.product_images` i
+            ON p.image_filename = i.name;
+        
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.product_embeddings_short` AS
+        SELECT 
+            sku,
+            image_uri,
+            {self._short_embedding_sql('embedding')} AS embedding
+        FROM `{self.dataset_ref}.product_embeddings`;
+        
+        CREATE VECTOR INDEX IF NOT EXISTS product_emb_short_idx
+        ON `{self.dataset_ref}.product_embeddings_short` (embedding)
+        OPTIONS (index_type = 'IVF', distance_type = 'COSINE')
+        """
+        
+        return query
+    
+    def update_product_embeddings(self) -> str:
+        """
+        Build MERGEs that embed only new or re-shot product images
+        """
+        query = f"""
+        MERGE `{self.dataset_ref}.product_embeddings` T
+        USING (
             SELECT 
-                p.*,
+                p.sku,
                 i.uri as image_uri,
-                a.primary_color,
-                a.detected_style,
-                a.quality_score,
                 AI.GENERATE_EMBEDDING(
                     MODEL `{self.dataset_ref}.multimodal_embedding_model`,
                     CONTENT => i.content,
@@ -95,8 +212,150 @@ class VisualSearchEngine:
             FROM `{self.dataset_ref}.products` p
             JOIN `{self.dataset_ref}.product_images` i
                 ON p.image_filename = i.name
-            LEFT JOIN `{self.dataset_ref}.image_analysis` a
-                ON p.sku = a.sku
+            LEFT JOIN `{self.dataset_ref}.product_embeddings` e
+                ON p.sku = e.sku
+            WHERE e.sku IS NULL OR e.image_uri != i.uri
+        ) S
+        ON T.sku = S.sku
+        WHEN MATCHED THEN
+            UPDATE SET image_uri = S.image_uri, embedding = S.embedding
+        WHEN NOT MATCHED THEN
+            INSERT (sku, image_uri, embedding) VALUES (sku, image_uri, embedding);
+        
+        MERGE `{self.dataset_ref}.product_embeddings_short` T
+        USING (
+            SELECT 
+                sku,
+                image_uri,
+                {self._short_embedding_sql('embedding')} AS embedding
+            FROM `{self.dataset_ref}.product_embeddings`
+        ) S
+        ON T.sku = S.sku
+        WHEN MATCHED AND T.image_uri != S.image_uri THEN
+            UPDATE SET image_uri = S.image_uri, embedding = S.embedding
+        WHEN NOT MATCHED THEN
+            INSERT (sku, image_uri, embedding) VALUES (sku, image_uri, embedding)
+        """
+        
+        return query
+    
+    @staticmethod
+    def _short_embedding_sql(column: str) -> str:
+        """SQL for the leading SHORT_EMBEDDING_DIMS of an embedding, L2-normalized"""
+        return (f"ML.NORMALIZER(ARRAY(SELECT x FROM UNNEST({column}) AS x WITH OFFSET o "
+                f"WHERE o < {SHORT_EMBEDDING_DIMS} ORDER BY o), 2)")
+    
+    def create_products_enriched_table(self) -> str:
+        """
+        Build the DDL that nests each product's image analysis into the product row
+        
+        Every builder here reads products_enriched, so none of them joins
+        products to image_analysis at query time. Each product keeps one row
+        with one analysis struct, even when it has several analysis rows;
+        analysis is NULL for products without one, and quality_score is stored
+        as FLOAT64 so no query casts it. Re-run after image analysis.
+        """
+        query = f"""
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.products_enriched` AS
+        SELECT 
+            p.*,
+            a.analysis
+        FROM `{self.dataset_ref}.products` p
+        LEFT JOIN (
+            SELECT 
+                sku,
+                ARRAY_AGG(STRUCT(
+                    primary_color,
+                    detected_style,
+                    detected_pattern,
+                    detected_texture,
+                    style_category,
+                    formality_score,
+                    SAFE_CAST(quality_score AS FLOAT64) AS quality_score
+                ) LIMIT 1)[OFFSET(0)] AS analysis
+            FROM `{self.dataset_ref}.image_analysis`
+            GROUP BY sku
+        ) a
+            ON p.sku = a.sku
+        """
+        
+        return query
+    
+    def create_color_functions(self) -> str:
+        """
+        Build the DDL for the persistent color UDFs used by the outfit and style queries
+        """
+        codes = '\n                '.join(
+            f"WHEN '{color}' THEN {code}" for color, code in self.color_codes.items()
+        )
+        # First matching family wins when a color belongs to several
+        families = ',\n                    '.join(
+            f"STRUCT({i} AS ord, {colors} AS colors)"
+            for i, colors in enumerate(self.color_families.values())
+        )
+        query = f"""
+        CREATE OR REPLACE FUNCTION `{self.dataset_ref}.color_code`(color STRING)
+        RETURNS INT64 AS (
+            CASE LOWER(color)
+                {codes}
+                ELSE -1
+            END
+        );
+        
+        CREATE OR REPLACE FUNCTION `{self.dataset_ref}.similar_colors`(color STRING)
+        RETURNS ARRAY<STRING> AS (
+            IFNULL(
+                (
+                    SELECT f.colors
+                    FROM UNNEST([
+                    {families}
+                    ]) f
+                    WHERE LOWER(color) IN UNNEST(f.colors)
+                    ORDER BY f.ord
+                    LIMIT 1
+                ),
+                [color]
+            )
+        )
+        """
+        
+        return query
+    
+    def build_visual_search_query(self, query: VisualSearchQuery,
+                                  query_embedding: Optional[np.ndarray] = None
+                                  ) -> Tuple[str, QueryParams]:
+        """
+        Build BigQuery query and parameters for visual search
+        
+        Requires create_product_embeddings_table to have been run, which
+        also builds the vector index searched here. The query image is
+        embedded client-side (cached by URI) unless query_embedding is given.
+        
+        Candidates come from the short embeddings and are re-ranked on the
+        full ones.
+        """
+        if query_embedding is None:
+            query_embedding = self._get_or_embed(query.image_uri)
+        query_embedding = np.asarray(query_embedding, dtype=np.float64)
+        short_embedding = query_embedding[:SHORT_EMBEDDING_DIMS]
+        short_embedding = short_embedding / (np.linalg.norm(short_embedding) or 1.0)
+        params = [
+            bigquery.ArrayQueryParameter('query_embedding', 'FLOAT64', query_embedding.tolist()),
+            bigquery.ArrayQueryParameter('query_embedding_short', 'FLOAT64', short_embedding.tolist()),
+            bigquery.ScalarQueryParameter('image_uri', 'STRING', query.image_uri)
+        ]
+        
+        # Base query over the catalog, reading only the columns returned
+        base_query = f"""
+        WITH product_catalog AS (
+            SELECT 
+                p.sku,
+                p.product_name,
+                p.brand_name,
+                p.price,
+                p.category,
+                p.analysis.primary_color
+            FROM `{self.dataset_ref}.products_enriched` p
             WHERE 1=1
         """
         
@@ -104,26 +363,57 @@ class VisualSearchEngine:
         filters = []
         
         if query.category_filter:
-            categories = "','".join(query.category_filter)
-            filters.append(f"p.category IN ('{categories}')")
+            filters.append("p.category IN UNNEST(@categories)")
+            params.append(bigquery.ArrayQueryParameter('categories', 'STRING', query.category_filter))
         
         if query.brand_filter:
-            brands = "','".join(query.brand_filter)
-            filters.append(f"p.brand_name IN ('{brands}')")
+            filters.append("p.brand_name IN UNNEST(@brands)")
+            params.append(bigquery.ArrayQueryParameter('brands', 'STRING', query.brand_filter))
         
         if query.price_range:
-            filters.append(f"p.price BETWEEN {query.price_range[0]} AND {query.price_range[1]}")
+            filters.append("p.price BETWEEN @price_min AND @price_max")
+            params.append(bigquery.ScalarQueryParameter('price_min', 'FLOAT64', query.price_range[0]))
+            params.append(bigquery.ScalarQueryParameter('price_max', 'FLOAT64', query.price_range[1]))
         
         if query.color_filter:
-            colors = "','".join(query.color_filter)
-            filters.append(f"a.primary_color IN ('{colors}')")
+            filters.append("p.analysis.primary_color IN UNNEST(@colors)")
+            params.append(bigquery.ArrayQueryParameter('colors', 'STRING', query.color_filter))
         
+        # Unfiltered searches use the IVF index over the whole table; filtered
+        # ones search only the embeddings of the matching SKUs, so a selective
+        # filter still returns a full page
+        search_table = f"TABLE `{self.dataset_ref}.product_embeddings_short`"
         if filters:
             base_query = base_query.replace("WHERE 1=1", f"WHERE {' AND '.join(filters)}")
+            search_table = f"""(
+                SELECT pe.sku, pe.embedding
+                FROM `{self.dataset_ref}.product_embeddings_short` pe
+                JOIN product_catalog f
+                    ON pe.sku = f.sku
+            )"""
         
-        # Complete query with similarity calculation
+        # Rows come back nearest first, so row order is the similarity rank
         full_query = f"""
         {base_query}
+        ),
+        candidates AS (
+            SELECT vs.base.sku
+            FROM VECTOR_SEARCH(
+                {search_table},
+                'embedding',
+                (SELECT @query_embedding_short AS embedding),
+                top_k => {RERANK_CANDIDATES},
+                distance_type => 'COSINE'
+            ) vs
+        ),
+        reranked AS (
+            SELECT 
+                pe.sku,
+                pe.image_uri,
+                ML.DISTANCE(pe.embedding, @query_embedding, 'COSINE') as distance
+            FROM `{self.dataset_ref}.product_embeddings` pe
+            JOIN candidates c
+                ON pe.sku = c.sku
         )
         SELECT 
             pc.sku,
@@ -131,39 +421,51 @@ class VisualSearchEngine:
             pc.brand_name,
             pc.price,
             pc.category,
-            pc.image_uri,
+            r.image_uri,
             pc.primary_color,
-            ML.DISTANCE(qe.embedding, pc.embedding, 'COSINE') as visual_distance,
-            1 - ML.DISTANCE(qe.embedding, pc.embedding, 'COSINE') as similarity_score,
-            RANK() OVER (ORDER BY ML.DISTANCE(qe.embedding, pc.embedding, 'COSINE') ASC) as similarity_rank
-        FROM query_embedding qe
-        CROSS JOIN product_catalog pc
-        WHERE pc.image_uri != '{query.image_uri}'
+            r.distance as visual_distance,
+            1 - r.distance as similarity_score
+        FROM product_catalog pc
+        JOIN reranked r
+            ON pc.sku = r.sku
+        WHERE (@image_uri IS NULL OR r.image_uri != @image_uri)
         ORDER BY visual_distance ASC
         LIMIT 50
         """
         
-        return full_query
+        return full_query, params
     
-    def find_style_matches(self, reference_sku: str, style_attributes: Dict[str, Any]) -> str:
+    def find_style_matches(self, reference_sku: str,
+                           style_attributes: Dict[str, Any]) -> Tuple[str, QueryParams]:
         """
         Find products matching a specific style profile
+        
+        Runs as a script: the reference attributes are read into variables
+        once rather than cross joined into every candidate row. Requires
+        create_color_functions to have been run.
         """
         query = f"""
-        WITH reference_product AS (
-            SELECT 
-                p.*,
-                a.primary_color,
-                a.detected_pattern,
-                a.detected_texture,
-                a.style_category,
-                a.formality_score
-            FROM `{self.dataset_ref}.products` p
-            JOIN `{self.dataset_ref}.image_analysis` a
-                ON p.sku = a.sku
-            WHERE p.sku = '{reference_sku}'
-        ),
-        style_scoring AS (
+        DECLARE ref_sku STRING;
+        DECLARE ref_color STRING;
+        DECLARE ref_pattern STRING;
+        DECLARE ref_style STRING;
+        DECLARE ref_formality FLOAT64;
+        DECLARE ref_similar_colors ARRAY<STRING>;
+        
+        SET (ref_sku, ref_color, ref_pattern, ref_style, ref_formality, ref_similar_colors) = (
+            SELECT AS STRUCT 
+                p.sku,
+                p.analysis.primary_color,
+                p.analysis.detected_pattern,
+                p.analysis.style_category,
+                p.analysis.formality_score,
+                `{self.dataset_ref}.similar_colors`(p.analysis.primary_color)
+            FROM `{self.dataset_ref}.products_enriched` p
+            WHERE p.sku = @reference_sku
+                AND p.analysis IS NOT NULL
+        );
+        
+        WITH style_scoring AS (
             SELECT 
                 p.sku,
                 p.product_name,
@@ -171,40 +473,35 @@ class VisualSearchEngine:
                 p.price,
                 p.category,
                 p.image_uri,
-                a.primary_color,
-                a.style_category,
+                p.analysis.primary_color,
+                p.analysis.style_category,
                 -- Color similarity
                 CASE 
-                    WHEN a.primary_color = r.primary_color THEN 1.0
-                    WHEN a.primary_color IN (
-                        SELECT color 
-                        FROM UNNEST({self._get_similar_colors('r.primary_color')}) as color
-                    ) THEN 0.8
+                    WHEN p.analysis.primary_color = ref_color THEN 1.0
+                    WHEN p.analysis.primary_color IN UNNEST(ref_similar_colors) THEN 0.8
                     ELSE 0.3
                 END * {self.style_weights['color']} as color_score,
                 
                 -- Pattern similarity
                 CASE 
-                    WHEN a.detected_pattern = r.detected_pattern THEN 1.0
-                    WHEN a.detected_pattern IS NULL OR r.detected_pattern IS NULL THEN 0.5
+                    WHEN p.analysis.detected_pattern = ref_pattern THEN 1.0
+                    WHEN p.analysis.detected_pattern IS NULL OR ref_pattern IS NULL THEN 0.5
                     ELSE 0.2
                 END * {self.style_weights['pattern']} as pattern_score,
                 
                 -- Style category match
                 CASE 
-                    WHEN a.style_category = r.style_category THEN 1.0
+                    WHEN p.analysis.style_category = ref_style THEN 1.0
                     ELSE 0.3
                 END * {self.style_weights['category']} as category_score,
                 
                 -- Formality similarity
-                (1 - ABS(IFNULL(a.formality_score, 0.5) - IFNULL(r.formality_score, 0.5))) 
+                (1 - ABS(IFNULL(p.analysis.formality_score, 0.5) - IFNULL(ref_formality, 0.5))) 
                     * {self.style_weights['formality']} as formality_score
                 
-            FROM `{self.dataset_ref}.products` p
-            JOIN `{self.dataset_ref}.image_analysis` a
-                ON p.sku = a.sku
-            CROSS JOIN reference_product r
-            WHERE p.sku != r.sku
+            FROM `{self.dataset_ref}.products_enriched` p
+            WHERE p.sku != ref_sku
+                AND p.analysis IS NOT NULL
         )
         SELECT 
             sku,
@@ -225,14 +522,19 @@ class VisualSearchEngine:
         FROM style_scoring
         WHERE (color_score + pattern_score + category_score + formality_score) > 0.5
         ORDER BY style_match_score DESC
-        LIMIT 20
+        LIMIT 20;
         """
+        params = [bigquery.ScalarQueryParameter('reference_sku', 'STRING', reference_sku)]
         
-        return query
+        return query, params
     
-    def find_outfit_combinations(self, base_product_sku: str, outfit_type: str = 'casual') -> str:
+    def find_outfit_combinations(self, base_product_sku: str,
+                                 outfit_type: str = 'casual') -> Tuple[str, QueryParams]:
         """
         Find complementary products for outfit building
+        
+        Runs as a script, reading the base item into variables once.
+        Requires create_color_functions to have been run.
         """
         # Define outfit rules
         outfit_rules = {
@@ -257,54 +559,74 @@ class VisualSearchEngine:
         }
         
         query = f"""
-        WITH base_item AS (
-            SELECT 
-                p.*,
-                a.primary_color,
-                a.style_category,
-                a.formality_score,
-                CASE 
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['tops']} THEN 'top'
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['bottoms']} THEN 'bottom'
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['footwear']} THEN 'footwear'
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['accessories']} THEN 'accessory'
-                    ELSE 'other'
-                END as item_type
-            FROM `{self.dataset_ref}.products` p
-            JOIN `{self.dataset_ref}.image_analysis` a
-                ON p.sku = a.sku
-            WHERE p.sku = '{base_product_sku}'
-        ),
-        complementary_items AS (
-            SELECT 
+        DECLARE base_item_sku STRING;
+        DECLARE base_color STRING;
+        DECLARE base_gender STRING;
+        DECLARE base_item_type STRING;
+        DECLARE base_code INT64;
+        
+        SET (base_item_sku, base_color, base_gender, base_item_type, base_code) = (
+            SELECT AS STRUCT 
                 p.sku,
-                p.product_name,
-                p.brand_name,
-                p.price,
-                p.category,
-                p.subcategory,
-                p.image_uri,
-                a.primary_color,
+                p.analysis.primary_color,
+                p.gender,
                 CASE 
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['tops']} THEN 'top'
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['bottoms']} THEN 'bottom'
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['footwear']} THEN 'footwear'
-                    WHEN p.subcategory IN {outfit_rules[outfit_type]['accessories']} THEN 'accessory'
+                    WHEN p.subcategory IN UNNEST(@tops) THEN 'top'
+                    WHEN p.subcategory IN UNNEST(@bottoms) THEN 'bottom'
+                    WHEN p.subcategory IN UNNEST(@footwear) THEN 'footwear'
+                    WHEN p.subcategory IN UNNEST(@accessories) THEN 'accessory'
                     ELSE 'other'
-                END as item_type,
-                -- Color harmony score
-                CASE 
-                    WHEN a.primary_color = b.primary_color THEN 0.8  -- Monochromatic
-                    WHEN {self._check_complementary_colors('a.primary_color', 'b.primary_color')} THEN 1.0
-                    WHEN {self._check_analogous_colors('a.primary_color', 'b.primary_color')} THEN 0.9
-                    ELSE 0.5
-                END as color_harmony_score
-            FROM `{self.dataset_ref}.products` p
-            JOIN `{self.dataset_ref}.image_analysis` a
-                ON p.sku = a.sku
-            CROSS JOIN base_item b
-            WHERE p.sku != b.sku
-                AND p.gender IN (b.gender, 'unisex')
+                END,
+                `{self.dataset_ref}.color_code`(p.analysis.primary_color)
+            FROM `{self.dataset_ref}.products_enriched` p
+            WHERE p.sku = @base_sku
+                AND p.analysis IS NOT NULL
+        );
+        
+        WITH complementary_items AS (
+            SELECT 
+                *,
+                -- Color harmony score: monochromatic 0.8, complementary 1.0,
+                -- analogous 0.9, anything else 0.5
+                0.8 * is_monochromatic + 1.0 * is_complementary + 0.9 * is_analogous +
+                0.5 * (1 - is_monochromatic - is_complementary - is_analogous) as color_harmony_score
+            FROM (
+                SELECT 
+                    p.sku,
+                    p.product_name,
+                    p.brand_name,
+                    p.price,
+                    p.category,
+                    p.subcategory,
+                    p.image_uri,
+                    p.analysis.primary_color,
+                    CASE 
+                        WHEN p.subcategory IN UNNEST(@tops) THEN 'top'
+                        WHEN p.subcategory IN UNNEST(@bottoms) THEN 'bottom'
+                        WHEN p.subcategory IN UNNEST(@footwear) THEN 'footwear'
+                        WHEN p.subcategory IN UNNEST(@accessories) THEN 'accessory'
+                        ELSE 'other'
+                    END as item_type,
+                    CAST(IFNULL(p.analysis.primary_color = base_color, FALSE) AS INT64) as is_monochromatic,
+                    CAST(code >= 0 AND base_code >= 0 AND (code < 6) = (base_code < 6)
+                         AND ABS(code - base_code) = 3 AS INT64) as is_complementary,
+                    CAST(code BETWEEN 0 AND 5 AND base_code BETWEEN 0 AND 5
+                         AND MOD(ABS(code - base_code), 6) IN (1, 5) AS INT64) as is_analogous
+                FROM `{self.dataset_ref}.products_enriched` p
+                CROSS JOIN UNNEST([`{self.dataset_ref}.color_code`(p.analysis.primary_color)]) AS code
+                WHERE p.sku != base_item_sku
+                    AND p.gender IN (base_gender, 'unisex')
+                    AND p.analysis IS NOT NULL
+            )
+        ),
+        top_items AS (
+            SELECT *
+            FROM complementary_items
+            WHERE item_type != base_item_type
+                AND item_type != 'other'
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY item_type ORDER BY color_harmony_score DESC
+            ) <= 3
         )
         SELECT 
             item_type,
@@ -319,59 +641,190 @@ class VisualSearchEngine:
                     color_harmony_score
                 )
                 ORDER BY color_harmony_score DESC
-                LIMIT 3
             ) as recommendations
-        FROM complementary_items
-        WHERE item_type != (SELECT item_type FROM base_item)
-            AND item_type != 'other'
-        GROUP BY item_type
+        FROM top_items
+        GROUP BY item_type;
         """
+        rules = outfit_rules[outfit_type]
+        params = [
+            bigquery.ScalarQueryParameter('base_sku', 'STRING', base_product_sku),
+            bigquery.ArrayQueryParameter('tops', 'STRING', rules['tops']),
+            bigquery.ArrayQueryParameter('bottoms', 'STRING', rules['bottoms']),
+            bigquery.ArrayQueryParameter('footwear', 'STRING', rules['footwear']),
+            bigquery.ArrayQueryParameter('accessories', 'STRING', rules['accessories'])
+        ]
         
-        return query
+        return query, params
     
-    def trending_visual_styles(self, timeframe_days: int = 30) -> str:
+    def create_partitioned_engagement_tables(self) -> str:
         """
-        Identify trending visual styles based on engagement
+        Build the DDL for date-partitioned copies of the engagement and conversion tables
+        
+        The trend queries read only the partitions inside their timeframe.
+        Queries on these tables must filter on the partition date. This is a
+        one-off build; refresh_trend_norms re-syncs the partitions inside its
+        timeframe from the source tables on every run.
         """
         query = f"""
-        WITH style_engagement AS (
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.product_engagement_partitioned`
+        PARTITION BY event_date
+        CLUSTER BY sku
+        OPTIONS (require_partition_filter = TRUE)
+        AS SELECT * FROM `{self.dataset_ref}.product_engagement`;
+        
+        CREATE OR REPLACE TABLE `{self.dataset_ref}.conversions_partitioned`
+        PARTITION BY order_date
+        CLUSTER BY sku
+        OPTIONS (require_partition_filter = TRUE)
+        AS SELECT * FROM `{self.dataset_ref}.conversions`
+        """
+        
+        return query
+    
+    def _style_engagement_sql(self) -> str:
+        """Per-style engagement over the last @tf_days days"""
+        return f"""
             SELECT 
-                a.style_category,
-                a.primary_color,
-                a.detected_pattern,
+                p.analysis.style_category,
+                p.analysis.primary_color,
+                p.analysis.detected_pattern,
                 COUNT(DISTINCT e.user_id) as unique_viewers,
                 SUM(e.view_duration) as total_view_time,
                 COUNT(DISTINCT c.order_id) as conversions,
                 AVG(p.rating) as avg_rating
-            FROM `{self.dataset_ref}.image_analysis` a
-            JOIN `{self.dataset_ref}.products` p
-                ON a.sku = p.sku
-            LEFT JOIN `{self.dataset_ref}.product_engagement` e
+            FROM `{self.dataset_ref}.products_enriched` p
+            LEFT JOIN (
+                SELECT sku, user_id, view_duration
+                FROM `{self.dataset_ref}.product_engagement_partitioned`
+                WHERE event_date >= DATE_SUB(CURRENT_DATE(), INTERVAL @tf_days DAY)
+            ) e
                 ON p.sku = e.sku
-                AND e.event_date >= DATE_SUB(CURRENT_DATE(), INTERVAL {timeframe_days} DAY)
-            LEFT JOIN `{self.dataset_ref}.conversions` c
+            LEFT JOIN (
+                SELECT sku, order_id
+                FROM `{self.dataset_ref}.conversions_partitioned`
+                WHERE order_date >= DATE_SUB(CURRENT_DATE(), INTERVAL @tf_days DAY)
+            ) c
                 ON p.sku = c.sku
-                AND c.order_date >= DATE_SUB(CURRENT_DATE(), INTERVAL {timeframe_days} DAY)
-            GROUP BY a.style_category, a.primary_color, a.detected_pattern
+            WHERE p.analysis IS NOT NULL
+            GROUP BY p.analysis.style_category, p.analysis.primary_color, p.analysis.detected_pattern
+        """
+    
+    def refresh_trend_norms(self, timeframe_days: int = 30) -> Tuple[str, QueryParams]:
+        """
+        Build the nightly job that records today's trend score normalisers
+        
+        trending_visual_styles divides by these instead of recomputing the
+        maxima over every style on each call. The job first replaces the last
+        `timeframe_days` of the partitioned engagement copies with the source
+        rows, so run it with the longest timeframe the trend queries use.
+        """
+        query = f"""
+        DECLARE sync_from DATE DEFAULT DATE_SUB(CURRENT_DATE(), INTERVAL @tf_days DAY);
+        
+        -- Re-sync the timeframe's partitions so trend reads never see a stale copy
+        BEGIN TRANSACTION;
+        
+        DELETE FROM `{self.dataset_ref}.product_engagement_partitioned`
+        WHERE event_date >= sync_from;
+        
+        INSERT INTO `{self.dataset_ref}.product_engagement_partitioned`
+        SELECT * FROM `{self.dataset_ref}.product_engagement`
+        WHERE event_date >= sync_from;
+        
+        DELETE FROM `{self.dataset_ref}.conversions_partitioned`
+        WHERE order_date >= sync_from;
+        
+        INSERT INTO `{self.dataset_ref}.conversions_partitioned`
+        SELECT * FROM `{self.dataset_ref}.conversions`
+        WHERE order_date >= sync_from;
+        
+        COMMIT TRANSACTION;
+        
+        CREATE TABLE IF NOT EXISTS `{self.dataset_ref}.trend_norms_daily` (
+            d DATE,
+            tf_days INT64,
+            max_viewers INT64,
+            max_conversions INT64
+        )
+        PARTITION BY d;
+        
+        MERGE `{self.dataset_ref}.trend_norms_daily` T
+        USING (
+            SELECT 
+                CURRENT_DATE() as d,
+                @tf_days as tf_days,
+                MAX(unique_viewers) as max_viewers,
+                MAX(conversions) as max_conversions
+            FROM ({self._style_engagement_sql()})
+        ) S
+        ON T.d = S.d AND T.tf_days = S.tf_days
+        WHEN MATCHED THEN
+            UPDATE SET max_viewers = S.max_viewers, max_conversions = S.max_conversions
+        WHEN NOT MATCHED THEN
+            INSERT (d, tf_days, max_viewers, max_conversions)
+            VALUES (d, tf_days, max_viewers, max_conversions)
+        """
+        params = [bigquery.ScalarQueryParameter('tf_days', 'INT64', timeframe_days)]
+        
+        return query, params
+    
+    def trending_visual_styles(self, timeframe_days: int = 30) -> Tuple[str, QueryParams]:
+        """
+        Identify trending visual styles based on engagement
+        
+        Runs as a script: normalises by the latest refresh_trend_norms row
+        for the same timeframe, and falls back to live maxima over
+        style_engagement when trend_norms_daily is missing or has no row yet.
+        """
+        query = f"""
+        DECLARE stored_max_viewers INT64;
+        DECLARE stored_max_conversions INT64;
+        
+        -- Only read the norms table when it exists; the nightly job may not have run yet
+        IF EXISTS (
+            SELECT 1
+            FROM `{self.dataset_ref}.INFORMATION_SCHEMA.TABLES`
+            WHERE table_name = 'trend_norms_daily'
+        ) THEN
+            SET (stored_max_viewers, stored_max_conversions) = (
+                SELECT AS STRUCT max_viewers, max_conversions
+                FROM `{self.dataset_ref}.trend_norms_daily`
+                WHERE d <= CURRENT_DATE()
+                    AND tf_days = @tf_days
+                ORDER BY d DESC
+                LIMIT 1
+            );
+        END IF;
+        
+        WITH style_engagement AS ({self._style_engagement_sql()}),
+        norms AS (
+            SELECT stored_max_viewers as max_viewers, stored_max_conversions as max_conversions
+            FROM UNNEST([1])
+            WHERE stored_max_viewers IS NOT NULL
+            UNION ALL
+            SELECT MAX(unique_viewers), MAX(conversions)
+            FROM style_engagement
+            WHERE stored_max_viewers IS NULL
         ),
         style_trends AS (
             SELECT 
-                style_category,
-                primary_color,
-                detected_pattern,
-                unique_viewers,
-                conversions,
-                conversions / NULLIF(unique_viewers, 0) as conversion_rate,
-                avg_rating,
+                s.style_category,
+                s.primary_color,
+                s.detected_pattern,
+                s.unique_viewers,
+                s.conversions,
+                s.conversions / NULLIF(s.unique_viewers, 0) as conversion_rate,
+                s.avg_rating,
                 -- Calculate trend score
                 (
-                    (unique_viewers / (SELECT MAX(unique_viewers) FROM style_engagement)) * 0.3 +
-                    (conversions / NULLIF((SELECT MAX(conversions) FROM style_engagement), 0)) * 0.4 +
-                    (conversions / NULLIF(unique_viewers, 0) / 0.1) * 0.2 +  -- Normalize conv rate
-                    (avg_rating / 5.0) * 0.1
+                    (s.unique_viewers / NULLIF(n.max_viewers, 0)) * 0.3 +
+                    (s.conversions / NULLIF(n.max_conversions, 0)) * 0.4 +
+                    (s.conversions / NULLIF(s.unique_viewers, 0) / 0.1) * 0.2 +  -- Normalize conv rate
+                    (s.avg_rating / 5.0) * 0.1
                 ) as trend_score
-            FROM style_engagement
-            WHERE unique_viewers >= 10  -- Minimum threshold
+            FROM style_engagement s
+            CROSS JOIN norms n
+            WHERE s.unique_viewers >= 10  -- Minimum threshold
         )
         SELECT 
             style_category,
@@ -385,49 +838,18 @@ class VisualSearchEngine:
             RANK() OVER (ORDER BY trend_score DESC) as trend_rank
         FROM style_trends
         ORDER BY trend_score DESC
-        LIMIT 20
+        LIMIT 20;
         """
+        params = [bigquery.ScalarQueryParameter('tf_days', 'INT64', timeframe_days)]
         
-        return query
-    
-    def _get_similar_colors(self, color: str) -> List[str]:
-        """Get colors from the same family"""
-        for family, colors in self.color_families.items():
-            if color.lower() in colors:
-                return colors
-        return [color]
-    
-    def _check_complementary_colors(self, color1: str, color2: str) -> bool:
-        """Check if colors are complementary"""
-        complementary_pairs = [
-            ('red', 'green'),
-            ('blue', 'orange'),
-            ('yellow', 'purple'),
-            ('black', 'white')
-        ]
-        
-        for pair in complementary_pairs:
-            if (color1 in pair and color2 in pair) and color1 != color2:
-                return True
-        return False
-    
-    def _check_analogous_colors(self, color1: str, color2: str) -> bool:
-        """Check if colors are analogous (next to each other on color wheel)"""
-        color_wheel = ['red', 'orange', 'yellow', 'green', 'blue', 'purple']
-        
-        try:
-            idx1 = color_wheel.index(color1.lower())
-            idx2 = color_wheel.index(color2.lower())
-            
-            # Check if adjacent on color wheel
-            return abs(idx1 - idx2) == 1 or abs(idx1 - idx2) == len(color_wheel) - 1
-        except ValueError:
-            return False
+        return query, params
 
 
 class VisualMerchandisingOptimizer:
     """
     Optimize product presentation using visual analytics
+    
+    Reads products_enriched (see VisualSearchEngine.create_products_enriched_table).
     """
     
     def __init__(self, project_id: str, dataset_id: str):
@@ -435,7 +857,8 @@ class VisualMerchandisingOptimizer:
         self.dataset_id = dataset_id
         self.dataset_ref = f"{project_id}.{dataset_id}"
         
-    def optimize_gallery_layout(self, category: str, layout_type: str = 'grid') -> str:
+    def optimize_gallery_layout(self, category: str,
+                                layout_type: str = 'grid') -> Tuple[str, QueryParams]:
         """
         Optimize product gallery layout for visual appeal and conversion
         """
@@ -446,31 +869,26 @@ class VisualMerchandisingOptimizer:
                 p.product_name,
                 p.price,
                 p.image_uri,
-                a.primary_color,
-                a.quality_score,
-                a.style_category,
-                -- Visual diversity score
-                COUNT(DISTINCT a.primary_color) OVER (
-                    PARTITION BY p.category 
-                    ORDER BY p.popularity_score DESC 
-                    ROWS BETWEEN 3 PRECEDING AND 3 FOLLOWING
-                ) as color_diversity,
-                -- Price diversity
-                STDDEV(p.price) OVER (
-                    PARTITION BY p.category 
-                    ORDER BY p.popularity_score DESC 
-                    ROWS BETWEEN 3 PRECEDING AND 3 FOLLOWING
-                ) as price_diversity,
+                p.analysis.primary_color,
+                p.analysis.quality_score,
+                p.analysis.style_category,
                 -- Combined score
                 p.popularity_score * 0.4 +
-                CAST(a.quality_score AS FLOAT64) * 0.3 +
+                p.analysis.quality_score * 0.3 +
                 p.conversion_rate * 0.3 as display_score
-            FROM `{self.dataset_ref}.products` p
-            JOIN `{self.dataset_ref}.image_analysis` a
-                ON p.sku = a.sku
-            WHERE p.category = '{category}'
+            FROM `{self.dataset_ref}.products_enriched` p
+            WHERE p.category = @category
                 AND p.is_active = TRUE
-                AND a.quality_score >= 0.6
+                AND p.analysis.quality_score >= 0.6
+        ),
+        ranked AS (
+            SELECT 
+                *,
+                -- Assign to layout position; masonry breaks score ties randomly
+                ROW_NUMBER() OVER (
+                    ORDER BY display_score DESC, IF(@layout_type = 'masonry', RAND(), 0)
+                ) as position
+            FROM product_visual_scores
         ),
         layout_optimization AS (
             SELECT 
@@ -480,22 +898,14 @@ class VisualMerchandisingOptimizer:
                 image_uri,
                 primary_color,
                 display_score,
-                -- Assign to layout position
-                CASE 
-                    WHEN '{layout_type}' = 'grid' THEN 
-                        ROW_NUMBER() OVER (ORDER BY display_score DESC)
-                    WHEN '{layout_type}' = 'masonry' THEN 
-                        ROW_NUMBER() OVER (ORDER BY display_score DESC, RAND())
-                    ELSE 
-                        ROW_NUMBER() OVER (ORDER BY display_score DESC)
-                END as position,
+                position,
                 -- Determine prominence
                 CASE 
-                    WHEN ROW_NUMBER() OVER (ORDER BY display_score DESC) <= 4 THEN 'hero'
-                    WHEN ROW_NUMBER() OVER (ORDER BY display_score DESC) <= 12 THEN 'featured'
+                    WHEN position <= 4 THEN 'hero'
+                    WHEN position <= 12 THEN 'featured'
                     ELSE 'standard'
                 END as display_prominence
-            FROM product_visual_scores
+            FROM ranked
         )
         SELECT 
             position,
@@ -510,8 +920,12 @@ class VisualMerchandisingOptimizer:
         ORDER BY position
         LIMIT 48  -- Typical page size
         """
+        params = [
+            bigquery.ScalarQueryParameter('category', 'STRING', category),
+            bigquery.ScalarQueryParameter('layout_type', 'STRING', layout_type)
+        ]
         
-        return query
+        return query, params
     
     def analyze_visual_performance(self) -> str:
         """
@@ -520,41 +934,48 @@ class VisualMerchandisingOptimizer:
         query = f"""
         WITH visual_engagement AS (
             SELECT 
-                a.primary_color,
-                a.detected_pattern,
-                a.style_category,
-                a.quality_score,
+                p.analysis.primary_color,
+                p.analysis.detected_pattern,
+                p.analysis.style_category,
+                p.analysis.quality_score,
                 AVG(e.view_duration) as avg_view_duration,
                 AVG(e.click_through_rate) as avg_ctr,
                 AVG(c.conversion_rate) as avg_conversion_rate,
                 COUNT(DISTINCT p.sku) as product_count
-            FROM `{self.dataset_ref}.image_analysis` a
-            JOIN `{self.dataset_ref}.products` p
-                ON a.sku = p.sku
+            FROM `{self.dataset_ref}.products_enriched` p
             JOIN `{self.dataset_ref}.product_engagement` e
                 ON p.sku = e.sku
             JOIN `{self.dataset_ref}.conversion_metrics` c
                 ON p.sku = c.sku
-            GROUP BY a.primary_color, a.detected_pattern, a.style_category, a.quality_score
+            WHERE p.analysis IS NOT NULL
+            GROUP BY p.analysis.primary_color, p.analysis.detected_pattern, p.analysis.style_category, p.analysis.quality_score
             HAVING product_count >= 5  -- Statistical significance
+        ),
+        norms AS (
+            SELECT 
+                AVG(avg_ctr) as mean_ctr,
+                AVG(avg_conversion_rate) as mean_conversion_rate,
+                AVG(avg_view_duration) as mean_view_duration
+            FROM visual_engagement
         )
         SELECT 
-            primary_color,
-            detected_pattern,
-            style_category,
-            ROUND(AVG(CAST(quality_score AS FLOAT64)), 2) as avg_quality_score,
-            ROUND(avg_view_duration, 2) as avg_view_duration_sec,
-            ROUND(avg_ctr * 100, 2) as avg_ctr_pct,
-            ROUND(avg_conversion_rate * 100, 2) as avg_conversion_pct,
-            product_count,
+            v.primary_color,
+            v.detected_pattern,
+            v.style_category,
+            ROUND(v.quality_score, 2) as avg_quality_score,
+            ROUND(v.avg_view_duration, 2) as avg_view_duration_sec,
+            ROUND(v.avg_ctr * 100, 2) as avg_ctr_pct,
+            ROUND(v.avg_conversion_rate * 100, 2) as avg_conversion_pct,
+            v.product_count,
             -- Performance index
             ROUND(
-                (avg_ctr / (SELECT AVG(avg_ctr) FROM visual_engagement)) * 0.3 +
-                (avg_conversion_rate / (SELECT AVG(avg_conversion_rate) FROM visual_engagement)) * 0.5 +
-                (avg_view_duration / (SELECT AVG(avg_view_duration) FROM visual_engagement)) * 0.2,
+                (v.avg_ctr / n.mean_ctr) * 0.3 +
+                (v.avg_conversion_rate / n.mean_conversion_rate) * 0.5 +
+                (v.avg_view_duration / n.mean_view_duration) * 0.2,
                 2
             ) as performance_index
-        FROM visual_engagement
+        FROM visual_engagement v
+        CROSS JOIN norms n
         ORDER BY performance_index DESC
         """
         
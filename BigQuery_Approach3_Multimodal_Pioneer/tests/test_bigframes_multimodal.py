@@ -0,0 +1,149 @@
+"""
+Tests for the BigFrames engine's local helpers
+"""
+
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import bigframes_multimodal  # noqa: E402
+from bigframes_multimodal import BigFramesMultimodalEngine  # noqa: E402
+
+
+class _FrameModel:
+    """Stub model whose predict returns a DataFrame in reverse row order, like a shuffled BigFrames result"""
+
+    def predict(self, uris, prompt=None):
+        reversed_uris = uris.iloc[::-1]
+        return pd.DataFrame({
+            'ml_generate_text_llm_result': [f"analysis of {uri}" for uri in reversed_uris],
+            'image_uri': reversed_uris.to_list(),
+        }, index=reversed_uris.index)
+
+
+class _EmbeddingsClient:
+    """Stands in for bigquery.Client; list_rows yields a fixed embeddings table"""
+
+    def __init__(self, rows):
+        self.table = pa.Table.from_pylist(rows, schema=pa.schema([
+            ('image_uri', pa.string()), ('image_embedding', pa.list_(pa.float64()))
+        ]))
+
+    def get_table(self, table_id):
+        return table_id
+
+    def list_rows(self, table):
+        return self
+
+    def to_arrow(self, bqstorage_client=None):
+        return self.table
+
+
+def _engine() -> BigFramesMultimodalEngine:
+    engine = BigFramesMultimodalEngine('project', 'dataset', 'bucket')
+    engine._predict_retry = lambda predict: predict
+    return engine
+
+
+def _pages(n_pages: int, page_size: int):
+    for page in range(n_pages):
+        index = range(page * page_size, (page + 1) * page_size)
+        yield pd.DataFrame({'sku': [f"SKU{i}" for i in index],
+                            'image_uri': [f"gs://b/{i}.jpg" for i in index]}, index=index)
+
+
+def test_predict_pipelined_reads_result_column_aligned_on_index():
+    engine = _engine()
+
+    df = asyncio.run(engine._predict_pipelined(_FrameModel(), _pages(4, 3), 'analysis', prompt='p'))
+
+    assert list(df.index) == list(range(12))
+    assert (df['analysis'] == 'analysis of ' + df['image_uri']).all()
+
+
+def test_predict_pipelined_fills_failed_pages_with_none():
+    engine = _engine()
+    engine._predict_safe = lambda model, uris, **kwargs: None
+
+    df = asyncio.run(engine._predict_pipelined(_FrameModel(), _pages(2, 2), 'analysis', prompt='p'))
+
+    assert df['analysis'].isna().all()
+    assert len(df) == 4
+
+
+def test_analyze_images_at_scale_points_loop_callers_to_async_variant():
+    engine = _engine()
+
+    async def call_sync_api():
+        engine.analyze_images_at_scale('products')
+
+    with pytest.raises(RuntimeError, match='analyze_images_at_scale_async'):
+        asyncio.run(call_sync_api())
+
+
+def test_cluster_count_never_exceeds_product_count():
+    assert BigFramesMultimodalEngine._cluster_count(10) == 10
+    assert BigFramesMultimodalEngine._cluster_count(1000) == 64
+    assert BigFramesMultimodalEngine._cluster_count(1_000_000) == 1000
+
+
+def _search_engine(monkeypatch, rows, quantize=False) -> BigFramesMultimodalEngine:
+    engine = BigFramesMultimodalEngine('project', 'dataset', 'bucket', quantize=quantize)
+    # Searches only check the flag; the clients it would have built are stubbed below
+    monkeypatch.setattr(bigframes_multimodal, 'BIGFRAMES_AVAILABLE', True)
+    engine._bq_client = _EmbeddingsClient(rows)
+    engine._bqstorage_client = None
+    engine._embed_query = lambda uri: (1.0, 0.2, 0.0)
+    return engine
+
+
+def test_quantized_scores_approximate_fp32_dot_products():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(50, 16)).astype(np.float32)
+    query = rng.normal(size=16).astype(np.float32)
+
+    codes, scales = BigFramesMultimodalEngine._quantize_embeddings(embeddings)
+    query_codes, query_scales = BigFramesMultimodalEngine._quantize_embeddings(query[np.newaxis, :])
+    raw = codes.astype(np.int32) @ query_codes[0].astype(np.int32)
+    dots = BigFramesMultimodalEngine._dequantize_scores(raw, scales, query_scales[0])
+
+    assert codes.dtype == np.int8 and np.abs(codes).max() == 127
+    np.testing.assert_allclose(dots, embeddings @ query, atol=0.05 * np.abs(embeddings @ query).max())
+
+
+def test_quantize_keeps_zero_rows_finite():
+    codes, scales = BigFramesMultimodalEngine._quantize_embeddings(np.zeros((2, 4), dtype=np.float32))
+
+    assert not codes.any()
+    assert (scales == 1.0).all()
+
+
+@pytest.mark.parametrize('quantize', [False, True], ids=['fp32', 'int8'])
+def test_visual_search_ranks_nearest_first(monkeypatch, quantize):
+    rows = [
+        {'image_uri': 'gs://b/far.jpg', 'image_embedding': [0.0, 0.0, 1.0]},
+        {'image_uri': 'gs://b/near.jpg', 'image_embedding': [1.0, 0.25, 0.0]},
+        {'image_uri': 'gs://b/mid.jpg', 'image_embedding': [1.0, 1.0, 0.0]},
+    ]
+    engine = _search_engine(monkeypatch, rows, quantize=quantize)
+
+    results = engine.visual_search_at_scale('gs://b/query.jpg', 'embeddings', k=2)
+
+    assert results['image_uri'].tolist() == ['gs://b/near.jpg', 'gs://b/mid.jpg']
+    assert results['similarity'].iloc[0] == pytest.approx(1.0, abs=0.02)
+
+
+def test_visual_search_on_empty_embeddings_table_returns_no_rows(monkeypatch):
+    engine = _search_engine(monkeypatch, [])
+
+    results = engine.visual_search_at_scale('gs://b/query.jpg', 'embeddings', k=5)
+
+    assert results.empty
+    assert 'similarity' in results.columns
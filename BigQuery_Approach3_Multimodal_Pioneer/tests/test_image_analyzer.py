@@ -0,0 +1,122 @@
+"""
+Tests for attribute extraction, compliance checks and quality scoring
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import image_analyzer  # noqa: E402
+from image_analyzer import ComplianceChecker, ImageAttributeExtractor, QualityAnalyzer  # noqa: E402
+
+
+def _row_scores(analyzer: QualityAnalyzer, frame: pd.DataFrame) -> pd.DataFrame:
+    """Per-row analyze_quality metrics for comparison with the batch path"""
+    rows = []
+    for record in frame.to_dict('records'):
+        record = {k: v for k, v in record.items() if isinstance(v, (list, str)) or pd.notna(v)}
+        result = analyzer.analyze_quality(record)
+        rows.append({**result['metrics'], 'overall_score': result['overall_score']})
+    return pd.DataFrame(rows, index=frame.index)
+
+
+@pytest.fixture(params=[True, False], ids=['numba', 'numpy'])
+def score_path(request, monkeypatch):
+    """Run a scoring test through the JIT kernel and the NumPy fallback"""
+    monkeypatch.setattr(image_analyzer, 'NUMBA_AVAILABLE', request.param)
+
+
+def test_quality_batch_without_detected_colors(score_path):
+    analyzer = QualityAnalyzer()
+    frame = pd.DataFrame({'image_quality_score': [0.8, 0.4], 'full_analysis': ['soft shadow', '']})
+
+    batch = analyzer.analyze_quality_batch(frame)
+
+    expected = _row_scores(analyzer, frame)
+    pd.testing.assert_frame_equal(batch[expected.columns], expected, check_exact=False)
+
+
+def test_quality_batch_with_all_nan_detected_colors(score_path):
+    analyzer = QualityAnalyzer()
+    frame = pd.DataFrame({'image_quality_score': [0.8, 0.4], 'detected_colors': [np.nan, np.nan]})
+
+    batch = analyzer.analyze_quality_batch(frame)
+
+    expected = _row_scores(analyzer, frame)
+    pd.testing.assert_frame_equal(batch[expected.columns], expected, check_exact=False)
+
+
+def test_single_and_batch_scores_cover_every_branch(score_path):
+    analyzer = QualityAnalyzer()
+    frame = pd.DataFrame({
+        'image_quality_score': [0.8, 0.5, 0.2, 0.9],
+        'full_analysis': ['clean studio shot', 'soft shadow', '', ''],
+        'detected_colors': [['red', 'white'], ['black'], ['red', 'navy'], []],
+    })
+    expected = pd.DataFrame({
+        'resolution_score': [1.0, 0.6, 0.4, 1.0],
+        'lighting_score': [0.96, 0.35, 0.24, 1.0],
+        'background_score': [1.0, 0.7, 0.5, 0.5],
+    })
+
+    batch = analyzer.analyze_quality_batch(frame)
+    rows = _row_scores(analyzer, frame)
+
+    pd.testing.assert_frame_equal(batch[expected.columns], expected, check_exact=False)
+    pd.testing.assert_frame_equal(rows[expected.columns], expected, check_exact=False)
+    # analyze_quality reports plain floats, not one-element array scalars
+    metrics = analyzer.analyze_quality(frame.iloc[0].to_dict())['metrics']
+    assert all(type(value) is float for value in metrics.values())
+
+
+def _values(attributes, attribute_type):
+    return [attr.value for attr in attributes if attr.attribute_type == attribute_type]
+
+
+def test_compliance_matches_mixed_case_labels_in_lowercased_text():
+    checker = ComplianceChecker()
+    analysis = {
+        'compliance_labels': ['CE Mark', 'FCC ID: 2ABC'],
+        'detected_text': 'Input VOLTAGE 5V. Model Number X1. Battery Warning inside',
+        'image_quality_score': 0.9,
+    }
+
+    assert checker.check_compliance(analysis, 'electronics') == []
+
+    missing = checker.check_compliance({'image_quality_score': 0.9}, 'electronics')
+    assert [issue.description for issue in missing if issue.issue_type == 'missing_required_label'] == [
+        'Missing required label: CE mark', 'Missing required label: FCC',
+        'Missing required label: voltage', 'Missing required label: model number',
+    ]
+
+
+def test_brand_scan_skips_short_words_and_keeps_top_two():
+    extractor = ImageAttributeExtractor()
+    text = 'by LG and Nike Air, from ACME Corp or Sony'
+
+    brands = _values(extractor.extract_text_attributes({'detected_text': text}, 'home'), 'brand')
+
+    assert brands == ['Nike Air', 'ACME Corp']
+
+
+def test_model_number_alternation_reports_each_form_once():
+    extractor = ImageAttributeExtractor()
+    text = 'Model: xz-9 with part ABC-1234 and kit 123ABC'
+
+    models = _values(extractor.extract_text_attributes({'detected_text': text}, 'home'), 'model_number')
+
+    assert models == ['xz-9', 'ABC-1234', '123ABC']
+
+
+def test_color_standardization_is_memoized_per_extractor():
+    extractor = ImageAttributeExtractor()
+    colors = ['Navy', 'navy', 'Dark Crimson Red', 'Mystery', 'Navy']
+
+    assert [extractor._standardize_color(color) for color in colors] == ['blue', 'blue', 'red', 'Mystery', 'blue']
+    assert extractor._standardize_color.cache_info().hits == 1
+    assert ImageAttributeExtractor()._standardize_color.cache_info().currsize == 0
@@ -0,0 +1,25 @@
+"""
+Tests for the multimodal engine's local helpers
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from multimodal_engine import _upload_object_names  # noqa: E402
+
+
+def test_upload_object_names_keep_paths_relative_to_common_directory(tmp_path):
+    paths = [str(tmp_path / 'a' / 'img.jpg'), str(tmp_path / 'b' / 'img.jpg'), str(tmp_path / 'b' / 'c' / 'x.png')]
+
+    assert _upload_object_names(paths, 'product_images/') == [
+        'product_images/a/img.jpg', 'product_images/b/img.jpg', 'product_images/b/c/x.png'
+    ]
+
+
+def test_upload_object_names_for_files_in_one_directory_are_basenames(tmp_path):
+    paths = [str(tmp_path / 'one.jpg'), str(tmp_path / 'two.jpg')]
+
+    assert _upload_object_names(paths, 'p/') == ['p/one.jpg', 'p/two.jpg']
+    assert _upload_object_names([], 'p/') == []
@@ -0,0 +1,140 @@
+"""
+Tests for the QC check dispatch, result sink and local data checks
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import quality_control  # noqa: E402
+from quality_control import QCCheckResult, QCResultSink, QCStatus, QualityControlSystem  # noqa: E402
+
+
+def _check_row(**overrides):
+    """One fused-query row that passes every check, with `overrides` applied"""
+    row = {
+        'sku': 'SKU1', 'product_name': 'Tee', 'price': 20.0, 'category': 'apparel',
+        'brand_name': 'acme', 'listed_color': 'red', 'detected_color': 'red',
+        'desc_length': 80, 'category_avg_price': 20.0, 'quality_score': 0.9,
+        'compliance_labels': [], 'dup_count': 1, 'product_names': None, 'prices': None,
+        'standardized_brand': 'acme',
+    }
+    for _, pass_flag, *_ in QualityControlSystem('p', 'd')._check_table:
+        row[pass_flag] = True
+    row.update(overrides)
+    return row
+
+
+def test_check_table_covers_every_rule_once():
+    qc = QualityControlSystem('p', 'd')
+
+    rule_ids = [entry[0] for entry in qc._check_table]
+
+    assert sorted(rule_ids) == sorted(qc.rules)
+    assert len(set(rule_ids)) == len(rule_ids)
+
+
+def test_check_results_dispatch_details_and_fixes_per_rule():
+    qc = QualityControlSystem('p', 'd')
+    tbl = pa.Table.from_pylist([
+        _check_row(),
+        _check_row(sku='SKU2', detected_color='blue', color_check_pass=False),
+        _check_row(sku='SKU3', product_name=None, price=0.0, required_fields_pass=False,
+                   brand_name='ACME', brand_standard_pass=False),
+    ])
+
+    results = {r.rule_id: r for r in qc._check_results(tbl)}
+
+    assert set(results) == {'IMG003', 'DATA001', 'CONS002'}
+    color = results['IMG003']
+    assert (color.sku, color.status, color.confidence) == ('SKU2', QCStatus.WARNING, 0.85)
+    assert color.details == {'listed_color': 'red', 'detected_color': 'blue'}
+    assert color.suggested_fix == 'Update color to: blue'
+    assert color.message == qc.rules['IMG003'].error_message
+    assert results['DATA001'].details == {'missing_fields': ['product_name', 'price']}
+    assert results['DATA001'].suggested_fix is None
+    assert results['CONS002'].suggested_fix == 'Update brand to: acme'
+    assert [r.rule_id for r in qc._check_results(tbl, rule_ids=('CONS002',))] == ['CONS002']
+
+
+class _RecordingClient:
+    """Stands in for bigquery.Client, keeping every insert_rows_json batch"""
+
+    def __init__(self):
+        self.batches = []
+
+    def insert_rows_json(self, table_id, rows):
+        self.batches.append((table_id, rows))
+        return []
+
+
+def test_sink_flushes_full_batches_then_remainder():
+    client = _RecordingClient()
+    statuses = (QCStatus.FAILED, QCStatus.WARNING)
+    results = [
+        QCCheckResult(f"SKU{i}", 'IMG001', statuses[i % 2], 'msg', 0.9, {'quality_score': i / 1000})
+        for i in range(1201)
+    ]
+
+    with QCResultSink('p.d.qc_results', client) as sink:
+        for result in results:
+            sink.add(result)
+
+    assert [len(rows) for _, rows in client.batches] == [500, 500, 201]
+    assert {table_id for table_id, _ in client.batches} == {'p.d.qc_results'}
+    assert sink.rows_written == 1201
+
+    rows = [row for _, batch in client.batches for row in batch]
+    assert [row['sku'] for row in rows] == [r.sku for r in results]
+    assert [row['status'] for row in rows[:2]] == ['failed', 'warning']
+    assert set(rows[0]) == set(QCResultSink.COLUMNS)
+    assert json.loads(rows[700]['details']) == {'quality_score': 0.7}
+    assert rows[0]['timestamp'] == results[0].timestamp.isoformat()
+
+
+@pytest.fixture(params=[True, False], ids=['numba', 'numpy'])
+def flag_path(request, monkeypatch):
+    """Run a local-check test through the JIT kernels and the NumPy fallback"""
+    monkeypatch.setattr(quality_control, 'NUMBA_AVAILABLE', request.param)
+
+
+def _local_failures(products: pd.DataFrame):
+    results = QualityControlSystem('p', 'd').run_local_data_checks(products)
+    return {(r.sku, r.rule_id) for r in results}
+
+
+def test_local_data_checks_match_sql_flags(flag_path):
+    # toys average 25, so the allowed band is 12.5-37.5; NULL category is its own group
+    products = pd.DataFrame({
+        'sku': ['A', 'B', None, 'D', 'E'],
+        'product_name': ['a', 'b', 'c', None, 'e'],
+        'price': [10.0, 40.0, None, 0.0, 7.0],
+        'category': ['toys', 'toys', None, None, 'food'],
+        'description': ['x' * 60, 'short', None, 'y' * 50, np.nan],
+    })
+
+    assert _local_failures(products) == {
+        ('A', 'DATA003'),
+        ('B', 'DATA002'), ('B', 'DATA003'),
+        (None, 'DATA001'),
+        ('D', 'DATA001'),
+    }
+
+
+def test_local_data_checks_with_all_missing_descriptions(flag_path):
+    products = pd.DataFrame({
+        'sku': ['A', 'B'],
+        'product_name': ['a', 'b'],
+        'price': [10.0, 11.0],
+        'category': ['toys', 'toys'],
+        'description': [np.nan, np.nan],
+    })
+
+    assert _local_failures(products) == set()
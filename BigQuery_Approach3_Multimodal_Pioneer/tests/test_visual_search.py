@@ -0,0 +1,124 @@
+"""
+Tests for the visual search query builders and result cache
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from visual_search import VisualSearchEngine, VisualSearchQuery  # noqa: E402
+
+EMBEDDINGS = {
+    'gs://b/shoe.jpg': (1.0, 0.0, 0.0),
+    'gs://b/shoe_copy.jpg': (1.0, 0.0, 0.01),
+    'gs://b/hat.jpg': (0.0, 1.0, 0.0),
+}
+
+
+class _SearchClient:
+    """Stands in for bigquery.Client; every search returns both shoe images' products"""
+
+    def __init__(self):
+        self.queries = []
+
+    def query_and_wait(self, sql, job_config=None):
+        self.queries.append({
+            p.name: p.values if hasattr(p, 'values') else p.value for p in job_config.query_parameters
+        })
+        return [SimpleNamespace(sku='SHOE', image_uri='gs://b/shoe.jpg'),
+                SimpleNamespace(sku='SHOE2', image_uri='gs://b/shoe_copy.jpg'),
+                SimpleNamespace(sku='BOOT', image_uri='gs://b/boot.jpg')]
+
+
+def _engine() -> VisualSearchEngine:
+    engine = VisualSearchEngine('project', 'dataset')
+    engine.__dict__['client'] = _SearchClient()
+    engine._query_emb_cache = EMBEDDINGS.__getitem__
+    return engine
+
+
+def test_search_excludes_own_image_and_reuses_exact_hits():
+    engine = _engine()
+
+    first = engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/shoe.jpg'))
+    second = engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/shoe.jpg'))
+
+    assert first == second == ['SHOE2', 'BOOT']
+    assert len(engine.client.queries) == 1
+    # The cached rows are fetched without the query image excluded
+    assert engine.client.queries[0]['image_uri'] is None
+
+
+def test_near_duplicate_hit_reapplies_exclusion_for_current_image():
+    engine = _engine()
+
+    engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/shoe.jpg'))
+    skus = engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/shoe_copy.jpg'))
+
+    assert skus == ['SHOE', 'BOOT']
+    assert len(engine.client.queries) == 1
+
+
+def test_dissimilar_image_or_different_filters_miss_the_cache():
+    engine = _engine()
+
+    engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/shoe.jpg'))
+    engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/hat.jpg'))
+    engine.search_similar_skus(VisualSearchQuery(image_uri='gs://b/shoe.jpg', brand_filter=['Acme']))
+
+    assert len(engine.client.queries) == 3
+    assert engine.client.queries[2]['brands'] == ['Acme']
+
+
+def _param_values(params):
+    return {p.name: p.values if hasattr(p, 'values') else p.value for p in params}
+
+
+def test_visual_search_query_binds_filters_as_parameters():
+    engine = VisualSearchEngine('project', 'dataset')
+    query = VisualSearchQuery(
+        image_uri="gs://b/o'brien.jpg",
+        category_filter=['shoes'],
+        brand_filter=["O'Brien"],
+        price_range=(10.0, 50.0),
+        color_filter=['red'],
+    )
+    embedding = np.zeros(1024)
+    embedding[0] = 3.0
+
+    sql, params = engine.build_visual_search_query(query, query_embedding=embedding)
+    values = _param_values(params)
+
+    assert "O'Brien" not in sql and "o'brien" not in sql
+    for name in ('categories', 'brands', 'price_min', 'price_max', 'colors', 'image_uri'):
+        assert f"@{name}" in sql
+    assert values['brands'] == ["O'Brien"]
+    assert (values['price_min'], values['price_max']) == (10.0, 50.0)
+    assert values['image_uri'] == "gs://b/o'brien.jpg"
+    assert len(values['query_embedding']) == 1024
+    assert values['query_embedding_short'][:2] == [1.0, 0.0]
+
+
+def test_unfiltered_visual_search_binds_only_embeddings_and_image():
+    engine = VisualSearchEngine('project', 'dataset')
+
+    _, params = engine.build_visual_search_query(VisualSearchQuery(), query_embedding=np.ones(8))
+
+    assert set(_param_values(params)) == {'query_embedding', 'query_embedding_short', 'image_uri'}
+
+
+def test_outfit_query_binds_subcategory_lists_as_arrays():
+    engine = VisualSearchEngine('project', 'dataset')
+
+    sql, params = engine.find_outfit_combinations('SKU1', 'casual')
+    values = _param_values(params)
+
+    assert values['base_sku'] == 'SKU1'
+    assert values['tops'] == ['t-shirt', 'shirt', 'blouse', 'sweater']
+    for name in ('base_sku', 'tops', 'bottoms', 'footwear', 'accessories'):
+        assert f"@{name}" in sql
+    assert "'t-shirt'" not in sql